@@ -111,7 +111,7 @@ _subscription_manager_list()
               --ondate --servicelevel
               --match-installed --no-overlap
               --matches
-              --pool-only
+              --pool-only --cached
               ${_subscription_manager_common_opts}"
   COMPREPLY=($(compgen -W "${opts}" -- ${1}))
 }
@@ -123,3 +123,106 @@ class GhettoBitStream(object):
         copy = data[:]
         copy.reverse()
         return sum(x << n * 8 for n, x in enumerate(copy))
+
+
+class BitStream(object):
+    """
+    Accepts binary data and makes it available as a stream of bits or one byte
+    at a time, like GhettoBitStream. Instead of converting each byte into a
+    string of '0' and '1' characters, bits are buffered in an int so that
+    several of them can be peeked at and consumed at once.
+    """
+
+    def __init__(self, data):
+        """
+        :param data:    binary data in a string
+        :type  data:    str
+        """
+        self.bytes = bytearray(data)
+        self._byte_pos = 0
+        # bits read from self.bytes, but not yet consumed
+        self._buffer = 0
+        self._buffer_bits = 0
+
+    @property
+    def remaining(self):
+        """
+        :return:    number of bits not yet consumed
+        :rtype:     int
+        """
+        return self._buffer_bits + 8 * (len(self.bytes) - self._byte_pos)
+
+    def pop_byte(self):
+        """
+        :return:    next entire byte in the stream, as an int
+        :rtype:     int
+        """
+        byte = self.bytes[self._byte_pos]
+        self._byte_pos += 1
+        return byte
+
+    def peek(self, count):
+        """
+        Look at the next bits in the stream without consuming them. If fewer
+        than count bits are left, the missing bits are returned as zeros.
+
+        :param count:   number of bits to look at
+        :type  count:   int
+        :return:        the next count bits as a big-endian unsigned int
+        :rtype:         int
+        """
+        while self._buffer_bits < count and self._byte_pos < len(self.bytes):
+            self._buffer = (self._buffer << 8) | self.bytes[self._byte_pos]
+            self._byte_pos += 1
+            self._buffer_bits += 8
+        if self._buffer_bits >= count:
+            return self._buffer >> (self._buffer_bits - count)
+        return self._buffer << (count - self._buffer_bits)
+
+    def skip(self, count):
+        """
+        Consume the next bits in the stream.
+
+        :param count:   number of bits to consume
+        :type  count:   int
+        :return:        False if the stream ended before count bits could be
+                        consumed, else True
+        :rtype:         bool
+        """
+        if count > self._buffer_bits:
+            self.peek(count)
+            if count > self._buffer_bits:
+                self._buffer = 0
+                self._buffer_bits = 0
+                return False
+        self._buffer_bits -= count
+        self._buffer &= (1 << self._buffer_bits) - 1
+        return True
+
+    def read(self, count):
+        """
+        :param count:   number of bits to read
+        :type  count:   int
+        :return:        the next count bits as a big-endian unsigned int
+        :rtype:         int
+        """
+        value = self.peek(count)
+        self.skip(count)
+        return value
+
+    @staticmethod
+    def combine_bytes(data):
+        """
+        combine unsigned ints read from a bit stream into one unsigned number,
+        reading data as big-endian
+
+        :param data:    iterable of positive ints, each representing a byte
+        :type  data:    iterable of positive ints
+        :return:        positive int, composed from input bytes combined as
+                        one int
+        :rtype:         int
+        """
+        value = 0
+        for byte in data:
+            value = (value << 8) | byte
+        return value
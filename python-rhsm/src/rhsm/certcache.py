@@ -0,0 +1,262 @@
+#
+# Copyright (c) 2017 Red Hat, Inc.
+#
+# This software is licensed to you under the GNU General Public License,
+# version 2 (GPLv2). There is NO WARRANTY for this software, express or
+# implied, including the implied warranties of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. You should have received a copy of GPLv2
+# along with this software; if not, see
+# http://www.gnu.org/licenses/old-licenses/gpl-2.0.txt.
+#
+# Red Hat trademarks are not licensed under GPLv2. No permission is
+# granted to use or replicate Red Hat trademarks that are incorporated
+# in this software or its documentation.
+#
+"""
+Persistent cache of parsed certificates.
+
+Parsing a certificate (loading the X509, walking its extensions and
+decompressing the v3 entitlement payload) is by far the most expensive
+part of listing a certificate directory, and the same unchanged files are
+parsed again by every yum/dnf transaction and every subscription-manager
+command. This module stores the parsed model of each certificate in a
+small JSON file per directory, keyed by the file's path and validated
+against its size, mtime, inode and the sha256 of its contents, so that
+unchanged certificates can be restored without touching OpenSSL.
+"""
+
+import base64
+import errno
+import hashlib
+import logging
+import os
+import tempfile
+
+import dateutil.parser
+
+from rhsm import ourjson as json
+from rhsm.certificate import Extensions, OID
+from rhsm.certificate2 import IdentityCertificate, ProductCertificate, \
+        EntitlementCertificate, Product, Order, Content, Pool, Version
+
+log = logging.getLogger(__name__)
+
+DEFAULT_CACHE_DIR = "/var/lib/rhsm/cache/certs"
+
+# Bumped whenever the serialized format below changes, older caches are
+# then simply discarded.
+CACHE_FORMAT = 1
+
+PRODUCT_FIELDS = ('id', 'name', 'version', 'architectures', 'provided_tags',
+        'brand_type', 'brand_name')
+ORDER_FIELDS = ('name', 'number', 'sku', 'subscription', 'quantity',
+        'virt_limit', 'socket_limit', 'contract', 'quantity_used',
+        'warning_period', 'account', 'provides_management', 'service_level',
+        'service_type', 'stacking_id', 'virt_only', 'ram_limit', 'core_limit')
+CONTENT_FIELDS = ('content_type', 'name', 'label', 'vendor', 'url', 'gpg',
+        'enabled', 'metadata_expire', 'required_tags', 'arches')
+
+
+def _fields(obj, names):
+    return dict((name, getattr(obj, name)) for name in names)
+
+
+def _kwargs(data):
+    # keyword arguments must be str on python 2
+    return dict((str(key), value) for (key, value) in data.items())
+
+
+class CertificateCache(object):
+    """
+    Parsed certificate models for the files of one certificate directory.
+
+    Entries are looked up with :meth:`get` and added with :meth:`put` while
+    the directory is being listed, :meth:`save` then writes back only the
+    entries that were used, so certificates removed from the directory are
+    dropped from the cache as well.
+    """
+
+    def __init__(self, cache_file):
+        self.cache_file = cache_file
+        self._entries = None
+        self._used = {}
+        self._dirty = False
+
+    @classmethod
+    def for_directory(cls, cert_dir, cache_dir=DEFAULT_CACHE_DIR):
+        """
+        Return the cache used for the certificates in cert_dir.
+
+        :param cert_dir: the certificate directory
+        :type cert_dir: str
+        :param cache_dir: directory holding the cache files
+        :type cache_dir: str
+        :rtype: CertificateCache
+        """
+        name = os.path.abspath(cert_dir).strip(os.sep).replace(os.sep, '_')
+        return cls(os.path.join(cache_dir, (name or 'root') + '.json'))
+
+    @staticmethod
+    def stamp(path, pem, stat=None):
+        """
+        Identify the contents of a certificate file.
+
+        :param path: path of the certificate file
+        :param pem: contents of the file
+        :param stat: os.stat result for the file, stat'ed if not given
+        :return: [size, mtime, inode, sha256 hex digest]
+        :rtype: list
+        """
+        if stat is None:
+            stat = os.stat(path)
+        if not isinstance(pem, bytes):
+            pem = pem.encode('utf-8')
+        return [stat.st_size, stat.st_mtime, stat.st_ino,
+                hashlib.sha256(pem).hexdigest()]
+
+    def get(self, path, stamp):
+        """
+        Return the certificate cached for path, or None if there is no entry
+        or the file changed since it was cached.
+        """
+        entry = self._load().get(path)
+        if entry is None or entry.get('stamp') != stamp:
+            return None
+        try:
+            cert = self._restore(path, entry['cert'])
+        except Exception as e:
+            log.debug("Ignoring unusable cache entry for %s: %s" % (path, e))
+            return None
+        self._used[path] = entry
+        return cert
+
+    def put(self, path, stamp, cert):
+        """
+        Remember the parsed certificate for path.
+        """
+        try:
+            data = self._serialize(cert)
+        except Exception as e:
+            log.debug("Not caching certificate %s: %s" % (path, e))
+            return
+        self._used[path] = {'stamp': stamp, 'cert': data}
+        self._dirty = True
+
+    def save(self):
+        """
+        Write the entries used since the cache was loaded back to disk.
+
+        Nothing is written if no entry changed. Failures are logged and
+        otherwise ignored, the cache is only an optimization.
+        """
+        entries = self._load()
+        if not self._dirty and len(self._used) == len(entries):
+            self._used = {}
+            return
+        self._entries = self._used
+        self._used = {}
+        self._dirty = False
+
+        cache_dir = os.path.dirname(self.cache_file)
+        try:
+            # Only create our own subdirectory, a missing /var/lib/rhsm/cache
+            # means we are not running on an installed system.
+            if not os.path.isdir(cache_dir):
+                if not os.path.isdir(os.path.dirname(cache_dir)):
+                    return
+                os.mkdir(cache_dir, 0o750)
+            fd, tmp_path = tempfile.mkstemp(dir=cache_dir, prefix='.certcache')
+            try:
+                f = os.fdopen(fd, 'w')
+                try:
+                    json.dump({'format': CACHE_FORMAT, 'entries': self._entries}, f)
+                finally:
+                    f.close()
+                os.rename(tmp_path, self.cache_file)
+            except Exception:
+                os.unlink(tmp_path)
+                raise
+        except (IOError, OSError) as e:
+            if e.errno not in (errno.EACCES, errno.EPERM, errno.EROFS):
+                log.warning("Unable to write certificate cache %s: %s" %
+                        (self.cache_file, e))
+
+    def _load(self):
+        if self._entries is None:
+            self._entries = {}
+            try:
+                f = open(self.cache_file)
+                try:
+                    data = json.load(f)
+                finally:
+                    f.close()
+                if data.get('format') == CACHE_FORMAT:
+                    self._entries = data['entries']
+            except IOError as e:
+                if e.errno != errno.ENOENT:
+                    log.debug("Unable to read certificate cache %s: %s" %
+                            (self.cache_file, e))
+            except ValueError as e:
+                log.debug("Ignoring corrupt certificate cache %s: %s" %
+                        (self.cache_file, e))
+        return self._entries
+
+    def _serialize(self, cert):
+        data = {
+            'version': str(cert.version),
+            'serial': cert.serial,
+            'start': cert.start.isoformat(),
+            'end': cert.end.isoformat(),
+            'subject': cert.subject,
+            'issuer': cert.issuer,
+        }
+        if isinstance(cert, IdentityCertificate):
+            data['type'] = 'identity'
+            data['alt_name'] = cert.alt_name
+            return data
+
+        data['products'] = [_fields(p, PRODUCT_FIELDS) for p in cert.products]
+        if not isinstance(cert, EntitlementCertificate):
+            data['type'] = 'product'
+            return data
+
+        data['type'] = 'entitlement'
+        data['extensions'] = dict((str(oid), base64.b64encode(value).decode('ascii'))
+                for (oid, value) in cert.extensions.items())
+        if cert.order is not None:
+            data['order'] = _fields(cert.order, ORDER_FIELDS)
+        if cert.content is not None:
+            data['content'] = [_fields(c, CONTENT_FIELDS) for c in cert.content]
+        if cert.pool is not None:
+            data['pool'] = cert.pool.id
+        return data
+
+    def _restore(self, path, data):
+        version = Version(data['version'])
+        kwargs = {
+            'path': path,
+            'version': version,
+            'serial': data['serial'],
+            'start': dateutil.parser.parse(data['start']),
+            'end': dateutil.parser.parse(data['end']),
+            'subject': data['subject'],
+            'issuer': data['issuer'],
+        }
+        cert_type = data['type']
+        if cert_type == 'identity':
+            return IdentityCertificate(alt_name=data['alt_name'], **kwargs)
+
+        kwargs['products'] = [Product(**_kwargs(p)) for p in data['products']]
+        if cert_type == 'product':
+            return ProductCertificate(**kwargs)
+
+        if 'order' in data:
+            kwargs['order'] = Order(**_kwargs(data['order']))
+        if 'content' in data:
+            kwargs['content'] = [Content(**_kwargs(c)) for c in data['content']]
+        if 'pool' in data:
+            kwargs['pool'] = Pool(data['pool'])
+        kwargs['extensions'] = Extensions(dict(
+                (OID(str(oid)), base64.b64decode(value))
+                for (oid, value) in data['extensions'].items()))
+        return EntitlementCertificate(**kwargs)
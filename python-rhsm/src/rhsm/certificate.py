@@ -50,9 +50,9 @@ VALUE_PATTERN = re.compile('.*prim:\s(\w*)\s*:*(.*)')
 # the certificate2 module. They are placed here to abstract the fact that
 # we're using two modules for the time being. Eventually the certificate2 code
 # should be moved here.
-def create_from_file(path):
+def create_from_file(path, cache=None):
     from rhsm.certificate2 import _CertFactory  # prevent circular deps
-    return _CertFactory().create_from_file(path)
+    return _CertFactory().create_from_file(path, cache=cache)
 
 
 def create_from_pem(pem):
@@ -30,6 +30,7 @@ from rhsm.connection import safe_int
 from rhsm.certificate import Extensions, OID, DateRange, GMT, \
         get_datetime_from_x509, parse_tags, CertificateException
 from rhsm.pathtree import PathTree
+from rhsm.utils import LRUCache
 from rhsm import ourjson as json
 
 REDHAT_OID_NAMESPACE = "1.3.6.1.4.1.2312.9"
@@ -61,16 +62,41 @@ class _CertFactory(object):
     certificate.py instead of this class.
     """
 
-    def create_from_file(self, path):
+    def create_from_file(self, path, cache=None):
         """
         Create appropriate certificate object from a PEM file on disk.
+
+        If a rhsm.certcache.CertificateCache is given, an unchanged file is
+        restored from it instead of being parsed, and newly parsed
+        certificates are added to it.
         """
         try:
-            pem = open(path, 'r').read()
+            f = open(path, 'r')
+            try:
+                pem = f.read()
+                stat = os.fstat(f.fileno())
+            finally:
+                f.close()
         except IOError as e:
             print(os.strerror(e.errno))
             exit(1)
-        return self._read_x509(_certificate.load(path), path, pem)
+
+        if cache is None:
+            return self._read_x509(_certificate.load(path), path, pem)
+
+        stamp = cache.stamp(path, pem, stat)
+        cert = cache.get(path, stamp)
+        if cert is not None:
+            # The X509 object is only needed by a few callers, load it
+            # from the pem we already have when first used.
+            cert._x509_pem = pem
+            if cert.version.major == 3:
+                cert.pem = pem
+            return cert
+
+        cert = self._read_x509(_certificate.load(path), path, pem)
+        cache.put(path, stamp, cert)
+        return cert
 
     def create_from_pem(self, pem, path=None):
         """
@@ -432,7 +458,10 @@ class Certificate(object):
 
         # The rhsm._certificate X509 object for this certificate.
         # WARNING: May be None in tests
-        self.x509 = x509
+        self._x509 = x509
+        # pem to load the X509 object from on first use, set for
+        # certificates restored from rhsm.certcache
+        self._x509_pem = None
 
         # Full file path to the certificate on disk. May be None if the cert
         # hasn't yet been written to disk.
@@ -456,6 +485,18 @@ class Certificate(object):
         self.subject = subject
         self.issuer = issuer
 
+    @property
+    def x509(self):
+        if self._x509 is None and self._x509_pem is not None:
+            self._x509 = _certificate.load(pem=self._x509_pem)
+            self._x509_pem = None
+        return self._x509
+
+    @x509.setter
+    def x509(self, x509):
+        self._x509 = x509
+        self._x509_pem = None
+
     def is_valid(self, on_date=None):
         gmt = datetime.utcnow()
         if on_date:
@@ -520,6 +561,9 @@ class ProductCertificate(Certificate):
 
 class EntitlementCertificate(ProductCertificate):
 
+    # number of recent check_path results remembered per certificate
+    CHECK_PATH_CACHE_SIZE = 256
+
     def __init__(self, order=None, content=None, pool=None, extensions=None, **kwargs):
         ProductCertificate.__init__(self, **kwargs)
         self.order = order
@@ -527,6 +571,7 @@ class EntitlementCertificate(ProductCertificate):
         self.pool = pool
         self.extensions = extensions
         self._path_tree_object = None
+        self._check_path_cache = LRUCache(self.CHECK_PATH_CACHE_SIZE)
 
     @property
     def entitlement_type(self):
@@ -572,14 +617,23 @@ class EntitlementCertificate(ProductCertificate):
         :raise:    ValueError when self.version.major < 3
         """
 
+        # The same few paths tend to be checked over and over (once per
+        # request for content), so remember recent results.
+        result = self._check_path_cache.get(path)
+        if result is None:
+            result = self._check_path_uncached(path)
+            self._check_path_cache[path] = result
+        return result
+
+    def _check_path_uncached(self, path):
         # squash double '//' if we get it in a content path
         # NOTE: according to http://tools.ietf.org/html/rfc3986#section-3.3
         # I think this technically changes the semantics of the url
-        path = posixpath.normpath(path)
+        normalized_path = posixpath.normpath(path)
         if self.version.major < 3:
-            return self._check_v1_path(path)
+            return self._check_v1_path(normalized_path)
         else:
-            return self._path_tree.match_path(path)
+            return self._path_tree.match_path(normalized_path)
 
     def _check_v1_path(self, path):
         """
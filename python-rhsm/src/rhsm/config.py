@@ -67,6 +67,10 @@ RHSM_DEFAULTS = {
         'manage_repos': '1',
         'full_refresh_on_yum': '0',
         'report_package_profile': '1',
+        'cert_download_batch_size': '20',
+        'cert_download_threads': '4',
+        'pool_cache_ttl': '300',
+        'pool_cache_background_refresh': '0',
         'plugindir': '/usr/share/rhsm-plugins',
         'pluginconfdir': '/etc/rhsm/pluginconf.d'
         }
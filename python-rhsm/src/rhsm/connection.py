@@ -21,9 +21,12 @@ import dateutil.parser
 import locale
 import logging
 import os
+import select
 import socket
 import sys
+import threading
 import time
+import zlib
 from email.utils import formatdate
 
 from rhsm.https import httplib, ssl
@@ -47,9 +50,16 @@ except ImportError:
 
 from rhsm import ourjson as json
 from rhsm import utils
+from rhsm.servercache import ServerInfoCache, server_version
 
 config = initConfig()
 
+# Servers with this capability accept gzip compressed request bodies.
+GZIP_REQUEST_CAPABILITY = "gzip_request"
+
+# Requests which can be sent again if their response was lost.
+IDEMPOTENT_METHODS = ("GET", "HEAD")
+
 
 def safe_int(value, safe_value=None):
     try:
@@ -230,6 +240,181 @@ def _encode_auth(username, password):
     return 'Basic %s' % encoded
 
 
+def _file_stamp(path):
+    """
+    Returns a (path, inode, mtime, size) tuple identifying the current
+    version of a file, or None if the file does not exist.
+    """
+    if not path:
+        return None
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return (path, st.st_ino, st.st_mtime, st.st_size)
+
+
+def _response_validators(headers):
+    """
+    Returns the cache validators (ETag and Last-Modified) of a response as
+    a dict, with None for the ones the server did not send.
+    """
+    lowered = dict((name.lower(), value) for (name, value) in (headers or {}).items())
+    return {'etag': lowered.get('etag'),
+            'last_modified': lowered.get('last-modified')}
+
+
+def _decompress(content, encoding):
+    """
+    Returns the response body content with the given Content-Encoding
+    undone.
+    """
+    encoding = (encoding or '').strip().lower()
+    if not content or encoding in ('', 'identity'):
+        return content
+    if encoding in ('gzip', 'x-gzip'):
+        return zlib.decompress(content, 16 + zlib.MAX_WBITS)
+    if encoding == 'deflate':
+        try:
+            return zlib.decompress(content)
+        except zlib.error:
+            # some servers send raw deflate data without the zlib header
+            return zlib.decompress(content, -zlib.MAX_WBITS)
+    log.warn("Unsupported response content encoding: %s" % encoding)
+    return content
+
+
+def _gzip(body):
+    """
+    Returns body compressed in the gzip format.
+    """
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    return compressor.compress(body) + compressor.flush()
+
+
+def _dir_fingerprint(dir_path):
+    """
+    Returns a fingerprint of all the *.pem files in a directory, which
+    changes whenever one of them is added, removed or rewritten.
+    """
+    try:
+        names = sorted(os.listdir(dir_path))
+    except (OSError, TypeError):
+        return None
+    return tuple(_file_stamp(os.path.join(dir_path, name))
+                 for name in names if name.endswith(".pem"))
+
+
+class _SSLContextCache(object):
+    """
+    Process wide cache of SSL contexts.
+
+    Loading the CA certificates and client certificate into a context is
+    expensive, so contexts are shared between all the connections using
+    the same settings. A cached context is only used while the fingerprint
+    of the files it was built from still matches.
+    """
+    def __init__(self):
+        self._contexts = {}
+        self._lock = threading.Lock()
+
+    def get(self, key, fingerprint, factory):
+        with self._lock:
+            cached = self._contexts.get(key)
+        if cached is not None and cached[0] == fingerprint:
+            return cached[1]
+
+        log.debug("Creating SSL context for %s" % (key,))
+        context = factory()
+        with self._lock:
+            self._contexts[key] = (fingerprint, context)
+        return context
+
+    def clear(self):
+        with self._lock:
+            self._contexts.clear()
+
+
+_ssl_contexts = _SSLContextCache()
+
+# Resources and capabilities of the servers, shared with other processes.
+_server_info = ServerInfoCache()
+
+# Disable SSLv2 and SSLv3 support to avoid poodles.
+_SSL_OPTIONS = ssl.OP_NO_SSLv2 | ssl.OP_NO_SSLv3
+
+
+def _connection_dropped(conn):
+    """
+    Check if the server has closed an idle keep-alive connection.
+
+    An idle connection should never have anything to read, so a readable
+    socket means the server sent EOF (or garbage) and the connection can
+    not be reused.
+    """
+    # The m2crypto HTTPSConnection wrapper keeps the real connection
+    # in _connection.
+    sock = getattr(getattr(conn, '_connection', conn), 'sock', None)
+    if sock is None:
+        return True
+    try:
+        readable, _, _ = select.select([sock], [], [], 0)
+    except (select.error, socket.error, ValueError):
+        return True
+    return bool(readable)
+
+
+class _HTTPSConnectionPool(object):
+    """
+    A small pool of HTTP/1.1 keep-alive connections to a single server.
+
+    Connections are built by the given factory and handed out to one
+    caller at a time. Callers return a connection with put() once its
+    response has been read completely, so that the next request can reuse
+    it without another TLS handshake.
+    """
+    def __init__(self, factory, max_idle=4):
+        self.factory = factory
+        self.max_idle = max_idle
+        self.handshakes = 0
+        self.reused_requests = 0
+        self._idle = []
+        self._lock = threading.Lock()
+
+    def create(self):
+        with self._lock:
+            self.handshakes += 1
+        return self.factory()
+
+    def get(self):
+        """
+        Returns a (connection, reused) tuple, preferring an idle connection
+        over a new one.
+        """
+        with self._lock:
+            while self._idle:
+                conn = self._idle.pop()
+                if _connection_dropped(conn):
+                    conn.close()
+                    continue
+                self.reused_requests += 1
+                return conn, True
+        return self.create(), False
+
+    def put(self, conn):
+        with self._lock:
+            if len(self._idle) < self.max_idle:
+                self._idle.append(conn)
+                return
+        conn.close()
+
+    def clear(self):
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for conn in idle:
+            conn.close()
+
+
 # FIXME: this is terrible, we need to refactor
 # Restlib to be Restlib based on a https client class
 class ContentConnection(object):
@@ -278,14 +463,21 @@ class ContentConnection(object):
     def user_agent(self):
         return "RHSM-content/1.0 (cmd=%s)" % utils.cmd_name(sys.argv)
 
-    def _request(self, request_type, handler, body=None, headers=None):
-        # See note in Restlib._request
+    def _create_ssl_context(self):
+        # See note in Restlib._create_ssl_context
         context = ssl.SSLContext(ssl.PROTOCOL_SSLv23)
-
-        # Disable SSLv2 and SSLv3 support to avoid poodles.
-        context.options = ssl.OP_NO_SSLv2 | ssl.OP_NO_SSLv3
+        context.options = _SSL_OPTIONS
 
         self._load_ca_certificates(context)
+        return context
+
+    def _get_ssl_context(self):
+        key = ('content', self.ent_dir, _SSL_OPTIONS)
+        return _ssl_contexts.get(key, _dir_fingerprint(self.ent_dir),
+                                 self._create_ssl_context)
+
+    def _request(self, request_type, handler, body=None, headers=None):
+        context = self._get_ssl_context()
 
         if self.proxy_hostname and self.proxy_port:
             log.debug("Using proxy: %s:%s" % (self.proxy_hostname, self.proxy_port))
@@ -391,6 +583,7 @@ class BaseRestLib(object):
 
         self.headers = {"Content-type": "application/json",
                         "Accept": "application/json",
+                        "Accept-Encoding": "gzip, deflate",
                         "x-python-rhsm-version": python_rhsm_version,
                         "x-subscription-manager-version": subman_version}
 
@@ -417,6 +610,31 @@ class BaseRestLib(object):
         if username and password:
             self.headers['Authorization'] = _encode_auth(username, password)
 
+        self._ssl_context = None
+        self._pool = _HTTPSConnectionPool(self._create_connection)
+
+        # ETag/Last-Modified of the last response per resource, used by
+        # request_get_if_changed() when the caller has none of its own.
+        self.validators = {}
+
+    @property
+    def handshakes(self):
+        """Number of new connections (and so TLS handshakes) made."""
+        return self._pool.handshakes
+
+    @property
+    def reused_requests(self):
+        """Number of requests sent over an already open connection."""
+        return self._pool.reused_requests
+
+    def close(self):
+        """
+        Close all idle keep-alive connections to the server.
+        """
+        log.debug("Closing connections to %s:%s, handshakes=%s reused_requests=%s" %
+                  (self.host, self.ssl_port, self.handshakes, self.reused_requests))
+        self._pool.clear()
+
     def _load_ca_certificates(self, context):
         loaded_ca_certs = []
         try:
@@ -433,10 +651,7 @@ class BaseRestLib(object):
         if loaded_ca_certs:
             log.debug("Loaded CA certificates from %s: %s" % (self.ca_dir, ', '.join(loaded_ca_certs)))
 
-    # FIXME: can method be empty?
-    def _request(self, request_type, method, info=None, headers=None):
-        handler = self.apihandler + method
-
+    def _create_ssl_context(self):
         # See M2Crypto/SSL/Context.py in m2crypto source and
         # https://www.openssl.org/docs/ssl/SSL_CTX_new.html
         # This ends up invoking SSLv23_method, which is the catch all
@@ -447,9 +662,7 @@ class BaseRestLib(object):
         #
         # So this supports tls1.2, 1.1, 1.0, and/or sslv3 if supported.
         context = ssl.SSLContext(ssl.PROTOCOL_SSLv23)
-
-        # Disable SSLv2 and SSLv3 support to avoid poodles.
-        context.options = ssl.OP_NO_SSLv2 | ssl.OP_NO_SSLv3
+        context.options = _SSL_OPTIONS
 
         if self.insecure:  # allow clients to work insecure mode if required..
             context.verify_mode = ssl.CERT_NONE
@@ -460,6 +673,31 @@ class BaseRestLib(object):
         if self.cert_file and os.path.exists(self.cert_file):
             context.load_cert_chain(self.cert_file, keyfile=self.key_file)
 
+        return context
+
+    def _get_ssl_context(self):
+        """
+        Returns the (shared) SSL context for this connection. It is only
+        rebuilt when the client certificate, key or CA certificates change
+        on disk.
+        """
+        key = ('uep', self.ca_dir, self.cert_file, self.key_file,
+               bool(self.insecure), _SSL_OPTIONS)
+        fingerprint = (_file_stamp(self.cert_file), _file_stamp(self.key_file))
+        if not self.insecure:
+            fingerprint += (_dir_fingerprint(self.ca_dir),)
+        context = _ssl_contexts.get(key, fingerprint, self._create_ssl_context)
+
+        if context is not self._ssl_context:
+            if self._ssl_context is not None:
+                # Open connections were set up with the old certificates
+                log.debug("SSL certificates changed, dropping open connections")
+                self._pool.clear()
+            self._ssl_context = context
+        return context
+
+    def _create_connection(self):
+        context = self._get_ssl_context()
         if self.proxy_hostname and self.proxy_port:
             log.debug("Using proxy: %s:%s" % (self.proxy_hostname, self.proxy_port))
             proxy_headers = {'User-Agent': self.user_agent}
@@ -469,12 +707,69 @@ class BaseRestLib(object):
             conn.set_tunnel(self.host, safe_int(self.ssl_port), proxy_headers)
         else:
             conn = httplib.HTTPSConnection(self.host, self.ssl_port, context=context, timeout=self.timeout)
+        return conn
+
+    def _send_request(self, request_type, handler, body, headers):
+        """
+        Send a request over a pooled connection and read the whole response.
+
+        If a reused keep-alive connection turns out to have been closed by
+        the server, the request is retried once on a new connection. Once
+        the request was sent the server may have acted on it already, so a
+        failure to read the response is only retried for GET and HEAD.
+
+        Returns a (response, content) tuple.
+        """
+        conn, reused = self._pool.get()
+        try:
+            sent = False
+            try:
+                conn.request(request_type, handler, body=body, headers=headers)
+                sent = True
+                response = conn.getresponse()
+            except (httplib.BadStatusLine, socket.error) as e:
+                if not reused or isinstance(e, ssl.SSLError):
+                    raise
+                if sent and request_type not in IDEMPOTENT_METHODS:
+                    raise
+                log.debug("Connection was closed by the server, reconnecting: %s" % e)
+                conn.close()
+                conn = self._pool.create()
+                conn.request(request_type, handler, body=body, headers=headers)
+                response = conn.getresponse()
+            content = response.read()
+        except Exception:
+            conn.close()
+            raise
+
+        if getattr(response, 'will_close', True):
+            conn.close()
+        else:
+            self._pool.put(conn)
+        return response, content
+
+    # FIXME: can method be empty?
+    def _request(self, request_type, method, info=None, headers=None, compress=False):
+        handler = self.apihandler + method
+
+        # Make sure the SSL context matches the current client cert before
+        # picking a connection from the pool.
+        self._get_ssl_context()
 
         if info is not None:
             body = json.dumps(info, default=json.encode)
         else:
             body = None
 
+        if compress and body is not None:
+            if not isinstance(body, bytes):
+                body = body.encode('utf-8')
+            size = len(body)
+            body = _gzip(body)
+            log.debug("Compressed request body from %s to %s bytes" % (size, len(body)))
+            headers = dict(headers or {})
+            headers["Content-Encoding"] = "gzip"
+
         log.debug("Making request: %s %s" % (request_type, handler))
 
         if self.user_agent:
@@ -487,7 +782,7 @@ class BaseRestLib(object):
             final_headers.update(headers)
 
         try:
-            conn.request(request_type, handler, body=body, headers=final_headers)
+            response, content = self._send_request(request_type, handler, body, final_headers)
         except ssl.SSLError:
             if self.cert_file:
                 id_cert = certificate.create_from_file(self.cert_file)
@@ -498,9 +793,13 @@ class BaseRestLib(object):
             if str(e)[-3:] == str(httplib.PROXY_AUTHENTICATION_REQUIRED):
                 raise ProxyException(e)
             raise
-        response = conn.getresponse()
+        encoding = response.getheader('content-encoding')
+        if encoding:
+            size = len(content)
+            content = _decompress(content, encoding)
+            log.debug("Decompressed %s response from %s to %s bytes" % (encoding, size, len(content)))
         result = {
-            "content": response.read().decode('utf-8'),
+            "content": content.decode('utf-8'),
             "status": response.status,
             "headers": dict(response.getheaders())
         }
@@ -604,17 +903,55 @@ class BaseRestLib(object):
         if 'errors' in body:
             return " ".join("%s" % errmsg for errmsg in body['errors'])
 
+    def _result_content(self, result):
+        """
+        Turn a validated response into what the request_* methods return.
+        """
+        return result
+
     def request_get(self, method, headers=None):
         return self._request("GET", method, headers=headers)
 
-    def request_post(self, method, params=None, headers=None):
-        return self._request("POST", method, params, headers=headers)
+    def request_get_if_changed(self, method, validators=None, headers=None):
+        """
+        Conditional GET of a resource.
+
+        The ETag and Last-Modified given in validators are sent as
+        If-None-Match and If-Modified-Since. When validators is None the ones
+        of the last response for the same resource are used, pass an empty
+        dict to fetch the resource unconditionally.
+
+        Returns None if the server answered 304 Not Modified, otherwise a
+        (content, validators) tuple where validators are the ones of the
+        new response.
+        """
+        if validators is None:
+            validators = self.validators.get(method) or {}
+        final_headers = {}
+        if validators.get('etag'):
+            final_headers['If-None-Match'] = validators['etag']
+        if validators.get('last_modified'):
+            final_headers['If-Modified-Since'] = validators['last_modified']
+        if headers:
+            final_headers.update(headers)
+
+        result = BaseRestLib._request(self, "GET", method, headers=final_headers)
+        if str(result['status']) == "304":
+            log.debug("Not modified: %s" % method)
+            return None
+
+        new_validators = _response_validators(result.get('headers'))
+        self.validators[method] = new_validators
+        return self._result_content(result), new_validators
+
+    def request_post(self, method, params=None, headers=None, compress=False):
+        return self._request("POST", method, params, headers=headers, compress=compress)
 
     def request_head(self, method, headers=None):
         return self._request("HEAD", method, headers=headers)
 
-    def request_put(self, method, params=None, headers=None):
-        return self._request("PUT", method, params, headers=headers)
+    def request_put(self, method, params=None, headers=None, compress=False):
+        return self._request("PUT", method, params, headers=headers, compress=compress)
 
     def request_delete(self, method, params=None, headers=None):
         return self._request("DELETE", method, params, headers=headers)
@@ -629,10 +966,12 @@ class Restlib(BaseRestLib):
      of communication with the server.
     """
 
-    def _request(self, request_type, method, info=None, headers=None):
+    def _request(self, request_type, method, info=None, headers=None, compress=False):
         result = super(Restlib, self)._request(request_type, method,
-            info=info, headers=headers)
+            info=info, headers=headers, compress=compress)
+        return self._result_content(result)
 
+    def _result_content(self, result):
         # Handle 204s
         if not len(result['content']):
             return None
@@ -790,14 +1129,22 @@ class UEPConnection:
         log.debug("Server supports the following resources: %s",
                   self.resources)
 
+    def _server_url(self):
+        return "https://%s:%s%s" % (self.host, self.ssl_port, self.handler)
+
     def supports_resource(self, resource_name):
         """
         Check if the server we're connecting too supports a particular
         resource. For our use cases this is generally the plural form
         of the resource.
+
+        The resources are cached on disk, see rhsm.servercache.
         """
+        if self.resources is None:
+            self.resources = _server_info.get(self._server_url(), 'resources')
         if self.resources is None:
             self._load_supported_resources()
+            _server_info.put(self._server_url(), 'resources', self.resources)
 
         return resource_name in self.resources
 
@@ -822,11 +1169,25 @@ class UEPConnection:
     def has_capability(self, capability):
         """
         Check if the server we're connected to has a particular capability.
+
+        The capabilities are cached on disk, see rhsm.servercache.
         """
+        if self.capabilities is None:
+            self.capabilities = _server_info.get(self._server_url(), 'capabilities')
         if self.capabilities is None:
             self.capabilities = self._load_manager_capabilities()
+            _server_info.put(self._server_url(), 'capabilities', self.capabilities)
         return capability in self.capabilities
 
+    def _compress_requests(self):
+        """
+        Check if request bodies can be sent gzip compressed. Does not load
+        the server capabilities just for this, as the extra request would
+        cost more than compressing saves.
+        """
+        return self.capabilities is not None and \
+            GZIP_REQUEST_CAPABILITY in self.capabilities
+
     def shutDown(self):
         self.conn.close()
         log.info("remote connection closed")
@@ -951,9 +1312,22 @@ class UEPConnection:
             params['serviceLevel'] = service_level
 
         method = "/consumers/%s" % self.sanitize(uuid)
-        ret = self.conn.request_put(method, params)
+        ret = self.conn.request_put(method, params, compress=self._compress_requests())
         return ret
 
+    def updateConsumerFactsDelta(self, consumer_uuid, changed, removed):
+        """
+        Updates only the facts that changed since the last update of the
+        consumer's facts on the server.
+
+        Only supported by servers with the "facts_delta" capability.
+        changed is a dict of the new and changed facts, removed a list of
+        the names of facts the system no longer has.
+        """
+        method = "/consumers/%s/facts/delta" % self.sanitize(consumer_uuid)
+        params = {'changed': changed, 'removed': removed}
+        return self.conn.request_post(method, params)
+
     def addOrUpdateGuestId(self, uuid, guestId):
         if isinstance(guestId, str) or isinstance(guestId, type(u"")):
             guest_uuid = guestId
@@ -996,7 +1370,21 @@ class UEPConnection:
         package headers we're interested in. See profile.py.
         """
         method = "/consumers/%s/packages" % self.sanitize(consumer_uuid)
-        ret = self.conn.request_put(method, pkg_dicts)
+        ret = self.conn.request_put(method, pkg_dicts, compress=self._compress_requests())
+        return ret
+
+    def updatePackageProfileDelta(self, consumer_uuid, added, removed):
+        """
+        Updates the consumer's package profile on the server with only the
+        packages installed and removed since the last update.
+
+        Only supported by servers with the "packages_delta" capability.
+        added and removed are lists of package dicts, as for
+        updatePackageProfile.
+        """
+        method = "/consumers/%s/packages/delta" % self.sanitize(consumer_uuid)
+        params = {'added': added, 'removed': removed}
+        ret = self.conn.request_post(method, params)
         return ret
 
     # FIXME: username and password not used here
@@ -1027,6 +1415,15 @@ class UEPConnection:
                     self.sanitize(on_date.isoformat(), plus=True))
         return self.conn.request_get(method)
 
+    def getComplianceIfChanged(self, uuid, validators=None):
+        """
+        Conditional version of getCompliance, see
+        BaseRestLib.request_get_if_changed for the arguments and the
+        return value.
+        """
+        method = '/consumers/%s/compliance' % self.sanitize(uuid)
+        return self.conn.request_get_if_changed(method, validators)
+
     def createOwner(self, ownerKey, ownerDisplayName=None):
         params = {"key": ownerKey}
         if ownerDisplayName:
@@ -1103,6 +1500,15 @@ class UEPConnection:
         method = '/consumers/%s/certificates/serials' % self.sanitize(consumerId)
         return self.conn.request_get(method)
 
+    def getCertificateSerialsIfChanged(self, consumerId, validators=None):
+        """
+        Conditional version of getCertificateSerials, see
+        BaseRestLib.request_get_if_changed for the arguments and the
+        return value.
+        """
+        method = '/consumers/%s/certificates/serials' % self.sanitize(consumerId)
+        return self.conn.request_get_if_changed(method, validators)
+
     def getAccessibleContent(self, consumerId, if_modified_since=None):
         """
         Get the content of the accessible content cert for a given consumer.
@@ -1357,7 +1763,11 @@ class UEPConnection:
 
     def getStatus(self):
         method = "/status"
-        return self.conn.request_get(method)
+        status = self.conn.request_get(method)
+        # an upgraded server may support other resources and capabilities
+        if isinstance(status, dict):
+            _server_info.check_version(self._server_url(), server_version(status))
+        return status
 
     def getContentOverrides(self, consumerId):
         """
@@ -1366,6 +1776,15 @@ class UEPConnection:
         method = "/consumers/%s/content_overrides" % self.sanitize(consumerId)
         return self.conn.request_get(method)
 
+    def getContentOverridesIfChanged(self, consumerId, validators=None):
+        """
+        Conditional version of getContentOverrides, see
+        BaseRestLib.request_get_if_changed for the arguments and the
+        return value.
+        """
+        method = "/consumers/%s/content_overrides" % self.sanitize(consumerId)
+        return self.conn.request_get_if_changed(method, validators)
+
     def setContentOverrides(self, consumerId, overrides):
         """
         Set an override on a content object.
@@ -109,17 +109,19 @@ class HuffmanNode(object):
         # the counter makes sure that when nodes of equal weight are compared,
         # the one most recently added gets chosen
         counter = itertools.count()
-        # We use the heapq module to make a min priority queue
-        queue = [(node, next(counter)) for node in nodes]
+        # We use the heapq module to make a min priority queue. The weight is
+        # kept in the tuple so nodes are ordered without calling __lt__.
+        queue = [(node.weight, next(counter), node) for node in nodes]
         heapq.heapify(queue)
         while True:
-            left, count = heapq.heappop(queue)
+            weight, count, left = heapq.heappop(queue)
             try:
-                right, count = heapq.heappop(queue)
+                weight, count, right = heapq.heappop(queue)
             except IndexError:
                 # no more nodes to compare, so a is the root node of the tree
                 return left
-            heapq.heappush(queue, (cls.combine(left, right), next(counter)))
+            node = cls.combine(left, right)
+            heapq.heappush(queue, (node.weight, next(counter), node))
 
     def __cmp__(self, other):
         return cmp(self.weight, other.weight)
@@ -134,3 +136,89 @@ class HuffmanNode(object):
 
     def __repr__(self):
         return 'HuffmanNode(%d, "%s")' % (self.weight, self.value)
+
+
+class HuffmanDecoder(object):
+    """
+    Decodes symbols from a bit stream using the leaves of a Huffman tree.
+
+    Rather than walking the tree (or looking up a string of '0' and '1'
+    characters) one bit at a time, codes are decoded with a lookup table
+    indexed by the next table_bits bits of the stream. Each entry holds the
+    length of the code those bits start with and its leaf. The rare codes
+    longer than the table are looked up by (length, code) one bit at a time.
+    """
+
+    # codes up to this many bits long are decoded with one table lookup
+    MAX_TABLE_BITS = 16
+
+    def __init__(self, root):
+        """
+        :param root:    root node of a Huffman tree, as returned by
+                        HuffmanNode.build_tree
+        :type  root:    rhsm.huffman.HuffmanNode
+        """
+        codes = self._leaf_codes(root)
+        max_length = max([length for length, code, leaf in codes] or [0])
+        self.table_bits = min(max_length, self.MAX_TABLE_BITS)
+        self.table = [None] * (1 << self.table_bits)
+        self.long_codes = {}
+        for length, code, leaf in codes:
+            # a tree with only a root has no codes at all
+            if length == 0:
+                continue
+            if length <= self.table_bits:
+                shift = self.table_bits - length
+                first = code << shift
+                entry = (length, leaf)
+                for index in range(first, first + (1 << shift)):
+                    self.table[index] = entry
+            else:
+                self.long_codes[(length, code)] = leaf
+
+    @staticmethod
+    def _leaf_codes(root):
+        """
+        :param root:    root node of a Huffman tree
+        :type  root:    rhsm.huffman.HuffmanNode
+        :return:        list of (code length, code, leaf) tuples, where code
+                        is an int holding the same bits as HuffmanNode.code
+        :rtype:         list
+        """
+        codes = []
+        stack = [(root, 0, 0)]
+        while stack:
+            node, length, code = stack.pop()
+            if node.is_leaf:
+                codes.append((length, code, node))
+            else:
+                stack.append((node.left, length + 1, code << 1))
+                stack.append((node.right, length + 1, (code << 1) | 1))
+        return codes
+
+    def decode(self, bitstream):
+        """
+        :param bitstream:   bit stream with a huffman code as the next value
+        :type  bitstream:   rhsm.bitstream.BitStream
+        :return:            leaf for the next code in the stream, or None if
+                            the stream ends before a complete code is read
+        :rtype:             rhsm.huffman.HuffmanNode
+        """
+        bits = bitstream.peek(self.table_bits)
+        entry = self.table[bits]
+        if entry is not None:
+            length, leaf = entry
+            if bitstream.skip(length):
+                return leaf
+            return None
+
+        length = min(self.table_bits, bitstream.remaining)
+        code = bits >> (self.table_bits - length)
+        bitstream.skip(length)
+        while bitstream.remaining:
+            code = (code << 1) | bitstream.read(1)
+            length += 1
+            leaf = self.long_codes.get((length, code))
+            if leaf is not None:
+                return leaf
+        return None
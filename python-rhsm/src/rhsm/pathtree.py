@@ -16,8 +16,8 @@
 import itertools
 import zlib
 
-from rhsm.bitstream import GhettoBitStream
-from rhsm.huffman import HuffmanNode
+from rhsm.bitstream import BitStream
+from rhsm.huffman import HuffmanDecoder, HuffmanNode
 
 # this is the "sentinel" value used for the path node that indicates the end
 # of a path
@@ -55,14 +55,22 @@ class PathTree(object):
         :type  data:    binary string
         """
         word_leaves, unused_bits = self._unpack_data(data)
-        HuffmanNode.build_tree(word_leaves)
-        word_dict = dict((node.code, node.value) for node in word_leaves)
-        bitstream = GhettoBitStream(unused_bits)
+        word_decoder = HuffmanDecoder(HuffmanNode.build_tree(word_leaves))
+        bitstream = BitStream(unused_bits)
         path_leaves = self._generate_path_leaves(bitstream)
-        HuffmanNode.build_tree(path_leaves)
-        path_dict = dict((node.code, node) for node in path_leaves)
+        path_decoder = HuffmanDecoder(HuffmanNode.build_tree(path_leaves))
         self.path_tree = self._generate_path_tree(
-                path_dict, path_leaves, word_dict, bitstream)
+                path_decoder, path_leaves, word_decoder, bitstream)
+
+    @property
+    def path_tree(self):
+        return self._path_tree
+
+    @path_tree.setter
+    def path_tree(self, tree):
+        self._path_tree = tree
+        # compiled lazily on the next match
+        self._matcher = None
 
     def match_path(self, path):
         """
@@ -79,45 +87,9 @@ class PathTree(object):
         """
         if not path.startswith('/'):
             raise ValueError('path must start with "/"')
-        return self._traverse_tree(self.path_tree, path.strip('/').split('/'))
-
-    @classmethod
-    def _traverse_tree(cls, tree, words):
-        """
-        Helper method for match_path that does recursive matching.
-
-        :param tree:    A dict representing a node in the greater path tree.
-        :type  tree:    dict
-        :param words:   list of words to match, the result of spliting a path
-                        by the "/" separator. Words must be sorted with the
-                        next word to match being at words[0]
-        :param words:   list
-        :return:        True iff there is a match, else False
-        :rtype:         bool
-        """
-        if PATH_END in tree:
-            # we hit the end of a path in the tree, so the match was successful
-            return True
-        if words:
-            words_to_try = []
-            # Look fo an exact match
-            if words[0] in tree:
-                words_to_try.append(words[0])
-            if words[0] == LISTING and len(words) == 1:
-                return True
-
-            # we allow any word to match against entitlement variables
-            # such as "$releasever".
-            for word in tree.keys():
-                if word.startswith('$'):
-                    words_to_try.append(word)
-
-            for word in words_to_try:
-                # keep trying for each child
-                for child in tree[word]:
-                    if cls._traverse_tree(child, words[1:]):
-                        return True
-        return False
+        if self._matcher is None:
+            self._matcher = _MatchNode.compile(self._path_tree)
+        return self._matcher.match(path.strip('/').split('/'))
 
     @staticmethod
     def _unpack_data(data):
@@ -159,7 +131,7 @@ class PathTree(object):
                             format, the beginning of this stream defines how
                             many total nodes exist. This method retrieves that
                             value.
-        :type  bitstream:   rhsm.bitstream.GhettoBitStream
+        :type  bitstream:   rhsm.bitstream.BitStream
         :return:            number of nodes
         :rtype:             int
         """
@@ -185,7 +157,7 @@ class PathTree(object):
 
         :param bitstream:   stream of bits remaining after decompressing the
                             word list
-        :type  bitstream:   rhsm.bitstream.GhettoBitStream
+        :type  bitstream:   rhsm.bitstream.BitStream
         :return:            list of HuffmanNode objects that can be used to
                             build a path tree
         :rtype:             list of HuffmanNode objects
@@ -220,39 +192,38 @@ class PathTree(object):
                 return code_dict[code]
 
     @classmethod
-    def _generate_path_tree(cls, path_dict, path_leaves, word_dict, bitstream):
+    def _generate_path_tree(cls, path_decoder, path_leaves, word_decoder, bitstream):
         """
         Once huffman trees have been generated for the words and for the path
         nodes, this method uses them and the bit stream to create the path tree
         that can be traversed to match potentially authorized paths.
 
-        :param path_dict:   dictionary where keys are huffman codes and values
-                            are path nodes.
-        :type  path_dict:   dict
+        :param path_decoder:    decoder for the huffman codes of path nodes
+        :type  path_decoder:    rhsm.huffman.HuffmanDecoder
         :param path_leaves: leaf nodes from the huffman tree of path nodes. the
                             values will be constructed into a new tree that can
                             be traversed to match actual paths.
         :type  path_leaves: list of HuffmanNode instances
-        :param word_dict:   dict where keys are huffman codes and values are
-                            words from the zlib-compressed word list.
-        :type  word_dict:   dict
+        :param word_decoder:    decoder for the huffman codes of words from
+                                the zlib-compressed word list.
+        :type  word_decoder:    rhsm.huffman.HuffmanDecoder
         :param bitstream:   bit stream where the rest of the bits describe
                             how to use words as references between nodes in
                             the path tree. This format is described in detail
                             in the v3 entitlement certificate docs.
-        :type  bitstream:   rhsm.bitstream.GhettoBitStream
+        :type  bitstream:   rhsm.bitstream.BitStream
         """
         values = [leaf.value for leaf in path_leaves]
         root = {}
         values.insert(0, root)
         for value in values:
             while True:
-                word = cls._get_leaf_from_dict(word_dict, bitstream)
+                word_leaf = word_decoder.decode(bitstream)
                 # check for end of node
-                if not word:
+                if word_leaf is None or not word_leaf.value:
                     break
-                path_node = cls._get_leaf_from_dict(path_dict, bitstream)
-                value.setdefault(word, []).append(path_node.value)
+                path_node = path_decoder.decode(bitstream)
+                value.setdefault(word_leaf.value, []).append(path_node.value)
         # add the sentinel value that marks this explicitly as the end of a path
         # there should usually only be one of these nodes
         for value in values:
@@ -260,3 +231,79 @@ class PathTree(object):
                 value[PATH_END] = None
 
         return root
+
+
+class _MatchNode(object):
+    """
+    A node of the path tree prepared for matching. Children are split once
+    into a dict of exact words and a list of the children reachable through
+    entitlement variables such as "$releasever", so that matching does not
+    have to scan every node's keys for variables.
+    """
+    __slots__ = ['is_end', 'exact', 'variables']
+
+    def __init__(self):
+        self.is_end = False
+        self.exact = {}
+        self.variables = []
+
+    @classmethod
+    def compile(cls, tree):
+        """
+        :param tree:    root node of the path tree, as built by PathTree
+        :type  tree:    dict
+        :return:        root of the compiled tree
+        :rtype:         rhsm.pathtree._MatchNode
+        """
+        # nodes may be referenced more than once, so compile each only once
+        compiled = {}
+
+        def get_node(tree_node):
+            node = compiled.get(id(tree_node))
+            if node is None:
+                node = compiled[id(tree_node)] = cls()
+                pending.append((tree_node, node))
+            return node
+
+        pending = []
+        root = get_node(tree)
+        while pending:
+            tree_node, node = pending.pop()
+            node.is_end = PATH_END in tree_node
+            for word, children in tree_node.items():
+                if word == PATH_END:
+                    continue
+                compiled_children = [get_node(child) for child in children]
+                if word.startswith('$'):
+                    node.variables.extend(compiled_children)
+                else:
+                    node.exact[word] = compiled_children
+        return root
+
+    def match(self, words):
+        """
+        :param words:   list of words to match, the result of spliting a path
+                        by the "/" separator.
+        :type  words:   list
+        :return:        True iff there is a match, else False
+        :rtype:         bool
+        """
+        last = len(words) - 1
+        # (node, index of the next word to match) pairs left to try
+        stack = [(self, 0)]
+        while stack:
+            node, index = stack.pop()
+            if node.is_end:
+                # we hit the end of a path in the tree, so the match was successful
+                return True
+            if index > last:
+                continue
+            word = words[index]
+            if index == last and word == LISTING:
+                return True
+            index += 1
+            for child in node.exact.get(word, ()):
+                stack.append((child, index))
+            for child in node.variables:
+                stack.append((child, index))
+        return False
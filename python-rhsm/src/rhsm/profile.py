@@ -11,6 +11,7 @@
 # http://www.gnu.org/licenses/old-licenses/gpl-2.0.txt.
 #
 import logging
+import os
 
 import rpm
 
@@ -18,6 +19,10 @@ from rhsm import ourjson as json
 
 log = logging.getLogger(__name__)
 
+# Files in the rpm database directory that are modified by every rpm
+# transaction (BerkeleyDB, ndb and sqlite backends):
+RPMDB_FILES = ('Packages', 'Packages.db', 'rpmdb.sqlite', 'rpmdb.sqlite-wal')
+
 
 class InvalidProfileType(Exception):
     """
@@ -30,6 +35,9 @@ class Package(object):
     """
     Represents a package installed on the system.
     """
+    # profiles hold thousands of these
+    __slots__ = ('name', 'version', 'release', 'arch', 'epoch', 'vendor')
+
     def __init__(self, name, version, release, arch, epoch=0, vendor=None,
                  from_dict=None):
         self.name = name
@@ -50,6 +58,10 @@ class Package(object):
                 'vendor': self.vendor,
         }
 
+    def _key(self):
+        return (self.name, self.version, self.release, self.arch, self.epoch,
+                self.vendor)
+
     def __eq__(self, other):
         """
         Compare one profile to another to determine if anything has changed.
@@ -57,15 +69,13 @@ class Package(object):
         if type(self) != type(other):
             return False
 
-        if self.name == other.name and \
-                self.version == other.version and \
-                self.release == other.release and \
-                self.arch == other.arch and \
-                self.epoch == other.epoch and \
-                self.vendor == other.vendor:
-            return True
+        return self._key() == other._key()
 
-        return False
+    def __ne__(self, other):
+        return not self.__eq__(other)
+
+    def __hash__(self):
+        return hash(self._key())
 
     def __str__(self):
         return "<Package: %s %s %s>" % (self.name, self.version, self.release)
@@ -152,11 +162,72 @@ class RPMProfile(object):
         if len(self.packages) != len(other.packages):
             return False
 
-        for pkg in self.packages:
-            if not pkg in other.packages:
-                return False
+        return set(self.packages) == set(other.packages)
+
+    def __ne__(self, other):
+        return not self.__eq__(other)
 
-        return True
+    def diff(self, other):
+        """
+        Compare this profile to an older one.
+
+        A package that was replaced by a single package of the same name and
+        arch (an update or downgrade) is reported as changed, everything
+        else that differs as added or removed. Several installed versions of
+        one package (ie kernels) are reported as added/removed.
+
+        @param other: the previous profile
+        @type other: RPMProfile
+        @return: (added, removed, changed), lists of Package objects, and
+                 of (old, new) Package pairs for changed
+        @rtype: tuple
+        """
+        current = set(self.packages)
+        previous = set(other.packages)
+        added = [pkg for pkg in self.packages if pkg not in previous]
+        removed = [pkg for pkg in other.packages if pkg not in current]
+
+        added_by_name = {}
+        for pkg in added:
+            added_by_name.setdefault((pkg.name, pkg.arch), []).append(pkg)
+        removed_by_name = {}
+        for pkg in removed:
+            removed_by_name.setdefault((pkg.name, pkg.arch), []).append(pkg)
+
+        changed = []
+        for pkg in added:
+            name_arch = (pkg.name, pkg.arch)
+            old_pkgs = removed_by_name.get(name_arch)
+            if len(added_by_name[name_arch]) == 1 and old_pkgs and len(old_pkgs) == 1:
+                changed.append((old_pkgs[0], pkg))
+
+        if changed:
+            changed_old = set(old for (old, new) in changed)
+            changed_new = set(new for (old, new) in changed)
+            added = [pkg for pkg in added if pkg not in changed_new]
+            removed = [pkg for pkg in removed if pkg not in changed_old]
+        return added, removed, changed
+
+
+def get_rpmdb_fingerprint():
+    """
+    Returns a cheap fingerprint of the state of the rpm database, a list
+    of [name, size, mtime, inode] for each database file, or None if none
+    of them could be found.
+
+    Comparing fingerprints only needs a few stat calls, so it can be used
+    to tell that the installed packages did not change without reading
+    every header.
+    """
+    dbpath = rpm.expandMacro('%{_dbpath}')
+    fingerprint = []
+    for name in RPMDB_FILES:
+        try:
+            st = os.stat(os.path.join(dbpath, name))
+        except OSError:
+            continue
+        fingerprint.append([name, st.st_size, st.st_mtime, st.st_ino])
+    return fingerprint or None
 
 
 def get_profile(profile_type):
@@ -0,0 +1,178 @@
+#
+# Copyright (c) 2017 Red Hat, Inc.
+#
+# This software is licensed to you under the GNU General Public License,
+# version 2 (GPLv2). There is NO WARRANTY for this software, express or
+# implied, including the implied warranties of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. You should have received a copy of GPLv2
+# along with this software; if not, see
+# http://www.gnu.org/licenses/old-licenses/gpl-2.0.txt.
+#
+# Red Hat trademarks are not licensed under GPLv2. No permission is
+# granted to use or replicate Red Hat trademarks that are incorporated
+# in this software or its documentation.
+#
+"""
+Persistent cache of what a server supports.
+
+UEPConnection.supports_resource() needs the resource list of the server
+(GET /) and has_capability() its manager capabilities (GET /status). Both
+only change when the server is upgraded, yet every short lived process,
+yum plugins, rhsmcertd-worker and each subscription-manager command, used
+to fetch them again and pay for a TLS handshake before doing anything
+else. This module keeps them on disk per server URL for a limited time,
+and forgets them as soon as the server reports a different version.
+"""
+
+import errno
+import logging
+import os
+import tempfile
+import threading
+import time
+
+from rhsm import ourjson as json
+
+log = logging.getLogger(__name__)
+
+DEFAULT_CACHE_FILE = "/var/lib/rhsm/cache/server_info.json"
+
+# Seconds an entry is used for before it is fetched from the server again.
+DEFAULT_TTL = 24 * 60 * 60
+
+# Bumped whenever the format below changes, older caches are then simply
+# discarded.
+CACHE_FORMAT = 1
+
+
+def server_version(status):
+    """
+    Return the version a /status response reports for the server, or None
+    if it has none.
+    """
+    if not status or not status.get('version'):
+        return None
+    return "%s-%s" % (status.get('version'), status.get('release'))
+
+
+class ServerInfoCache(object):
+    """
+    Values fetched from servers, kept per server URL and key.
+
+    Lookups read the cache file once per process, updates merge into what
+    is on disk at that point, so processes updating the cache at the same
+    time do not lose each others entries for other servers.
+    """
+
+    def __init__(self, cache_file=DEFAULT_CACHE_FILE, ttl=DEFAULT_TTL):
+        self.cache_file = cache_file
+        self.ttl = ttl
+        self._entries = None
+        self._lock = threading.Lock()
+
+    def get(self, url, key):
+        """
+        Return the value cached for key of the server at url, or None if
+        there is none or it expired.
+        """
+        with self._lock:
+            if self._entries is None:
+                self._entries = self._read()
+            item = (self._entries.get(url) or {}).get(key)
+        if not isinstance(item, dict):
+            return None
+        age = time.time() - item.get('time', 0)
+        if age < 0 or age > self.ttl:
+            return None
+        return item.get('value')
+
+    def put(self, url, key, value):
+        """
+        Remember the value of key for the server at url.
+        """
+        def update(entry):
+            entry[key] = {'time': time.time(), 'value': value}
+            return entry
+        self._update(url, update)
+
+    def check_version(self, url, version):
+        """
+        Record the version the server at url reports, forgetting everything
+        cached for it if the version changed.
+        """
+        if version is None:
+            return
+
+        def update(entry):
+            cached_version = entry.get('version')
+            if cached_version == version:
+                return None
+            # Values cached before the version was known were fetched from
+            # this version as far as we can tell, keep them.
+            if cached_version is None:
+                entry['version'] = version
+                return entry
+            log.debug("Server %s changed version to %s, dropping cached server info" %
+                      (url, version))
+            return {'version': version}
+        self._update(url, update)
+
+    def clear(self):
+        with self._lock:
+            self._entries = {}
+            try:
+                os.unlink(self.cache_file)
+            except OSError:
+                pass
+
+    def _update(self, url, update):
+        with self._lock:
+            entries = self._read()
+            entry = update(dict(entries.get(url) or {}))
+            if entry is None:
+                self._entries = entries
+                return
+            entries[url] = entry
+            self._entries = entries
+            self._write(entries)
+
+    def _read(self):
+        try:
+            f = open(self.cache_file)
+            try:
+                data = json.load(f)
+            finally:
+                f.close()
+        except IOError as e:
+            if e.errno != errno.ENOENT:
+                log.debug("Unable to read server info cache %s: %s" % (self.cache_file, e))
+            return {}
+        except ValueError as e:
+            log.debug("Ignoring corrupt server info cache %s: %s" % (self.cache_file, e))
+            return {}
+        if not isinstance(data, dict) or data.get('format') != CACHE_FORMAT:
+            return {}
+        return data.get('servers') or {}
+
+    def _write(self, entries):
+        cache_dir = os.path.dirname(self.cache_file)
+        # A missing cache directory means we are not running on an
+        # installed system, do not create it.
+        if not os.path.isdir(cache_dir):
+            return
+        try:
+            fd, tmp_path = tempfile.mkstemp(dir=cache_dir, prefix='.server_info')
+            try:
+                f = os.fdopen(fd, 'w')
+                try:
+                    json.dump({'format': CACHE_FORMAT, 'servers': entries}, f)
+                finally:
+                    f.close()
+                os.rename(tmp_path, self.cache_file)
+            except Exception:
+                os.unlink(tmp_path)
+                raise
+        except (IOError, OSError) as e:
+            if e.errno not in (errno.EACCES, errno.EPERM, errno.EROFS):
+                log.warning("Unable to write server info cache %s: %s" %
+                            (self.cache_file, e))
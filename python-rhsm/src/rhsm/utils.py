@@ -16,6 +16,7 @@
 import gettext
 import os
 import re
+import threading
 try:
     from urllib.parse import urlparse
 except ImportError:
@@ -257,3 +258,74 @@ def cmd_name(argv):
         cmd_name_string = "initial-setup"
 
     return cmd_name_string
+
+
+class LRUCache(object):
+    """
+    A small thread safe dict-like cache that keeps only the most recently
+    used max_size entries.
+
+    Entries are kept in a circular doubly linked list ordered by use, so
+    lookups, inserts and evictions are all O(1). (OrderedDict is not
+    available on python 2.6.)
+    """
+    # indexes into the link lists
+    PREV, NEXT, KEY, VALUE = 0, 1, 2, 3
+
+    def __init__(self, max_size=128):
+        self.max_size = max_size
+        self._lock = threading.Lock()
+        self.clear()
+
+    def clear(self):
+        with self._lock:
+            self._links = {}
+            self._root = []
+            self._root[:] = [self._root, self._root, None, None]
+
+    def __len__(self):
+        return len(self._links)
+
+    def __contains__(self, key):
+        return key in self._links
+
+    def get(self, key, default=None):
+        with self._lock:
+            link = self._links.get(key)
+            if link is None:
+                return default
+            self._move_to_front(link)
+            return link[self.VALUE]
+
+    def __setitem__(self, key, value):
+        with self._lock:
+            link = self._links.get(key)
+            if link is not None:
+                link[self.VALUE] = value
+                self._move_to_front(link)
+                return
+
+            if len(self._links) >= self.max_size:
+                oldest = self._root[self.PREV]
+                self._unlink(oldest)
+                del self._links[oldest[self.KEY]]
+
+            root = self._root
+            first = root[self.NEXT]
+            link = [root, first, key, value]
+            first[self.PREV] = link
+            root[self.NEXT] = link
+            self._links[key] = link
+
+    def _unlink(self, link):
+        link[self.PREV][self.NEXT] = link[self.NEXT]
+        link[self.NEXT][self.PREV] = link[self.PREV]
+
+    def _move_to_front(self, link):
+        self._unlink(link)
+        root = self._root
+        first = root[self.NEXT]
+        link[self.PREV] = root
+        link[self.NEXT] = first
+        first[self.PREV] = link
+        root[self.NEXT] = link
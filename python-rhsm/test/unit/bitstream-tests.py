@@ -15,7 +15,7 @@ import os
 import unittest
 import zlib
 
-from rhsm.bitstream import GhettoBitStream
+from rhsm.bitstream import BitStream, GhettoBitStream
 
 DATA = os.path.join(os.path.dirname(os.path.abspath(__file__)),
                     'entitlement_data.bin')
@@ -73,3 +73,46 @@ class TestGhettoBitStream(unittest.TestCase):
         self.assertEqual(self.bs.combine_bytes([1, 3]), 259)
         self.assertEqual(self.bs.combine_bytes([3]), 3)
         self.assertEqual(self.bs.combine_bytes([1, 1, 3]), 65795)
+
+
+class TestBitStream(unittest.TestCase):
+    def setUp(self):
+        self.bs = BitStream(tree_data)
+
+    def test_pop_byte(self):
+        remaining = self.bs.remaining
+        first = self.bs.pop_byte()
+        self.assertEqual(first, 5)
+        self.assertEqual(self.bs.remaining, remaining - 8)
+
+    def test_same_bits_as_ghetto(self):
+        bits = ''.join(GhettoBitStream(tree_data))
+        self.assertEqual(self.bs.read(len(bits)), int(bits, 2))
+        self.assertEqual(self.bs.remaining, 0)
+
+    def test_peek_does_not_consume(self):
+        remaining = self.bs.remaining
+        self.assertEqual(self.bs.peek(3), self.bs.peek(3))
+        self.assertEqual(self.bs.remaining, remaining)
+
+    def test_read(self):
+        bs = BitStream(bytearray([213, 6]))
+        self.assertEqual(bs.read(4), 13)
+        self.assertEqual(bs.read(8), 80)
+        self.assertEqual(bs.read(4), 6)
+        self.assertEqual(bs.remaining, 0)
+
+    def test_peek_past_end_pads_zeros(self):
+        bs = BitStream(bytearray([255]))
+        self.assertEqual(bs.peek(10), 1020)
+
+    def test_skip_past_end(self):
+        bs = BitStream(bytearray([255]))
+        self.assertTrue(bs.skip(3))
+        self.assertFalse(bs.skip(6))
+        self.assertEqual(bs.remaining, 0)
+
+    def test_combine_bytes(self):
+        self.assertEqual(self.bs.combine_bytes([1, 3]), 259)
+        self.assertEqual(self.bs.combine_bytes([3]), 3)
+        self.assertEqual(self.bs.combine_bytes([1, 1, 3]), 65795)
@@ -0,0 +1,154 @@
+#
+# Copyright (c) 2017 Red Hat, Inc.
+#
+# This software is licensed to you under the GNU General Public License,
+# version 2 (GPLv2). There is NO WARRANTY for this software, express or
+# implied, including the implied warranties of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. You should have received a copy of GPLv2
+# along with this software; if not, see
+# http://www.gnu.org/licenses/old-licenses/gpl-2.0.txt.
+#
+# Red Hat trademarks are not licensed under GPLv2. No permission is
+# granted to use or replicate Red Hat trademarks that are incorporated
+# in this software or its documentation.
+#
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from mock import patch
+
+from test.unit import certdata
+from rhsm.certcache import CertificateCache
+from rhsm.certificate import create_from_file
+from rhsm.certificate2 import EntitlementCertificate, IdentityCertificate, \
+        ProductCertificate
+
+
+class CertificateCacheTests(unittest.TestCase):
+
+    def setUp(self):
+        self.cert_dir = tempfile.mkdtemp()
+        self.cache_dir = tempfile.mkdtemp()
+        self.cache_file = os.path.join(self.cache_dir, 'certs', 'test.json')
+
+    def tearDown(self):
+        shutil.rmtree(self.cert_dir)
+        shutil.rmtree(self.cache_dir)
+
+    def _write(self, name, pem):
+        path = os.path.join(self.cert_dir, name)
+        f = open(path, 'w')
+        f.write(pem)
+        f.close()
+        return path
+
+    def _load(self, path):
+        cache = CertificateCache(self.cache_file)
+        cert = create_from_file(path, cache=cache)
+        cache.save()
+        return cert
+
+    def _load_cached(self, path):
+        with patch('rhsm.certificate2._CertFactory._read_x509') as mock_read:
+            cert = self._load(path)
+            self.assertFalse(mock_read.called)
+        return cert
+
+    def test_v3_entitlement_cert(self):
+        path = self._write('1.pem', certdata.ENTITLEMENT_CERT_V3_2_WITH_CONTENT_ARCH)
+        parsed = self._load(path)
+        cached = self._load_cached(path)
+
+        self.assertTrue(isinstance(cached, EntitlementCertificate))
+        self.assertEquals(path, cached.path)
+        self.assertEquals(str(parsed.version), str(cached.version))
+        self.assertEquals(parsed.serial, cached.serial)
+        self.assertEquals(parsed.start, cached.start)
+        self.assertEquals(parsed.end, cached.end)
+        self.assertEquals(parsed.subject, cached.subject)
+        self.assertEquals(parsed.issuer, cached.issuer)
+        self.assertEquals(parsed.pem, cached.pem)
+        self.assertEquals(parsed.pool.id, cached.pool.id)
+        self.assertEquals(parsed.order.sku, cached.order.sku)
+        self.assertEquals(parsed.order.quantity_used, cached.order.quantity_used)
+        self.assertEquals(parsed.content, cached.content)
+        self.assertEquals([(c.enabled, c.arches) for c in parsed.content],
+                [(c.enabled, c.arches) for c in cached.content])
+        self.assertEquals(parsed.products, cached.products)
+        self.assertEquals(parsed.entitlement_type, cached.entitlement_type)
+        self.assertEquals(parsed.check_path('/path/to/awesomeos/all'),
+                cached.check_path('/path/to/awesomeos/all'))
+        self.assertEquals(parsed.x509.get_serial_number(),
+                cached.x509.get_serial_number())
+
+    def test_v1_entitlement_cert(self):
+        path = self._write('1.pem', certdata.ENTITLEMENT_CERT_V1_0)
+        parsed = self._load(path)
+        cached = self._load_cached(path)
+
+        self.assertTrue(isinstance(cached, EntitlementCertificate))
+        self.assertTrue(cached.pem is None)
+        self.assertEquals(parsed.extensions, cached.extensions)
+        self.assertEquals(parsed.content, cached.content)
+        self.assertEquals(parsed.order.name, cached.order.name)
+
+        # v1 certs are written out from the lazily loaded X509 object
+        out = os.path.join(self.cert_dir, 'copy.pem')
+        cached.write(out)
+        self.assertEquals(parsed.serial, create_from_file(out).serial)
+
+    def test_product_and_identity_certs(self):
+        prod_path = self._write('prod.pem', certdata.PRODUCT_CERT_V1_0)
+        ident_path = self._write('cert.pem', certdata.IDENTITY_CERT)
+        self._load(prod_path)
+        prod = self._load_cached(prod_path)
+        self.assertTrue(isinstance(prod, ProductCertificate))
+        self.assertEquals('Awesome OS for x86_64 Bits', prod.products[0].name)
+
+        self._load(ident_path)
+        ident = self._load_cached(ident_path)
+        self.assertTrue(isinstance(ident, IdentityCertificate))
+        self.assertEquals(create_from_file(ident_path).alt_name, ident.alt_name)
+
+    def test_changed_file_is_parsed(self):
+        path = self._write('1.pem', certdata.ENTITLEMENT_CERT_V3_0)
+        self._load(path)
+        self._write('1.pem', certdata.ENTITLEMENT_CERT_V1_0)
+
+        cert = self._load(path)
+        self.assertEquals(1, cert.version.major)
+
+    def test_unused_entries_pruned(self):
+        path = self._write('1.pem', certdata.ENTITLEMENT_CERT_V3_0)
+        other = self._write('2.pem', certdata.PRODUCT_CERT_V1_0)
+        cache = CertificateCache(self.cache_file)
+        create_from_file(path, cache=cache)
+        create_from_file(other, cache=cache)
+        cache.save()
+
+        self._load(path)
+        self.assertEquals([path], list(CertificateCache(self.cache_file)._load().keys()))
+
+    def test_missing_cache_parent_not_created(self):
+        cache_file = os.path.join(self.cache_dir, 'missing', 'certs', 'test.json')
+        cache = CertificateCache(cache_file)
+        create_from_file(self._write('1.pem', certdata.PRODUCT_CERT_V1_0), cache=cache)
+        cache.save()
+        self.assertFalse(os.path.exists(os.path.dirname(cache_file)))
+
+    def test_corrupt_cache_ignored(self):
+        path = self._write('1.pem', certdata.PRODUCT_CERT_V1_0)
+        os.mkdir(os.path.dirname(self.cache_file))
+        f = open(self.cache_file, 'w')
+        f.write('{not json')
+        f.close()
+        cert = self._load(path)
+        self.assertEquals('Awesome OS for x86_64 Bits', cert.products[0].name)
+        self._load_cached(path)
+
+    def test_for_directory(self):
+        cache = CertificateCache.for_directory('/etc/pki/entitlement', '/cache')
+        self.assertEquals('/cache/etc_pki_entitlement.json', cache.cache_file)
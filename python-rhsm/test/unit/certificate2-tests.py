@@ -227,6 +227,15 @@ class V3CertTests(unittest.TestCase):
     def test_match_deep_path(self):
         self.assertTrue(self.ent_cert.check_path('/path/to/awesomeos/x86_64/foo/bar'))
 
+    def test_check_path_cached(self):
+        with patch.object(self.ent_cert, '_check_path_uncached',
+                          wraps=self.ent_cert._check_path_uncached) as mock_check:
+            self.assertTrue(self.ent_cert.check_path('/path/to/awesomeos/x86_64'))
+            self.assertTrue(self.ent_cert.check_path('/path/to/awesomeos/x86_64'))
+            self.assertFalse(self.ent_cert.check_path('/path/to/nothing'))
+            self.assertFalse(self.ent_cert.check_path('/path/to/nothing'))
+            self.assertEquals(2, mock_check.call_count)
+
     def test_missing_pool(self):
         self.assertEquals(None, self.ent_cert.pool)
 
@@ -15,8 +15,12 @@
 #
 import datetime
 import locale
+import os
+import shutil
 import socket
+import tempfile
 import unittest
+import zlib
 
 from nose.plugins.skip import SkipTest
 
@@ -475,6 +479,298 @@ class RestlibTests(unittest.TestCase):
         self.assertTrue(isinstance(data["phoneNumbers"][0][0]["type"], type(u"")))
 
 
+class RestlibConnectionPoolTests(unittest.TestCase):
+    def setUp(self):
+        self.restlib = Restlib("somehost", "123", "somehandler", insecure=True)
+        self.restlib._get_ssl_context = Mock()
+        self.restlib._create_connection = Mock(side_effect=self._new_connection)
+        self.restlib._pool.factory = self.restlib._create_connection
+        self.connections = []
+
+    def _new_connection(self):
+        conn = Mock()
+        conn.getresponse.return_value = self._response()
+        self.connections.append(conn)
+        return conn
+
+    def _response(self, will_close=False):
+        response = Mock()
+        response.status = 200
+        response.will_close = will_close
+        response.read.return_value = b'{"result": true}'
+        response.getheaders.return_value = []
+        response.getheader.return_value = None
+        return response
+
+    @patch('rhsm.connection._connection_dropped', return_value=False)
+    def test_keep_alive_connection_reused(self, mock_dropped):
+        self.restlib.request_get("/status")
+        self.restlib.request_get("/status")
+        self.assertEquals(1, len(self.connections))
+        self.assertEquals(1, self.restlib.handshakes)
+        self.assertEquals(1, self.restlib.reused_requests)
+
+    @patch('rhsm.connection._connection_dropped', return_value=False)
+    def test_connection_not_reused_when_server_closes(self, mock_dropped):
+        self.restlib.request_get("/status")
+        self.connections[0].getresponse.return_value = self._response(will_close=True)
+        self.restlib.request_get("/status")
+        self.restlib.request_get("/status")
+        self.assertEquals(2, self.restlib.handshakes)
+        self.assertTrue(self.connections[0].close.called)
+
+    @patch('rhsm.connection._connection_dropped', return_value=True)
+    def test_dropped_idle_connection_discarded(self, mock_dropped):
+        self.restlib.request_get("/status")
+        self.restlib.request_get("/status")
+        self.assertEquals(2, self.restlib.handshakes)
+        self.assertEquals(0, self.restlib.reused_requests)
+        self.assertTrue(self.connections[0].close.called)
+
+    @patch('rhsm.connection._connection_dropped', return_value=False)
+    def test_stale_connection_retried(self, mock_dropped):
+        self.restlib.request_get("/status")
+        self.connections[0].getresponse.side_effect = connection.httplib.BadStatusLine("''")
+        result = self.restlib.request_get("/status")
+        self.assertEquals({"result": True}, result)
+        self.assertEquals(2, len(self.connections))
+        self.assertTrue(self.connections[0].close.called)
+
+    @patch('rhsm.connection._connection_dropped', return_value=False)
+    def test_stale_connection_send_retried(self, mock_dropped):
+        self.restlib.request_get("/status")
+        self.connections[0].request.side_effect = socket.error("broken pipe")
+        self.restlib.request_post("/consumers/uuid/entitlements")
+        self.assertEquals(2, len(self.connections))
+
+    @patch('rhsm.connection._connection_dropped', return_value=False)
+    def test_lost_response_not_retried_when_not_idempotent(self, mock_dropped):
+        self.restlib.request_get("/status")
+        self.connections[0].getresponse.side_effect = connection.httplib.BadStatusLine("''")
+        self.assertRaises(connection.httplib.BadStatusLine, self.restlib.request_post,
+                          "/consumers/uuid/entitlements")
+        self.assertEquals(1, len(self.connections))
+        self.assertTrue(self.connections[0].close.called)
+
+    def test_new_connection_error_not_retried(self):
+        self.restlib._create_connection = Mock(return_value=Mock())
+        self.restlib._pool.factory = self.restlib._create_connection
+        self.restlib._create_connection.return_value.request.side_effect = socket.error("refused")
+        self.assertRaises(socket.error, self.restlib.request_get, "/status")
+        self.assertEquals(1, self.restlib._create_connection.call_count)
+
+    @patch('rhsm.connection._connection_dropped', return_value=False)
+    def test_close_closes_idle_connections(self, mock_dropped):
+        self.restlib.request_get("/status")
+        self.restlib.close()
+        self.assertTrue(self.connections[0].close.called)
+        self.restlib.request_get("/status")
+        self.assertEquals(2, self.restlib.handshakes)
+
+
+class RestlibConditionalGetTests(unittest.TestCase):
+    def setUp(self):
+        self.restlib = Restlib("somehost", "123", "somehandler", insecure=True)
+        self.restlib._get_ssl_context = Mock()
+        self.restlib._send_request = Mock(side_effect=self._send_request)
+        self.responses = []
+
+    def _send_request(self, request_type, handler, body, headers):
+        status, content, response_headers = self.responses.pop(0)
+        response = Mock()
+        response.status = status
+        response.getheaders.return_value = list(response_headers.items())
+        response.getheader.return_value = None
+        return response, content
+
+    def _sent_headers(self, call_index=-1):
+        return self.restlib._send_request.call_args_list[call_index][0][3]
+
+    def test_validators_returned(self):
+        self.responses.append((200, b'[{"serial": 1}]', {'ETag': '"abc"',
+                'Last-Modified': 'Tue, 01 Aug 2017 10:00:00 GMT'}))
+        content, validators = self.restlib.request_get_if_changed("/serials", {})
+        self.assertEquals([{"serial": 1}], content)
+        self.assertEquals('"abc"', validators['etag'])
+        self.assertEquals('Tue, 01 Aug 2017 10:00:00 GMT', validators['last_modified'])
+        self.assertFalse('If-None-Match' in self._sent_headers())
+
+    def test_not_modified(self):
+        self.responses.append((304, b'', {}))
+        validators = {'etag': '"abc"', 'last_modified': 'Tue, 01 Aug 2017 10:00:00 GMT'}
+        self.assertEquals(None, self.restlib.request_get_if_changed("/serials", validators))
+        self.assertEquals('"abc"', self._sent_headers()['If-None-Match'])
+        self.assertEquals('Tue, 01 Aug 2017 10:00:00 GMT',
+                self._sent_headers()['If-Modified-Since'])
+
+    def test_last_validators_reused_per_resource(self):
+        self.responses.append((200, b'[]', {'etag': '"abc"'}))
+        self.responses.append((200, b'[]', {'etag': '"def"'}))
+        self.responses.append((304, b'', {}))
+        self.restlib.request_get_if_changed("/serials")
+        self.restlib.request_get_if_changed("/compliance")
+        self.assertEquals(None, self.restlib.request_get_if_changed("/serials"))
+        self.assertEquals('"abc"', self._sent_headers()['If-None-Match'])
+
+    def test_empty_validators_fetch_unconditionally(self):
+        self.responses.append((200, b'[]', {'etag': '"abc"'}))
+        self.responses.append((200, b'[]', {}))
+        self.restlib.request_get_if_changed("/serials")
+        content, validators = self.restlib.request_get_if_changed("/serials", {})
+        self.assertFalse('If-None-Match' in self._sent_headers())
+        self.assertEquals(None, validators['etag'])
+
+
+class RestlibCompressionTests(unittest.TestCase):
+    def setUp(self):
+        self.restlib = Restlib("somehost", "123", "somehandler", insecure=True)
+        self.restlib._get_ssl_context = Mock()
+        self.restlib._send_request = Mock(side_effect=self._send_request)
+        self.response_content = b'[{"id": "pool"}]'
+        self.response_encoding = None
+
+    def _send_request(self, request_type, handler, body, headers):
+        response = Mock()
+        response.status = 200
+        response.getheaders.return_value = []
+        response.getheader.side_effect = lambda name: \
+            self.response_encoding if name.lower() == 'content-encoding' else None
+        return response, self.response_content
+
+    def test_accept_encoding_sent(self):
+        self.restlib.request_get("/pools")
+        headers = self.restlib._send_request.call_args[0][3]
+        self.assertEquals("gzip, deflate", headers["Accept-Encoding"])
+
+    def test_gzip_response(self):
+        self.response_encoding = 'gzip'
+        self.response_content = connection._gzip(b'[{"id": "pool"}]')
+        self.assertEquals([{"id": "pool"}], self.restlib.request_get("/pools"))
+
+    def test_deflate_response(self):
+        self.response_encoding = 'deflate'
+        self.response_content = zlib.compress(b'[{"id": "pool"}]')
+        self.assertEquals([{"id": "pool"}], self.restlib.request_get("/pools"))
+
+        # raw deflate without the zlib header
+        self.response_content = self.response_content[2:-4]
+        self.assertEquals([{"id": "pool"}], self.restlib.request_get("/pools"))
+
+    def test_compressed_request_body(self):
+        self.restlib.request_put("/consumers/abc/packages", [{"name": "pkg"}], compress=True)
+        body, headers = self.restlib._send_request.call_args[0][2:]
+        self.assertEquals("gzip", headers["Content-Encoding"])
+        self.assertEquals([{"name": "pkg"}],
+                json.loads(zlib.decompress(body, 16 + zlib.MAX_WBITS).decode('utf-8')))
+
+    def test_body_compressed_only_with_capability(self):
+        uep = UEPConnection(username="dummy", password="dummy", handler="/Test/", insecure=True)
+        uep.conn = Mock()
+        uep.updatePackageProfile("abc", [])
+        self.assertEquals(False, uep.conn.request_put.call_args[1]['compress'])
+
+        uep.capabilities = [connection.GZIP_REQUEST_CAPABILITY]
+        uep.updatePackageProfile("abc", [])
+        self.assertEquals(True, uep.conn.request_put.call_args[1]['compress'])
+
+
+class SSLContextCacheTests(unittest.TestCase):
+    def setUp(self):
+        self.ca_dir = tempfile.mkdtemp()
+        self._write_ca("redhat-uep.pem")
+        connection._ssl_contexts.clear()
+
+    def tearDown(self):
+        shutil.rmtree(self.ca_dir)
+        connection._ssl_contexts.clear()
+
+    def _write_ca(self, name):
+        with open(os.path.join(self.ca_dir, name), 'w') as ca_file:
+            ca_file.write(name)
+
+    def _restlib(self):
+        restlib = Restlib("somehost", "123", "somehandler", ca_dir=self.ca_dir)
+        restlib._create_ssl_context = Mock(side_effect=lambda: Mock())
+        return restlib
+
+    def test_context_shared_between_connections(self):
+        first = self._restlib()
+        second = self._restlib()
+        self.assertTrue(first._get_ssl_context() is second._get_ssl_context())
+        self.assertEquals(0, second._create_ssl_context.call_count)
+
+    def test_context_rebuilt_when_ca_added(self):
+        restlib = self._restlib()
+        context = restlib._get_ssl_context()
+        self._write_ca("other-ca.pem")
+        self.assertFalse(context is restlib._get_ssl_context())
+        self.assertEquals(2, restlib._create_ssl_context.call_count)
+
+    def test_context_not_shared_with_insecure(self):
+        secure = self._restlib()
+        insecure = self._restlib()
+        insecure.insecure = True
+        self.assertFalse(secure._get_ssl_context() is insecure._get_ssl_context())
+
+    def test_dir_fingerprint_ignores_other_files(self):
+        fingerprint = connection._dir_fingerprint(self.ca_dir)
+        self._write_ca("README")
+        self.assertEquals(fingerprint, connection._dir_fingerprint(self.ca_dir))
+
+
+class ServerInfoCacheTests(unittest.TestCase):
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+        cache = connection.ServerInfoCache(os.path.join(self.cache_dir, 'server_info.json'))
+        patcher = patch('rhsm.connection._server_info', cache)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        shutil.rmtree(self.cache_dir)
+
+    def _uep(self, status=None):
+        uep = UEPConnection(username="dummy", password="dummy", handler="/Test/", insecure=True)
+        uep.conn = Mock()
+        uep.conn.request_get.side_effect = lambda method: {
+            '/': [{'rel': 'pools', 'href': '/pools'}],
+            '/status': status or {'version': '2.0.1', 'release': '1',
+                                  'managerCapabilities': ['cores']},
+        }[method]
+        return uep
+
+    def test_resources_cached_between_connections(self):
+        self.assertTrue(self._uep().supports_resource('pools'))
+        uep = self._uep()
+        self.assertTrue(uep.supports_resource('pools'))
+        self.assertFalse(uep.supports_resource('owners'))
+        self.assertEquals(0, uep.conn.request_get.call_count)
+
+    def test_capabilities_cached_between_connections(self):
+        self.assertTrue(self._uep().has_capability('cores'))
+        uep = self._uep()
+        self.assertTrue(uep.has_capability('cores'))
+        self.assertEquals(0, uep.conn.request_get.call_count)
+
+    def test_resources_kept_when_version_first_seen(self):
+        self._uep().supports_resource('pools')
+        self._uep().getStatus()
+        uep = self._uep()
+        self.assertTrue(uep.supports_resource('pools'))
+        self.assertEquals(0, uep.conn.request_get.call_count)
+
+    def test_server_upgrade_invalidates(self):
+        self._uep().supports_resource('pools')
+        self._uep().has_capability('cores')
+        upgraded = self._uep({'version': '2.1.0', 'release': '1',
+                              'managerCapabilities': ['cores', 'ram']})
+        upgraded.getStatus()
+        self.assertTrue(upgraded.has_capability('ram'))
+        upgraded.supports_resource('pools')
+        self.assertEquals(['/status', '/status', '/'],
+                [c[0][0] for c in upgraded.conn.request_get.call_args_list])
+
+
 # see #830767 and #842885 for examples of why this is
 # a useful test. Aka, sometimes we forget to make
 # str/repr work and that cases weirdness
@@ -11,9 +11,14 @@
 # granted to use or replicate Red Hat trademarks that are incorporated
 # in this software or its documentation.
 
+import random
 import unittest
 
-from rhsm.huffman import HuffmanNode
+from mock import patch
+
+from rhsm.bitstream import BitStream, GhettoBitStream
+from rhsm.huffman import HuffmanDecoder, HuffmanNode
+from rhsm.pathtree import PathTree
 
 
 class TestHuffmanNode(unittest.TestCase):
@@ -74,3 +79,52 @@ class TestHuffmanNode(unittest.TestCase):
             leaves = [HuffmanNode(weight) for weight in range(1, n)]
             tree = HuffmanNode.build_tree(leaves)
             self.assertEqual(tree.weight, sum(leaf.weight for leaf in leaves))
+
+
+class TestHuffmanDecoder(unittest.TestCase):
+    def setUp(self):
+        self.leaves = [HuffmanNode(weight, weight) for weight in range(1, 300)]
+        self.decoder = HuffmanDecoder(HuffmanNode.build_tree(self.leaves))
+        self.code_dict = dict((leaf.code, leaf) for leaf in self.leaves)
+
+    def _random_data(self, size):
+        rand = random.Random(size)
+        return bytearray(rand.randint(0, 255) for x in range(size))
+
+    def _assert_same_as_code_dict(self, decoder, data):
+        bitstream = BitStream(data)
+        ghetto = GhettoBitStream(data)
+        while True:
+            expected = PathTree._get_leaf_from_dict(self.code_dict, ghetto)
+            self.assertTrue(decoder.decode(bitstream) is expected)
+            if expected is None:
+                break
+
+    def test_leaf_codes(self):
+        codes = HuffmanDecoder._leaf_codes(HuffmanNode.build_tree(self.leaves))
+        self.assertEqual(len(codes), len(self.leaves))
+        for length, code, leaf in codes:
+            self.assertEqual(leaf.code, bin(code)[2:].zfill(length))
+
+    def test_decode(self):
+        leaves = [HuffmanNode(weight, weight) for weight in range(1, 5)]
+        decoder = HuffmanDecoder(HuffmanNode.build_tree(leaves))
+        # codes '0', '10', '110', '111', '111', '111' and a partial '1'
+        bitstream = BitStream(bytearray([0x5b, 0xff]))
+        values = [decoder.decode(bitstream).value for x in range(6)]
+        self.assertEqual(values, [4, 3, 1, 2, 2, 2])
+        self.assertTrue(decoder.decode(bitstream) is None)
+
+    def test_same_as_code_dict(self):
+        self._assert_same_as_code_dict(self.decoder, self._random_data(500))
+
+    def test_long_codes(self):
+        # codes longer than the lookup table are decoded bit by bit
+        with patch.object(HuffmanDecoder, 'MAX_TABLE_BITS', 4):
+            decoder = HuffmanDecoder(HuffmanNode.build_tree(self.leaves))
+        self.assertTrue(decoder.long_codes)
+        self._assert_same_as_code_dict(decoder, self._random_data(500))
+
+    def test_single_node_tree(self):
+        decoder = HuffmanDecoder(HuffmanNode.build_tree([HuffmanNode(1, 'a')]))
+        self.assertTrue(decoder.decode(BitStream(bytearray([1]))) is None)
@@ -151,3 +151,14 @@ class TestPathTree(unittest.TestCase):
             self.assertTrue(pt.match_path('/foo/jarjar/binks'))
             self.assertTrue(pt.match_path('/foo/jarjar/bar'))
             self.assertFalse(pt.match_path('/foo/jarjar/notbinks'))
+
+    def test_match_shared_node(self):
+        # the same node can be reached through more than one parent
+        shared = {'os': [{PATH_END: None}]}
+        tree = {'foo': [{'$releasever': [shared], 'bar': [shared]}]}
+        data = open(DATA, 'rb').read()
+        pt = PathTree(data)
+        pt.path_tree = tree
+        self.assertTrue(pt.match_path('/foo/bar/os'))
+        self.assertTrue(pt.match_path('/foo/7Server/os'))
+        self.assertFalse(pt.match_path('/foo/bar/debug'))
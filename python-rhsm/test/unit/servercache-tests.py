@@ -0,0 +1,102 @@
+#
+# Copyright (c) 2017 Red Hat, Inc.
+#
+# This software is licensed to you under the GNU General Public License,
+# version 2 (GPLv2). There is NO WARRANTY for this software, express or
+# implied, including the implied warranties of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. You should have received a copy of GPLv2
+# along with this software; if not, see
+# http://www.gnu.org/licenses/old-licenses/gpl-2.0.txt.
+#
+# Red Hat trademarks are not licensed under GPLv2. No permission is
+# granted to use or replicate Red Hat trademarks that are incorporated
+# in this software or its documentation.
+#
+
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+from mock import patch
+
+from rhsm.servercache import ServerInfoCache, server_version
+
+URL = "https://somehost:443/candlepin"
+
+
+class ServerInfoCacheTests(unittest.TestCase):
+
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+        self.cache_file = os.path.join(self.cache_dir, 'server_info.json')
+
+    def tearDown(self):
+        shutil.rmtree(self.cache_dir)
+
+    def test_value_shared_between_instances(self):
+        ServerInfoCache(self.cache_file).put(URL, 'resources', {'pools': '/pools'})
+        cache = ServerInfoCache(self.cache_file)
+        self.assertEquals({'pools': '/pools'}, cache.get(URL, 'resources'))
+        self.assertEquals(None, cache.get("https://otherhost:443/candlepin", 'resources'))
+
+    def test_expired_value_ignored(self):
+        ServerInfoCache(self.cache_file).put(URL, 'capabilities', ['cores'])
+        cache = ServerInfoCache(self.cache_file, ttl=60)
+        with patch('rhsm.servercache.time.time', return_value=time.time() + 61):
+            self.assertEquals(None, cache.get(URL, 'capabilities'))
+        self.assertEquals(['cores'], cache.get(URL, 'capabilities'))
+
+    def test_version_change_invalidates(self):
+        cache = ServerInfoCache(self.cache_file)
+        cache.check_version(URL, '2.0.1-1')
+        cache.put(URL, 'capabilities', ['cores'])
+        cache.check_version(URL, '2.0.1-1')
+        self.assertEquals(['cores'], ServerInfoCache(self.cache_file).get(URL, 'capabilities'))
+
+        cache.check_version(URL, '2.1.0-1')
+        self.assertEquals(None, cache.get(URL, 'capabilities'))
+        self.assertEquals(None, ServerInfoCache(self.cache_file).get(URL, 'capabilities'))
+
+    def test_first_version_adopted(self):
+        cache = ServerInfoCache(self.cache_file)
+        cache.put(URL, 'resources', {'pools': '/pools'})
+        cache.check_version(URL, '2.0.1-1')
+        self.assertEquals({'pools': '/pools'},
+                ServerInfoCache(self.cache_file).get(URL, 'resources'))
+
+        cache.check_version(URL, '2.1.0-1')
+        self.assertEquals(None, cache.get(URL, 'resources'))
+
+    def test_updates_merged_with_other_processes(self):
+        first = ServerInfoCache(self.cache_file)
+        second = ServerInfoCache(self.cache_file)
+        first.get(URL, 'resources')
+        second.put("https://otherhost:443/candlepin", 'resources', {'pools': '/pools'})
+        first.put(URL, 'resources', {'owners': '/owners'})
+        cache = ServerInfoCache(self.cache_file)
+        self.assertEquals({'pools': '/pools'},
+                cache.get("https://otherhost:443/candlepin", 'resources'))
+        self.assertEquals({'owners': '/owners'}, cache.get(URL, 'resources'))
+
+    def test_corrupt_cache_ignored(self):
+        f = open(self.cache_file, 'w')
+        f.write('{not json')
+        f.close()
+        cache = ServerInfoCache(self.cache_file)
+        self.assertEquals(None, cache.get(URL, 'resources'))
+        cache.put(URL, 'resources', {})
+        self.assertEquals({}, ServerInfoCache(self.cache_file).get(URL, 'resources'))
+
+    def test_missing_cache_dir_not_created(self):
+        cache_file = os.path.join(self.cache_dir, 'missing', 'server_info.json')
+        cache = ServerInfoCache(cache_file)
+        cache.put(URL, 'resources', {})
+        self.assertFalse(os.path.exists(os.path.dirname(cache_file)))
+        self.assertEquals({}, cache.get(URL, 'resources'))
+
+    def test_server_version(self):
+        self.assertEquals('2.0.1-1', server_version({'version': '2.0.1', 'release': '1'}))
+        self.assertEquals(None, server_version({'result': True}))
+        self.assertEquals(None, server_version(None))
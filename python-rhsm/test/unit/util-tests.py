@@ -5,7 +5,7 @@ from rhsm.utils import remove_scheme, get_env_proxy_info, \
     ServerUrlParseErrorEmpty, ServerUrlParseErrorNone, \
     ServerUrlParseErrorPort, ServerUrlParseErrorScheme, \
     ServerUrlParseErrorJustScheme, has_bad_scheme, has_good_scheme, \
-    parse_url, cmd_name
+    parse_url, cmd_name, LRUCache
 from rhsm.config import DEFAULT_PORT, DEFAULT_PREFIX, DEFAULT_HOSTNAME
 
 
@@ -419,3 +419,34 @@ class TestCmdName(unittest.TestCase):
     def test_rhsmd(self):
         argv = ['/usr/libexec/rhsmd', '-i', '-f', 'valid']
         self.assertEquals("rhsmd", cmd_name(argv))
+
+
+class TestLRUCache(unittest.TestCase):
+    def setUp(self):
+        self.cache = LRUCache(max_size=3)
+        for key in ['a', 'b', 'c']:
+            self.cache[key] = key.upper()
+
+    def test_get(self):
+        self.assertEquals('A', self.cache.get('a'))
+        self.assertEquals(None, self.cache.get('z'))
+        self.assertEquals(False, self.cache.get('z', False))
+
+    def test_evicts_least_recently_used(self):
+        self.cache.get('a')
+        self.cache['d'] = 'D'
+        self.assertEquals(3, len(self.cache))
+        self.assertFalse('b' in self.cache)
+        self.assertTrue('a' in self.cache)
+        self.assertTrue('d' in self.cache)
+
+    def test_update_existing_key(self):
+        self.cache['a'] = 'AA'
+        self.cache['d'] = 'D'
+        self.assertEquals('AA', self.cache.get('a'))
+        self.assertFalse('b' in self.cache)
+
+    def test_clear(self):
+        self.cache.clear()
+        self.assertEquals(0, len(self.cache))
+        self.assertEquals(None, self.cache.get('a'))
@@ -19,6 +19,13 @@ import sys
 
 enable_debug = False
 
+# milliseconds between checks for cert dirs inotify can not watch yet
+CERT_DIR_POLL_INTERVAL = 60 * 1000
+
+# milliseconds without further cert changes before the status is checked,
+# a cert refresh writes and renames many files
+CERT_CHANGE_DELAY = 2 * 1000
+
 
 def excepthook_base(exc_type, exc_value, exc_traceback):
     # something failed before we even got logging setup
@@ -65,6 +72,7 @@ def excepthook_logging(exc_type, exc_value, exc_traceback):
 sys.excepthook = excepthook_logging
 
 from subscription_manager.ga import GObject as ga_GObject
+from subscription_manager.ga import GLib as ga_GLib
 from subscription_manager.injectioninit import init_dep_injection
 init_dep_injection()
 
@@ -175,9 +183,56 @@ class StatusChecker(dbus.service.Object):
         # this will get set after first invocation
         self.rhsm_icon_cache = require(RHSM_ICON_CACHE)
         self.keep_alive = keep_alive
+        # set by watch_certs
+        self.cert_monitor = None
+        self.cert_dir_poll = False
+        self.cert_change_timer = None
         self.force_signal = force_signal
         self.loop = loop
 
+    def watch_certs(self):
+        """
+        Check the status again whenever the entitlement, product or consumer
+        certs change, instead of waiting for the next check_status call.
+        Only useful with keep_alive.
+        """
+        sorter = require(CERT_SORTER)
+        cert_monitor = sorter.cert_monitor
+        if not cert_monitor.start_watching():
+            return
+        self.cert_monitor = cert_monitor
+        sorter.add_callback(self.on_certs_changed)
+        ga_GLib.io_add_watch(cert_monitor.fileno(), ga_GLib.PRIORITY_DEFAULT,
+                             ga_GLib.IO_IN, cert_monitor.process_events)
+        self._poll_unwatched_cert_dirs()
+
+    def _poll_unwatched_cert_dirs(self):
+        # cert dirs that do not exist (anymore) can only be polled for,
+        # until they appear and inotify watches them
+        if self.cert_dir_poll or self.cert_monitor.fully_watched():
+            return
+        self.cert_dir_poll = True
+        ga_GLib.timeout_add(CERT_DIR_POLL_INTERVAL, self._on_cert_dir_poll)
+
+    def _on_cert_dir_poll(self):
+        self.cert_monitor.update()
+        self.cert_dir_poll = not self.cert_monitor.fully_watched()
+        return self.cert_dir_poll
+
+    def on_certs_changed(self):
+        # wait for the burst of changes to end before checking once
+        if self.cert_change_timer is not None:
+            ga_GLib.source_remove(self.cert_change_timer)
+        self.cert_change_timer = ga_GLib.timeout_add(CERT_CHANGE_DELAY,
+                                                     self._on_certs_settled)
+
+    def _on_certs_settled(self):
+        self.cert_change_timer = None
+        debug("certificates changed, checking status")
+        self.check_status()
+        self._poll_unwatched_cert_dirs()
+        return False
+
     @dbus.service.signal(
         dbus_interface='com.redhat.SubscriptionManager.EntitlementStatus',
         signature='i')
@@ -333,6 +388,9 @@ def main():
     if options.immediate:
         checker.entitlement_status_changed(force_signal)
 
+    if options.keep_alive:
+        checker.watch_certs()
+
     loop.run()
 
 
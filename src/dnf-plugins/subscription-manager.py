@@ -15,13 +15,10 @@
 
 import os
 
+# Keep the imports here light, the rest is only imported when redhat.repo
+# needs to be updated, see subscription_manager.repofingerprint.
 from subscription_manager import injection as inj
-from subscription_manager.repolib import RepoActionInvoker
-from rhsmlib.facts.hwprobe import ClassicCheck
-from subscription_manager.utils import chroot
-from subscription_manager.injectioninit import init_dep_injection
-from subscription_manager import logutil
-from rhsm import connection
+from subscription_manager.repofingerprint import RepoFingerprint, valid_until
 from rhsm import config
 
 from dnfpluginscore import _, logger
@@ -53,31 +50,68 @@ class SubscriptionManager(dnf.Plugin):
 
     def config(self):
         """ update """
+        cfg = config.initConfig()
+        cache_only = not bool(cfg.get_int('rhsm', 'full_refresh_on_yum'))
+
+        fingerprint = self._fingerprint(cfg, cache_only)
+        if fingerprint:
+            messages = fingerprint.check()
+            if messages is not None:
+                logger.debug(_('Subscription Management repositories are up to date.'))
+                for level, msg in messages:
+                    logger.info(msg)
+                return
+            fingerprint.begin()
+
+        from subscription_manager.injectioninit import init_dep_injection
+        from subscription_manager.utils import chroot
+        from subscription_manager import logutil
+
         logutil.init_logger_for_yum()
 
         init_dep_injection()
 
         chroot(self.base.conf.installroot)
 
-        cfg = config.initConfig()
-        cache_only = not bool(cfg.get_int('rhsm', 'full_refresh_on_yum'))
-
+        self.messages = []
         try:
+            report = None
             if os.getuid() == 0:
-                self._update(cache_only)
+                report = self._update(cache_only)
                 self._warnOrGiveUsageMessage()
             else:
                 logger.info(_('Not root, Subscription Management repositories not updated'))
             self._warnExpired()
+            if fingerprint and report:
+                ent_dir = inj.require(inj.ENT_DIR)
+                fingerprint.save(self.messages, valid_until(ent_dir.list()))
         except Exception as e:
             logger.error(str(e))
 
+    def _fingerprint(self, cfg, cache_only):
+        """
+        Return the RepoFingerprint of redhat.repo, or None if the plugin
+        must always update it.
+        """
+        if not cache_only or os.getuid() != 0 or config.in_container():
+            return None
+        if self.base.conf.installroot not in (None, '', '/'):
+            return None
+        return RepoFingerprint(cfg, releasever=self.base.conf.releasever)
+
+    def _warn(self, msg):
+        # same format as the yum plugin, which shares the fingerprint
+        self.messages.append([2, msg])
+        logger.info(msg)
+
     def _update(self, cache_only):
         """ update entitlement certificates """
         logger.info(_('Updating Subscription Management repositories.'))
 
         # XXX: Importing inline as you must be root to read the config file
         from subscription_manager.identity import ConsumerIdentity
+        from subscription_manager.repolib import RepoActionInvoker
+        from rhsm import connection
 
         cert_file = str(ConsumerIdentity.certpath())
         key_file = str(ConsumerIdentity.keypath())
@@ -101,7 +135,7 @@ class SubscriptionManager(dnf.Plugin):
             logger.info(_("Subscription Manager is operating in container mode."))
 
         rl = RepoActionInvoker(cache_only=cache_only)
-        rl.update()
+        return rl.update()
 
     def _warnExpired(self):
         """ display warning for expired entitlements """
@@ -113,10 +147,11 @@ class SubscriptionManager(dnf.Plugin):
                 products.add(m)
         if products:
             msg = expired_warning % '\n'.join(sorted(products))
-            logger.info(msg)
+            self._warn(msg)
 
     def _warnOrGiveUsageMessage(self):
         """ either output a warning, or a usage message """
+        from rhsmlib.facts.hwprobe import ClassicCheck
         msg = ""
         if ClassicCheck().is_registered_with_classic():
             return
@@ -131,4 +166,4 @@ class SubscriptionManager(dnf.Plugin):
 
         finally:
             if msg:
-                logger.info(msg)
+                self._warn(msg)
@@ -60,6 +60,8 @@ def posttrans_hook(conduit):
 class YumProductManager(ProductManager):
     def __init__(self, base):
         self.base = base
+        # active repos for the rpmdb of this transaction, see get_active
+        self._active = None
         ProductManager.__init__(self)
 
     def update_all(self):
@@ -99,6 +101,16 @@ class YumProductManager(ProductManager):
     def get_active(self):
         """find yum repos that have packages installed"""
 
+        # The installed packages don't change for the rest of the
+        # transaction, so we only have to work this out once.
+        if self._active is not None:
+            return self._active
+
+        # name, arch of every installed package, read from the rpmdb
+        # once instead of searching it for each available package
+        installed_na = set((pkgtup[0], pkgtup[1])
+                           for pkgtup in self.base.rpmdb.simplePkgList())
+
         active = set([])
 
         # If a package is in a enabled and 'protected' repo
@@ -109,13 +121,20 @@ class YumProductManager(ProductManager):
 
         for p in packages:
             repo = p.repoid
+            # The pkg is installed, so the repo it was installed
+            # from is considered 'active'
+            # yum on 5.7 list everything as "installed" instead
+            # of the repo it came from
+            if repo in (None, "installed") or repo in active:
+                continue
+
             # if a pkg is in multiple repo's, this will consider
             # all the repo's with the pkg "active".
             # NOTE: if a package is from a disabled repo, we won't
             # find it with this, because 'packages' won't include it.
-            db_pkg = self.base.rpmdb.searchNevra(name=p.name, arch=p.arch)
-            # that pkg is not actually installed
-            if not db_pkg:
+            if (p.name, p.arch) not in installed_na:
+                # that pkg is not actually installed
+                #
                 # Effect of this is that a package that is only
                 # available from disabled repos, it is not considered
                 # an active package.
@@ -131,14 +150,9 @@ class YumProductManager(ProductManager):
                 # that repo or be updated with makes the repo 'active'.
                 continue
 
-            # The pkg is installed, so the repo it was installed
-            # from is considered 'active'
-            # yum on 5.7 list everything as "installed" instead
-            # of the repo it came from
-            if repo in (None, "installed"):
-                continue
             active.add(repo)
 
+        self._active = active
         return active
 
     def check_version_tracks_repos(self):
@@ -18,14 +18,11 @@
 import os
 from yum.plugins import TYPE_CORE, TYPE_INTERACTIVE
 
+# Keep the imports here light, the rest is only imported when redhat.repo
+# needs to be updated, see subscription_manager.repofingerprint.
 from subscription_manager import injection as inj
-from subscription_manager.repolib import RepoActionInvoker
-from rhsmlib.facts.hwprobe import ClassicCheck
 from subscription_manager.certlib import Locker
-from subscription_manager.utils import chroot
-from subscription_manager.injectioninit import init_dep_injection
-from subscription_manager import logutil
-from rhsm import connection
+from subscription_manager.repofingerprint import RepoFingerprint, valid_until
 from rhsm import config
 
 requires_api_version = '2.5'
@@ -77,6 +74,20 @@ class YumRepoLocker(Locker):
             self.lock.release()
 
 
+class MessageRecorder(object):
+    """
+    Passes messages on to the conduit, keeping them so they can be repeated
+    while redhat.repo is up to date.
+    """
+    def __init__(self, conduit):
+        self.conduit = conduit
+        self.messages = []
+
+    def info(self, level, msg):
+        self.messages.append([level, msg])
+        self.conduit.info(level, msg)
+
+
 def update(conduit, cache_only):
     """ update entitlement certificates """
     if os.getuid() != 0:
@@ -86,6 +97,8 @@ def update(conduit, cache_only):
 
     # XXX: Importing inline as you must be root to read the config file
     from subscription_manager.identity import ConsumerIdentity
+    from subscription_manager.repolib import RepoActionInvoker
+    from rhsm import connection
 
     cert_file = ConsumerIdentity.certpath()
     key_file = ConsumerIdentity.keypath()
@@ -109,7 +122,7 @@ def update(conduit, cache_only):
         conduit.info(3, "Subscription Manager is operating in container mode.")
 
     rl = RepoActionInvoker(cache_only=cache_only, locker=YumRepoLocker(conduit=conduit))
-    rl.update()
+    return rl.update()
 
 
 def warnExpired(conduit):
@@ -134,6 +147,7 @@ def warnOrGiveUsageMessage(conduit):
     # TODO: refactor so there are not two checks for this
     if os.getuid() != 0:
         return
+    from rhsmlib.facts.hwprobe import ClassicCheck
     if ClassicCheck().is_registered_with_classic():
         return
     try:
@@ -152,10 +166,43 @@ def warnOrGiveUsageMessage(conduit):
             conduit.info(2, msg)
 
 
+def get_fingerprint(conduit, cfg, cache_only):
+    """
+    Return the RepoFingerprint of redhat.repo, or None if the plugin must
+    always update it.
+    """
+    yum_conf = conduit.getConf()
+    if not cache_only or os.getuid() != 0 or config.in_container():
+        return None
+    if yum_conf.installroot not in (None, '', '/'):
+        return None
+    releasever = getattr(yum_conf, 'yumvar', {}).get('releasever')
+    return RepoFingerprint(cfg, releasever=releasever)
+
+
 def postconfig_hook(conduit):
     """ update """
     # register rpm name for yum history recording"
     # yum on 5.7 doesn't have this method, so check for it
+    if hasattr(conduit, 'registerPackageName'):
+        conduit.registerPackageName("subscription-manager")
+
+    cfg = config.initConfig()
+    cache_only = not bool(cfg.get_int('rhsm', 'full_refresh_on_yum'))
+
+    fingerprint = get_fingerprint(conduit, cfg, cache_only)
+    if fingerprint:
+        messages = fingerprint.check()
+        if messages is not None:
+            conduit.info(3, 'Subscription Management repositories are up to date.')
+            for level, msg in messages:
+                conduit.info(level, msg)
+            return
+        fingerprint.begin()
+
+    from subscription_manager.injectioninit import init_dep_injection
+    from subscription_manager.utils import chroot
+    from subscription_manager import logutil
 
     logutil.init_logger_for_yum()
 
@@ -165,14 +212,13 @@ def postconfig_hook(conduit):
     # we must update entitlements in that directory.
     chroot(conduit.getConf().installroot)
 
-    cfg = config.initConfig()
-    cache_only = not bool(cfg.get_int('rhsm', 'full_refresh_on_yum'))
-
-    if hasattr(conduit, 'registerPackageName'):
-        conduit.registerPackageName("subscription-manager")
     try:
-        update(conduit, cache_only)
-        warnOrGiveUsageMessage(conduit)
-        warnExpired(conduit)
+        report = update(conduit, cache_only)
+        recorder = MessageRecorder(conduit)
+        warnOrGiveUsageMessage(recorder)
+        warnExpired(recorder)
+        if fingerprint and report:
+            ent_dir = inj.require(inj.ENT_DIR)
+            fingerprint.save(recorder.messages, valid_until(ent_dir.list()))
     except Exception as e:
         conduit.error(2, str(e))
@@ -18,6 +18,7 @@ import dbus
 import rhsm.config
 
 from rhsmlib.facts import collector, host_collector, hwprobe, custom
+from rhsmlib.facts.collector import CollectionRun, FactsCache
 from rhsmlib.dbus import util, base_object
 from rhsmlib.dbus.facts import constants
 
@@ -34,15 +35,30 @@ class BaseFacts(base_object.BaseObject):
 
         # Default is an empty FactsCollector
         self.facts_collector = self.facts_collector_class()
+        self.facts_cache = FactsCache()
 
     @util.dbus_service_method(
         dbus_interface=constants.FACTS_DBUS_INTERFACE,
         out_signature='a{ss}')
     @util.dbus_handle_exceptions
     def GetFacts(self, sender=None):
-        collection = self.facts_collector.collect()
-        cleaned = dict([(str(key), str(value)) for key, value in collection.data.items()])
-        return dbus.Dictionary(cleaned, signature="ss")
+        collection_run = CollectionRun(cache=self.facts_cache)
+        return dbus.Dictionary(self.get_facts(collection_run), signature="ss")
+
+    @util.dbus_service_method(
+        dbus_interface=constants.FACTS_DBUS_INTERFACE,
+        out_signature='a{ss}')
+    @util.dbus_handle_exceptions
+    def RefreshFacts(self, sender=None):
+        """Like GetFacts, but collect everything again instead of using
+        cached facts."""
+        collection_run = CollectionRun(cache=self.facts_cache, refresh=True)
+        return dbus.Dictionary(self.get_facts(collection_run), signature="ss")
+
+    def get_facts(self, collection_run):
+        """Return the facts as a dict of strings, collected as part of collection_run."""
+        collection = self.facts_collector.collect(collection_run)
+        return dict([(str(key), str(value)) for key, value in collection.data.items()])
 
 
 class AllFacts(base_object.BaseObject):
@@ -62,22 +78,40 @@ class AllFacts(base_object.BaseObject):
             ("Custom", CustomFacts),
         ]
 
+        # Cached facts are shared by all the child objects, so a refresh
+        # through any of them is seen by the others.
+        self.facts_cache = FactsCache()
         self.collectors = []
         for path, clazz in collector_definitions:
             sub_path = self.default_dbus_path + "/" + path
-            self.collectors.append(
-                (path, clazz(conn=conn, object_path=sub_path, bus_name=bus_name))
-            )
+            facts_object = clazz(conn=conn, object_path=sub_path, bus_name=bus_name)
+            facts_object.facts_cache = self.facts_cache
+            self.collectors.append((path, facts_object))
 
     @util.dbus_service_method(
         dbus_interface=constants.FACTS_DBUS_INTERFACE,
         out_signature='a{ss}')
     @util.dbus_handle_exceptions
     def GetFacts(self, sender=None):
+        return dbus.Dictionary(self._get_facts(refresh=False), signature="ss")
+
+    @util.dbus_service_method(
+        dbus_interface=constants.FACTS_DBUS_INTERFACE,
+        out_signature='a{ss}')
+    @util.dbus_handle_exceptions
+    def RefreshFacts(self, sender=None):
+        """Like GetFacts, but collect everything again instead of using
+        cached facts."""
+        return dbus.Dictionary(self._get_facts(refresh=True), signature="ss")
+
+    def _get_facts(self, refresh):
+        # HostFacts already runs the hardware and custom collectors, with
+        # one CollectionRun every collector only runs once per request.
+        collection_run = CollectionRun(cache=self.facts_cache, refresh=refresh)
         results = {}
         for name, fact_collector in self.collectors:
-            results.update(fact_collector.GetFacts())
-        return dbus.Dictionary(results, signature="ss")
+            results.update(fact_collector.get_facts(collection_run))
+        return results
 
     def remove_from_connection(self, connection=None, path=None):
         # Call remove_from_connection on all the child objects first
@@ -56,6 +56,9 @@ class FactsClient(object):
     def GetFacts(self, *args, **kwargs):
         return self.interface.GetFacts(*args, **kwargs)
 
+    def RefreshFacts(self, *args, **kwargs):
+        return self.interface.RefreshFacts(*args, **kwargs)
+
     def _on_bus_disconnect(self, connection):
         self.dbus_proxy_object = None
         log.debug("Disconnected from FactsService")
@@ -11,14 +11,21 @@
 # granted to use or replicate Red Hat trademarks that are incorporated
 # in this software or its documentation.
 #
+import functools
 import logging
 import os
 import platform
+import sys
+import threading
+import time
 
 from rhsmlib.facts import collection
 
 log = logging.getLogger(__name__)
 
+# Changes on every boot, cached facts from a previous boot are never used
+BOOT_ID_FILE = "/proc/sys/kernel/random/boot_id"
+
 
 def get_arch(prefix=None):
     """Get the systems architecture.
@@ -53,10 +60,242 @@ def get_arch(prefix=None):
         log.exception(e)
         raise
 
+
+def read_boot_id():
+    try:
+        with open(BOOT_ID_FILE, 'r') as boot_id_fd:
+            return boot_id_fd.read().strip()
+    except IOError:
+        return None
+
+
+def source_stamp(path):
+    """Identify the current state of a file or directory used as a source
+    of facts. Returns None if path does not exist.
+
+    Directories are identified by their mtime and the names they contain,
+    so adding or removing entries (ie, a network interface under
+    /sys/class/net) changes the stamp as well."""
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    if os.path.isdir(path):
+        try:
+            return (st.st_mtime, tuple(sorted(os.listdir(path))))
+        except OSError:
+            return (st.st_mtime,)
+    return (st.st_mtime, st.st_size, st.st_ino)
+
+
+class ProbeTimeout(Exception):
+    pass
+
+
+def call_concurrently(funcs, timeout=None):
+    """Call each of funcs in a thread of its own and wait for them all.
+
+    Returns, in the order of funcs, a (result, exception) tuple for each
+    call. A call still running timeout seconds after they were started is
+    abandoned (its thread keeps running as a daemon) and gets a
+    ProbeTimeout as its exception."""
+    outcomes = [(None, ProbeTimeout())] * len(funcs)
+    finished = threading.Semaphore(0)
+    timed_out = []
+
+    def call(index, func):
+        try:
+            outcomes[index] = (func(), None)
+        except Exception:
+            outcomes[index] = (None, sys.exc_info()[1])
+        finished.release()
+
+    for index, func in enumerate(funcs):
+        thread = threading.Thread(target=call, args=(index, func))
+        thread.setDaemon(True)
+        thread.start()
+
+    # A timed wait polls on python 2, which would add its latency to every
+    # call. Wait without a timeout instead, and let a timer wake us up.
+    timer = None
+    if timeout is not None:
+        def expire():
+            timed_out.append(True)
+            finished.release()
+        timer = threading.Timer(timeout, expire)
+        timer.setDaemon(True)
+        timer.start()
+    try:
+        for func in funcs:
+            finished.acquire()
+            if timed_out:
+                break
+    finally:
+        if timer is not None:
+            timer.cancel()
+    # copied, so late finishing threads do not change what callers see
+    return list(outcomes)
+
+
+class FactsCache(object):
+    """Facts of collectors that declare a cache_ttl, kept between requests.
+
+    An entry is used until its collector's cache_ttl passes or the
+    collector's cache_fingerprint() changes, whichever comes first. The
+    facts service keeps one FactsCache for its lifetime."""
+
+    def __init__(self):
+        self._entries = {}
+
+    def get(self, key, fingerprint, ttl):
+        """Return the cached facts for key, or None if there are none or they
+        are stale."""
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        collected, cached_fingerprint, facts = entry
+        age = time.time() - collected
+        # a clock that went backwards invalidates as well
+        if age < 0 or age >= ttl or cached_fingerprint != fingerprint:
+            self._entries.pop(key, None)
+            return None
+        return dict(facts)
+
+    def put(self, key, fingerprint, facts):
+        self._entries[key] = (time.time(), fingerprint, dict(facts))
+
+    def clear(self):
+        self._entries = {}
+
+
+class CollectionRun(object):
+    """Results of the collectors used to answer one facts request.
+
+    Several collectors (and the collectors those run) can share a
+    CollectionRun, each distinct collector is then only run once and the
+    time it took is logged.
+
+    If a FactsCache is given, collectors with a cache_ttl are served from
+    it while their results are still fresh. With refresh=True they are all
+    run again and the cache is updated with the new results."""
+
+    def __init__(self, cache=None, refresh=False):
+        self._results = {}
+        self.cache = cache
+        self.refresh = refresh
+        # Collectors of a run can be running in several threads, a
+        # collector already running in one of them is waited for instead
+        # of being run again.
+        self._lock = threading.Lock()
+        self._running = {}
+        # Collectors which failed or were given up on, the rest of the run
+        # goes on without their facts rather than waiting or trying again.
+        self._skipped = set()
+
+    def get_all(self, facts_collector):
+        """Return facts_collector.get_all(), running it only on first use.
+
+        While it runs, facts_collector.collection_run is set to this run,
+        so the collectors it uses are shared as well."""
+        key = facts_collector.run_key()
+        while True:
+            self._lock.acquire()
+            try:
+                if key in self._results:
+                    return self._results[key]
+                if key in self._skipped:
+                    log.debug("%s skipped in this run" % facts_collector.__class__.__name__)
+                    return {}
+                running = self._running.get(key)
+                if running is None:
+                    running = self._running[key] = threading.Event()
+                    break
+            finally:
+                self._lock.release()
+            # set once it finished, failed or was skipped
+            running.wait()
+
+        try:
+            facts = self._collect(key, facts_collector)
+            self._results[key] = facts
+            return facts
+        except Exception:
+            self._lock.acquire()
+            try:
+                self._skipped.add(key)
+            finally:
+                self._lock.release()
+            raise
+        finally:
+            self._lock.acquire()
+            try:
+                del self._running[key]
+            finally:
+                self._lock.release()
+            running.set()
+
+    def skip(self, facts_collector):
+        """Go on without the facts of a collector that is still running.
+
+        Whoever waits for it in this run, now or later, gets no facts
+        instead."""
+        key = facts_collector.run_key()
+        self._lock.acquire()
+        try:
+            self._skipped.add(key)
+            running = self._running.get(key)
+        finally:
+            self._lock.release()
+        if running is not None:
+            running.set()
+
+    def _collect(self, key, facts_collector):
+        cacheable = self.cache is not None and facts_collector.cache_ttl
+        if cacheable:
+            # Taken before collecting, so a change while the collector runs
+            # invalidates what it collected.
+            fingerprint = facts_collector.cache_fingerprint()
+            if not self.refresh:
+                facts = self.cache.get(key, fingerprint, facts_collector.cache_ttl)
+                if facts is not None:
+                    log.debug("%s facts served from cache" % facts_collector.__class__.__name__)
+                    return facts
+
+        previous_run = facts_collector.collection_run
+        facts_collector.collection_run = self
+        start = time.time()
+        try:
+            facts = facts_collector.get_all()
+        finally:
+            facts_collector.collection_run = previous_run
+        log.debug("%s collected %s facts in %.3f seconds" %
+                  (facts_collector.__class__.__name__, len(facts), time.time() - start))
+
+        if cacheable:
+            self.cache.put(key, fingerprint, facts)
+        return facts
+
 # An empty FactsCollector should just return an empty dict on get_all()
 
 
 class FactsCollector(object):
+    # set while running as part of a CollectionRun
+    collection_run = None
+
+    # Seconds the facts of this collector may be served from a FactsCache,
+    # None if they are always collected again.
+    cache_ttl = None
+    # Files and directories the facts are read from, cached facts are
+    # invalidated as soon as one of them changes.
+    cache_sources = ()
+
+    # Run the hardware_methods in parallel threads. Only for collectors
+    # whose methods are independent of each other, ie, that do not share
+    # state through self.
+    concurrent_hardware_methods = False
+    # Seconds to wait for a concurrent probe before going on without it
+    probe_timeout = 120
+
     def __init__(self, arch=None, prefix=None, testing=None,
                  hardware_methods=None, collected_hw_info=None):
         """Base class for facts collecting classes.
@@ -78,33 +317,100 @@ class FactsCollector(object):
 
         self.hardware_methods = hardware_methods or []
 
-    def collect(self):
-        """Return a FactsCollection iterable."""
+    def collect(self, collection_run=None):
+        """Return a FactsCollection iterable.
+
+        If a CollectionRun is given, results of collectors that already ran
+        in it are reused."""
         facts_dict = collection.FactsDict()
-        facts_dict.update(self.get_all())
+        if collection_run is None:
+            facts_dict.update(self.get_all())
+        else:
+            facts_dict.update(collection_run.get_all(self))
         facts_collection = collection.FactsCollection(facts_dict=facts_dict)
         return facts_collection
 
+    def run_key(self):
+        """Collectors with the same run_key collect the same facts."""
+        return (self.__class__, self.prefix, self.testing, self.arch)
+
+    def cache_fingerprint(self):
+        """Identify the state of the system the cached facts depend on.
+
+        Cached facts are only used while this stays the same. By default
+        this is the boot id plus the stamps of the cache_sources."""
+        fingerprint = [read_boot_id()]
+        for path in self.cache_sources:
+            fingerprint.append(source_stamp(self.prefix + path))
+        return fingerprint
+
+    def _collect_from(self, facts_collector):
+        """Return the facts of another collector, shared with the rest of
+        the current CollectionRun if there is one."""
+        if self.collection_run is None:
+            return facts_collector.get_all()
+        return self.collection_run.get_all(facts_collector)
+
+    def _collect_concurrently(self, facts_collectors):
+        """Return the facts of several independent collectors, in the same
+        order, running the collectors at the same time.
+
+        A collector that does not finish within probe_timeout seconds is
+        logged and contributes no facts."""
+        outcomes = call_concurrently(
+            [functools.partial(self._collect_from, c) for c in facts_collectors],
+            timeout=self.probe_timeout
+        )
+        results = []
+        for facts_collector, (facts, e) in zip(facts_collectors, outcomes):
+            if isinstance(e, ProbeTimeout):
+                log.warn("%s did not finish within %s seconds, skipping its facts" %
+                         (facts_collector.__class__.__name__, self.probe_timeout))
+                if self.collection_run is not None:
+                    self.collection_run.skip(facts_collector)
+                facts = {}
+            elif e is not None:
+                raise e
+            results.append(facts)
+        return results
+
     def get_all(self):
         # try each hardware method, and try/except around, since
         # these tend to be fragile
+        if self.concurrent_hardware_methods:
+            outcomes = call_concurrently(self.hardware_methods, timeout=self.probe_timeout)
+        else:
+            outcomes = [self._call_hardware_method(method) for method in self.hardware_methods]
+
+        # merged in the order of hardware_methods, so later methods still
+        # override what earlier ones found
         all_hw_info = {}
-        for hardware_method in self.hardware_methods:
-            info_dict = {}
-            try:
-                info_dict = hardware_method()
-            except Exception as e:
+        for hardware_method, (info_dict, e) in zip(self.hardware_methods, outcomes):
+            if e is not None:
+                if isinstance(e, ProbeTimeout):
+                    e = "no result after %s seconds" % self.probe_timeout
                 log.warn("Hardware detection [%s] failed: %s" % (hardware_method.__name__, e))
+                info_dict = {}
 
             all_hw_info.update(info_dict)
 
         return all_hw_info
 
+    @staticmethod
+    def _call_hardware_method(hardware_method):
+        try:
+            return (hardware_method(), None)
+        except Exception as e:
+            return (None, e)
+
 
 class StaticFactsCollector(FactsCollector):
     def __init__(self, static_facts, **kwargs):
         super(FactsCollector, self).__init__(**kwargs)
         self.static_facts = static_facts
 
+    def run_key(self):
+        return (self.__class__, id(self))
+
     def get_all(self):
         return self.static_facts
@@ -16,7 +16,7 @@ import glob
 import logging
 
 from rhsm import ourjson
-from rhsmlib.facts.collector import FactsCollector
+from rhsmlib.facts.collector import FactsCollector, source_stamp
 
 log = logging.getLogger(__name__)
 
@@ -95,6 +95,10 @@ class CustomFactsDirectories(object):
 
 
 class CustomFactsCollector(FactsCollector):
+    # Invalidated by any change to the facts files, the TTL only bounds how
+    # long a missed change (ie, an edit within the same second) is served.
+    cache_ttl = 60 * 60
+
     def __init__(self, prefix=None, testing=None, collected_hw_info=None,
                  path_and_globs=None):
         super(CustomFactsCollector, self).__init__(
@@ -105,6 +109,19 @@ class CustomFactsCollector(FactsCollector):
         self.path_and_globs = path_and_globs
         self.facts_directories = CustomFactsDirectories(self.path_and_globs)
 
+    def run_key(self):
+        paths_and_globs = tuple((os.path.normpath(path), pattern)
+                                for (path, pattern) in self.path_and_globs or [])
+        return super(CustomFactsCollector, self).run_key() + (paths_and_globs,)
+
+    def cache_fingerprint(self):
+        fingerprint = super(CustomFactsCollector, self).cache_fingerprint()
+        for path, glob_pattern in self.path_and_globs or []:
+            fingerprint.append(source_stamp(path))
+            for fact_file_path in sorted(glob.glob(os.path.join(path, glob_pattern))):
+                fingerprint.append((fact_file_path, source_stamp(fact_file_path)))
+        return fingerprint
+
     def get_all(self):
         facts_dict = {}
         for facts_dir in self.facts_directories:
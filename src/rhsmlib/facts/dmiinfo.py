@@ -37,6 +37,9 @@ FIRMWARE_DUMP_FILENAME = "dmi.dump"
 
 
 class DmiFirmwareInfoCollector(collector.FactsCollector):
+    # DMI tables only change with a reboot, which changes the boot id
+    cache_ttl = 24 * 60 * 60
+
     def __init__(self, prefix=None, testing=None, collected_hw_info=None):
         super(DmiFirmwareInfoCollector, self).__init__(
             prefix=prefix,
@@ -63,7 +63,11 @@ class FirmwareCollector(collector.FactsCollector):
         )
 
         # Pass in collected hardware so DMI etc can potentially override it
-        firmware_info_dict = firmware_info_collector.get_all()
+        if isinstance(firmware_info_collector, collector.FactsCollector):
+            # shared with the rest of the run, and cached if possible
+            firmware_info_dict = self._collect_from(firmware_info_collector)
+        else:
+            firmware_info_dict = firmware_info_collector.get_all()
         # This can potentially clobber facts that already existed in self.allhw
         # (and is supposed to).
         return firmware_info_dict
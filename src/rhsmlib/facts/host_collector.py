@@ -50,25 +50,37 @@ class HostCollector(collector.FactsCollector):
     facts_glob = '*.facts'
 
     def get_all(self):
+        if self.collection_run is None:
+            # The probes started below share their results through a
+            # CollectionRun.
+            return collector.CollectionRun().get_all(self)
+
         host_facts = {}
         hardware_collector = hwprobe.HardwareCollector(
             prefix=self.prefix,
             testing=self.testing
         )
-        hardware_info = hardware_collector.get_all()
-
         firmware_collector = firmware_info.FirmwareCollector(
             prefix=self.prefix,
             testing=self.testing,
         )
-        firmware_info_dict = firmware_collector.get_all()
+        # virt-what does not need any other facts, so it is started along
+        # with the hardware and firmware probes. VirtCollector below then
+        # gets its result from the collection run.
+        virt_what_collector = virt.VirtWhatCollector(
+            prefix=self.prefix,
+            testing=self.testing
+        )
+        hardware_info, firmware_info_dict, virt_what_info = self._collect_concurrently(
+            [hardware_collector, firmware_collector, virt_what_collector]
+        )
 
         virt_collector = virt.VirtCollector(
             prefix=self.prefix,
             testing=self.testing,
             collected_hw_info=firmware_info_dict
         )
-        virt_collector_info = virt_collector.get_all()
+        virt_collector_info = self._collect_from(virt_collector)
 
         host_facts.update(hardware_info)
         host_facts.update(virt_collector_info)
@@ -83,7 +95,7 @@ class HostCollector(collector.FactsCollector):
             testing=self.testing,
             path_and_globs=path_and_globs
         )
-        custom_facts_dict = custom_facts.get_all()
+        custom_facts_dict = self._collect_from(custom_facts)
         host_facts.update(custom_facts_dict)
 
         locale_info = {}
@@ -98,7 +110,7 @@ class HostCollector(collector.FactsCollector):
             testing=self.testing,
             collected_hw_info=host_facts
         )
-        cleanup_info = cleanup_collector.get_all()
+        cleanup_info = self._collect_from(cleanup_collector)
 
         host_facts.update(cleanup_info)
         return host_facts
@@ -97,6 +97,22 @@ class GenericPlatformSpecificInfoProvider(object):
 
 
 class HardwareCollector(collector.FactsCollector):
+    # CPU, memory and distribution facts only change with a reboot or a
+    # package update, but there is no cheap way to notice an address change
+    # on an existing network interface, so keep the facts for a few minutes.
+    cache_ttl = 5 * 60
+    cache_sources = (
+        '/etc/os-release',
+        '/etc/redhat-release',
+        '/etc/hostname',
+        '/etc/hosts',
+        '/sys/class/net',
+    )
+
+    # The methods below only read the system, lscpu, hostname -f and the
+    # address lookups in get_network_info can then overlap.
+    concurrent_hardware_methods = True
+
     def __init__(self, arch=None, prefix=None, testing=None, collected_hw_info=None):
         super(HardwareCollector, self).__init__(
             arch=arch,
@@ -116,6 +132,17 @@ class HardwareCollector(collector.FactsCollector):
             self.get_network_interfaces,
         ]
 
+    def cache_fingerprint(self):
+        fingerprint = super(HardwareCollector, self).cache_fingerprint()
+        fingerprint.append(socket.gethostname())
+        # CPUs can be taken online and offline without a reboot
+        try:
+            with open(self.prefix + '/sys/devices/system/cpu/online', 'r') as online_fd:
+                fingerprint.append(online_fd.read().strip())
+        except IOError:
+            fingerprint.append(None)
+        return fingerprint
+
     def get_uname_info(self):
         uname_info = {}
         uname_data = os.uname()
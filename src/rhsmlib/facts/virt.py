@@ -30,6 +30,10 @@ _ = gettext.gettext
 
 
 class VirtWhatCollector(collector.FactsCollector):
+    # The hypervisor can only change across a reboot (or a migration, which
+    # the TTL covers), and running virt-what is slow.
+    cache_ttl = 60 * 60
+
     def get_all(self):
         return self.get_virt_info()
 
@@ -145,10 +149,10 @@ class VirtCollector(collector.FactsCollector):
         virt_info = {}
 
         virt_what_collector = VirtWhatCollector(prefix=self.prefix, testing=self.testing)
-        virt_what_info = virt_what_collector.get_all()
+        virt_what_info = self._collect_from(virt_what_collector)
         virt_info.update(virt_what_info)
 
-        if virt_what_info['virt.is_guest']:
+        if virt_what_info.get('virt.is_guest'):
             virt_uuid_collector = VirtUuidCollector(
                 prefix=self.prefix,
                 testing=self.testing,
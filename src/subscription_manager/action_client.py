@@ -56,6 +56,19 @@ class ActionClient(base_action_client.BaseActionClient):
 
         return lib_set
 
+    def _get_lib_dependencies(self):
+        # repos are generated from the entitlement certs, the uploads only
+        # need a current identity cert, and none of them need the repos.
+        # The repo update also reads the identity cert, which idcertlib
+        # rewrites in place, so it waits for that too.
+        return {
+            self.idcertlib: [self.entcertlib],
+            self.content_client: [self.entcertlib, self.idcertlib],
+            self.factlib: [self.idcertlib],
+            self.profilelib: [self.idcertlib],
+            self.installedprodlib: [self.idcertlib],
+        }
+
 
 class HealingActionClient(base_action_client.BaseActionClient):
     def _get_libset(self):
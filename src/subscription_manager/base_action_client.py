@@ -14,6 +14,8 @@
 # in this software or its documentation.
 #
 import logging
+import sys
+import threading
 
 from subscription_manager import injection as inj
 
@@ -27,6 +29,9 @@ class BaseActionClient(object):
     An object used to update the certficates, yum repos, and facts for the system.
     """
 
+    # most libs that can run at the same time, see _get_lib_dependencies
+    max_concurrent_libs = 4
+
     def __init__(self):
 
         self._libset = self._get_libset()
@@ -37,6 +42,17 @@ class BaseActionClient(object):
     def _get_libset(self):
         return []
 
+    def _get_lib_dependencies(self):
+        """
+        Return a dict mapping a lib from the libset to the libs that have
+        to finish before it can start. Libs without an entry have no
+        dependencies, and libs can only depend on libs that come before
+        them in the libset. Independent libs are run concurrently.
+
+        The default of None runs every lib after the previous one.
+        """
+        return None
+
     def update(self, autoheal=False):
         """
         Update I{entitlement} certificates and corresponding
@@ -76,6 +92,10 @@ class BaseActionClient(object):
 
     def _run_updates(self, autoheal):
 
+        dependencies = self._get_lib_dependencies()
+        if dependencies is not None:
+            return self._run_updates_concurrently(list(self._libset), dependencies)
+
         update_reports = []
 
         for lib in self._libset:
@@ -86,3 +106,65 @@ class BaseActionClient(object):
             update_reports.append(update_report)
 
         return update_reports
+
+    def _run_updates_concurrently(self, libs, dependencies):
+        """
+        Run each lib in its own thread as soon as the libs it depends on
+        are done, with at most max_concurrent_libs running at once.
+
+        The reports are returned in libset order. If a lib raises (see
+        _run_update), no further libs are started and the exception of the
+        first failed lib is raised once the running ones are done.
+        """
+        # dependencies as indexes, only on libs earlier in the set
+        depends_on = []
+        for i, lib in enumerate(libs):
+            deps = dependencies.get(lib, [])
+            depends_on.append(set(j for j in range(i) if libs[j] in deps))
+
+        reports = [None] * len(libs)
+        errors = {}
+        done = set()
+        running = set()
+        pending = list(range(len(libs)))
+        condition = threading.Condition()
+
+        def run(i):
+            try:
+                reports[i] = self._run_update(libs[i])
+            except Exception:
+                errors[i] = sys.exc_info()
+            condition.acquire()
+            try:
+                running.discard(i)
+                done.add(i)
+                condition.notify()
+            finally:
+                condition.release()
+
+        condition.acquire()
+        try:
+            while pending or running:
+                if errors:
+                    pending = []
+                for i in list(pending):
+                    if len(running) >= self.max_concurrent_libs:
+                        break
+                    if depends_on[i] <= done:
+                        pending.remove(i)
+                        running.add(i)
+                        log.debug("running lib: %s" % libs[i])
+                        thread = threading.Thread(target=run, args=(i,),
+                                                  name="lib-%s" % i)
+                        thread.setDaemon(True)
+                        thread.start()
+                if running:
+                    condition.wait()
+        finally:
+            condition.release()
+
+        if errors:
+            exc_info = errors[min(errors)]
+            raise exc_info[0], exc_info[1], exc_info[2]
+
+        return reports
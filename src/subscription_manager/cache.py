@@ -19,16 +19,19 @@ this with the current state, and perform an update on the server if
 necessary.
 """
 
+import errno
 import gettext
 import logging
 import os
 import socket
+import tempfile
 import threading
+import time
 from rhsm.https import ssl
 
 from rhsm.config import initConfig
 import rhsm.connection as connection
-from rhsm.profile import get_profile, RPMProfile
+from rhsm.profile import get_profile, get_rpmdb_fingerprint, RPMProfile
 import subscription_manager.injection as inj
 from subscription_manager.jsonwrapper import PoolWrapper
 from rhsm import ourjson as json
@@ -40,6 +43,7 @@ _ = gettext.gettext
 log = logging.getLogger(__name__)
 
 PACKAGES_RESOURCE = "packages"
+PACKAGES_DELTA_CAPABILITY = "packages_delta"
 
 conf = config.Config(initConfig())
 
@@ -180,9 +184,16 @@ class StatusCache(CacheManager):
     Unlike other cache managers, this one gets info from the server rather
     than sending it.
     """
+    # ETag/Last-Modified of the cached status, for subclasses which fetch
+    # it with a conditional GET (see _sync_if_changed).
+    VALIDATORS_FILE = None
+
     def __init__(self):
         self.server_status = None
         self.last_error = None
+        # set when the server reported the cached status as still current
+        self.not_modified = False
+        self._validators = None
 
     def load_status(self, uep, uuid):
         """
@@ -198,7 +209,8 @@ class StatusCache(CacheManager):
         """
         try:
             self._sync_with_server(uep, uuid)
-            self.write_cache()
+            if not self.not_modified:
+                self.write_cache()
             self.last_error = False
             return self.server_status
         except ssl.SSLError as ex:
@@ -241,6 +253,74 @@ class StatusCache(CacheManager):
     def to_dict(self):
         return self.server_status
 
+    def _sync_if_changed(self, get_if_changed, uuid):
+        """
+        Fetch the status with a conditional GET.
+
+        get_if_changed is one of the UEPConnection *IfChanged methods. If
+        the server answers 304 Not Modified the cached status is used and
+        not_modified is set, so neither the cache nor anything derived
+        from it needs to be written again.
+        """
+        self.not_modified = False
+        response = get_if_changed(uuid, self._read_validators(uuid))
+        if response is None:
+            cached = self._read_cache()
+            if cached is not None:
+                log.debug("Status not modified, using cache: %s" % self.CACHE_FILE)
+                self.not_modified = True
+                return
+            # The cache went away since we read the validators.
+            response = get_if_changed(uuid, {})
+        self.server_status, validators = response
+        self._validators = dict(validators, uuid=uuid)
+
+    def _read_validators(self, uuid):
+        """
+        Return the validators stored for the cached status of the given
+        consumer, or None if there is no usable cache to revalidate.
+        """
+        if not self.VALIDATORS_FILE or not self._cache_exists():
+            return None
+        try:
+            f = open(self.VALIDATORS_FILE)
+            try:
+                validators = json.load(f)
+            finally:
+                f.close()
+        except (IOError, ValueError):
+            return None
+        if not isinstance(validators, dict) or validators.get('uuid') != uuid:
+            return None
+        return validators
+
+    def _write_cache_and_validators(self, debug=True):
+        # The validators are removed before and written after the status,
+        # so they can never describe an older status than the one on disk.
+        self._remove_validators()
+        super(StatusCache, self).write_cache(debug)
+        if not self.VALIDATORS_FILE or not self._validators:
+            return
+        if not (self._validators.get('etag') or self._validators.get('last_modified')):
+            return
+        try:
+            f = open(self.VALIDATORS_FILE, "w")
+            try:
+                json.dump(self._validators, f)
+            finally:
+                f.close()
+        except IOError, e:
+            if debug:
+                log.error("Unable to write cache: %s" % self.VALIDATORS_FILE)
+                log.exception(e)
+
+    def _remove_validators(self):
+        if self.VALIDATORS_FILE and os.path.exists(self.VALIDATORS_FILE):
+            try:
+                os.remove(self.VALIDATORS_FILE)
+            except OSError:
+                pass
+
     def _load_data(self, open_file):
         json_str = open_file.read()
         return json.loads(json_str)
@@ -286,15 +366,17 @@ class StatusCache(CacheManager):
         This is threaded because it should never block in runtime.
         Writing to disk means it will be read from memory for the rest of this run.
         """
-        threading.Thread(target=super(StatusCache, self).write_cache,
+        threading.Thread(target=self._write_cache_and_validators,
                          args=[True],
                          name="WriteCache%sThread" % self.__class__.__name__).start()
         log.debug("Started thread to write cache: %s" % self.CACHE_FILE)
 
     # we override a @classmethod with an instance method in the sub class?
     def delete_cache(self):
+        self._remove_validators()
         super(StatusCache, self).delete_cache()
         self.server_status = None
+        self._validators = None
 
 
 class EntitlementStatusCache(StatusCache):
@@ -304,9 +386,37 @@ class EntitlementStatusCache(StatusCache):
     than sending it.
     """
     CACHE_FILE = "/var/lib/rhsm/cache/entitlement_status.json"
+    VALIDATORS_FILE = "/var/lib/rhsm/cache/entitlement_status_validators.json"
 
     def _sync_with_server(self, uep, uuid):
-        self.server_status = uep.getCompliance(uuid)
+        self._sync_if_changed(uep.getComplianceIfChanged, uuid)
+
+
+class EntitlementSerialsCache(StatusCache):
+    """
+    Manages the cache of entitlement certificate serials the server
+    expects this system to have.
+
+    Unlike the other status caches, errors talking to the server are not
+    hidden by falling back to the cache, see get_serials.
+    """
+    CACHE_FILE = "/var/lib/rhsm/cache/entitlement_serials.json"
+    VALIDATORS_FILE = "/var/lib/rhsm/cache/entitlement_serials_validators.json"
+
+    def _sync_with_server(self, uep, uuid):
+        self._sync_if_changed(uep.getCertificateSerialsIfChanged, uuid)
+
+    def get_serials(self, uep, uuid):
+        """
+        Return the serials the server expects for the given consumer.
+
+        not_modified tells if they are the same as last time they were
+        fetched.
+        """
+        self._sync_with_server(uep, uuid)
+        if not self.not_modified:
+            self.write_cache()
+        return [d['serial'] for d in self.server_status]
 
 
 class ProductStatusCache(StatusCache):
@@ -315,6 +425,9 @@ class ProductStatusCache(StatusCache):
     """
     CACHE_FILE = "/var/lib/rhsm/cache/product_status.json"
 
+    # No conditional GET here: the date ranges come with the whole consumer,
+    # whose lastCheckin changes on every check-in, so the server would
+    # hardly ever answer 304 Not Modified.
     def _sync_with_server(self, uep, uuid):
         consumer_data = uep.getConsumer(uuid)
 
@@ -329,9 +442,10 @@ class OverrideStatusCache(StatusCache):
     Manages the cache of yum repo overrides set on the server.
     """
     CACHE_FILE = "/var/lib/rhsm/cache/content_overrides.json"
+    VALIDATORS_FILE = "/var/lib/rhsm/cache/content_overrides_validators.json"
 
     def _sync_with_server(self, uep, consumer_uuid):
-        self.server_status = uep.getContentOverrides(consumer_uuid)
+        self._sync_if_changed(uep.getContentOverridesIfChanged, consumer_uuid)
 
 
 class ReleaseStatusCache(StatusCache):
@@ -359,13 +473,18 @@ class ProfileManager(CacheManager):
     Manages the profile of packages installed on this system.
     """
     CACHE_FILE = "/var/lib/rhsm/packages/packages.json"
+    # state of the rpm database the cached profile was read from
+    RPMDB_FINGERPRINT_FILE = "/var/lib/rhsm/packages/rpmdb_fingerprint.json"
 
     def __init__(self, current_profile=None):
 
         # Could be None, we'll read the system's current profile later once
         # we're sure we actually need the data.
         self._current_profile = current_profile
+        self._rpmdb_fingerprint = None
         self._report_package_profile = conf['rhsm'].get_int('report_package_profile')
+        # a forced update always sends the full profile
+        self._full_upload = False
 
     # give tests a chance to use something other than RPMProfile
     def _get_profile(self, profile_type):
@@ -374,11 +493,58 @@ class ProfileManager(CacheManager):
     def _get_current_profile(self):
         # If we weren't given a profile, load the current systems packages:
         if not self._current_profile:
+            # taken before reading, so a transaction running meanwhile is
+            # noticed next time
+            self._rpmdb_fingerprint = self._get_rpmdb_fingerprint()
             self._current_profile = self._get_profile('rpm')
         return self._current_profile
 
     def _set_current_profile(self, value):
         self._current_profile = value
+        self._rpmdb_fingerprint = None
+
+    def _get_rpmdb_fingerprint(self):
+        try:
+            return get_rpmdb_fingerprint()
+        except Exception, e:
+            log.debug("Unable to fingerprint the rpm database: %s" % e)
+            return None
+
+    def _read_rpmdb_fingerprint(self):
+        try:
+            f = open(self.RPMDB_FINGERPRINT_FILE)
+            try:
+                return json.load(f)
+            finally:
+                f.close()
+        except (IOError, ValueError):
+            return None
+
+    def write_cache(self, debug=True):
+        CacheManager.write_cache(self, debug)
+        self._write_rpmdb_fingerprint(debug)
+
+    def _write_rpmdb_fingerprint(self, debug=True):
+        # Without a fingerprint for the profile just written any old one
+        # must go, it no longer describes the cache.
+        try:
+            if self._rpmdb_fingerprint is None:
+                if os.path.exists(self.RPMDB_FINGERPRINT_FILE):
+                    os.remove(self.RPMDB_FINGERPRINT_FILE)
+            else:
+                f = open(self.RPMDB_FINGERPRINT_FILE, "w")
+                json.dump(self._rpmdb_fingerprint, f)
+                f.close()
+        except (IOError, OSError), e:
+            if debug:
+                log.error("Unable to write cache: %s" % self.RPMDB_FINGERPRINT_FILE)
+                log.exception(e)
+
+    @classmethod
+    def delete_cache(cls):
+        super(ProfileManager, cls).delete_cache()
+        if os.path.exists(cls.RPMDB_FINGERPRINT_FILE):
+            os.remove(cls.RPMDB_FINGERPRINT_FILE)
 
     def _set_report_package_profile(self, value):
         self._report_package_profile = value
@@ -405,19 +571,68 @@ class ProfileManager(CacheManager):
             log.info("Skipping package profile upload due to report_package_profile setting.")
             return 0
 
-        return CacheManager.update_check(self, uep, consumer_uuid, force)
+        self._full_upload = force
+        try:
+            return CacheManager.update_check(self, uep, consumer_uuid, force)
+        finally:
+            self._full_upload = False
 
     def has_changed(self):
         if not self._cache_exists():
             log.debug("Cache does not exist")
             return True
 
+        # Avoid reading every rpm header when the rpm database has not
+        # been touched since the cached profile was read from it.
+        if self._current_profile is None:
+            fingerprint = self._get_rpmdb_fingerprint()
+            if fingerprint is not None and \
+                    fingerprint == self._read_rpmdb_fingerprint():
+                log.debug("rpm database unchanged since last package profile update.")
+                return False
+
         cached_profile = self._read_cache()
-        return not cached_profile == self.current_profile
+        changed = not cached_profile == self.current_profile
+        # The rpm database was touched without changing the packages (a
+        # rebuild, a reinstall), remember it in its new state, or every
+        # later check would have to read all the packages again.
+        if not changed and self._rpmdb_fingerprint is not None and \
+                self._rpmdb_fingerprint != self._read_rpmdb_fingerprint():
+            self._write_rpmdb_fingerprint()
+        return changed
+
+    def _get_delta(self, uep):
+        """
+        Returns the (added, removed) package dicts since the profile we
+        last sent, or None if the full profile has to be uploaded.
+        """
+        if self._full_upload or not self._cache_exists():
+            return None
+        if not uep.has_capability(PACKAGES_DELTA_CAPABILITY):
+            return None
+
+        cached_profile = self._read_cache()
+        if cached_profile is None:
+            return None
+
+        added, removed, changed = self.current_profile.diff(cached_profile)
+        added.extend([new for (old, new) in changed])
+        removed.extend([old for (old, new) in changed])
+        return ([pkg.to_dict() for pkg in added],
+                [pkg.to_dict() for pkg in removed])
 
     def _sync_with_server(self, uep, consumer_uuid):
-        uep.updatePackageProfile(consumer_uuid,
-                self.current_profile.collect())
+        delta = self._get_delta(uep)
+        if delta is None:
+            uep.updatePackageProfile(consumer_uuid,
+                    self.current_profile.collect())
+            return
+
+        added, removed = delta
+        log.debug("Uploading package profile delta: %s added, %s removed, "
+                  "%s packages unchanged." % (len(added), len(removed),
+                  len(self.current_profile.packages) - len(added)))
+        uep.updatePackageProfileDelta(consumer_uuid, added, removed)
 
 
 class InstalledProductsManager(CacheManager):
@@ -619,6 +834,168 @@ class ContentAccessCache(object):
             return cache.read()
 
 
+class PoolCatalogCache(object):
+    """
+    Catalog of the pools last listed from the server, so listing them again
+    does not have to run the same heavy query.
+
+    Entries are kept per owner, consumer, active_on date, filter and whether
+    all pools or only compatible ones were listed. They are used for
+    pool_cache_ttl seconds, and must be invalidated whenever the
+    entitlements of the consumer change. With pool_cache_background_refresh
+    set, expired entries younger than MAX_STALE are still used while a fresh
+    copy is fetched in the background.
+
+    The server checks pools against the facts and package profile it was
+    sent last, entries are not used once either was sent again.
+    """
+
+    CACHE_FILE = "/var/lib/rhsm/cache/pool_catalog.json"
+    DEFAULT_TTL = 300
+
+    # Rewritten whenever facts or the package profile are sent to the
+    # server. The first one is facts.Facts.CACHE_FILE, which can not be
+    # imported here.
+    CONSUMER_DATA_FILES = [
+        "/var/lib/rhsm/facts/facts.json",
+        ProfileManager.CACHE_FILE,
+    ]
+
+    # Entries older than this are never used, and dropped on the next write.
+    MAX_STALE = 24 * 60 * 60
+
+    def __init__(self, ttl=None, background_refresh=None):
+        if ttl is None:
+            ttl = self._conf_int('pool_cache_ttl', self.DEFAULT_TTL)
+        if background_refresh is None:
+            background_refresh = bool(self._conf_int('pool_cache_background_refresh', 0))
+        self.ttl = ttl
+        self.background_refresh = background_refresh
+        self._lock = threading.Lock()
+
+    def _conf_int(self, key, default):
+        try:
+            value = conf['rhsm'].get_int(key)
+        except ValueError:
+            log.warn("Ignoring invalid value for %s in rhsm.conf" % key)
+            value = None
+        if value is None or value < 0:
+            return default
+        return value
+
+    @staticmethod
+    def _key(consumer_uuid, list_all, active_on, filter_string):
+        if hasattr(active_on, 'isoformat'):
+            active_on = active_on.isoformat()
+        return json.dumps([consumer_uuid, bool(list_all), active_on, filter_string])
+
+    def consumer_data(self):
+        """
+        Return the state of the facts and package profile last sent to the
+        server.
+        """
+        stats = []
+        for path in self.CONSUMER_DATA_FILES:
+            try:
+                st = os.stat(path)
+            except OSError:
+                stats.append(None)
+                continue
+            stats.append([st.st_size, st.st_mtime])
+        return stats
+
+    def owner(self, consumer_uuid):
+        """
+        Return the owner key last seen for the consumer, or None.
+        """
+        return self._read()['owners'].get(consumer_uuid)
+
+    def get(self, consumer_uuid, list_all=False, active_on=None, filter_string=None):
+        """
+        Return the cached pools and their age in seconds, or None if there
+        are no usable pools for these parameters.
+        """
+        catalog = self._read()
+        owner = catalog['owners'].get(consumer_uuid)
+        entry = catalog['entries'].get(self._key(consumer_uuid, list_all,
+                active_on, filter_string))
+        if owner is None or entry is None or entry.get('owner') != owner:
+            return None
+        if entry.get('consumer_data') != self.consumer_data():
+            return None
+        age = time.time() - entry['time']
+        if age < 0 or age > self.MAX_STALE:
+            return None
+        return entry['pools'], age
+
+    def put(self, consumer_uuid, owner, pools, list_all=False, active_on=None,
+            filter_string=None, consumer_data=None):
+        """
+        Store the pools listed for these parameters. consumer_data is what
+        consumer_data() returned before they were requested, so that facts
+        sent meanwhile are not taken into account by mistake.
+        """
+        if consumer_data is None:
+            consumer_data = self.consumer_data()
+        with self._lock:
+            catalog = self._read()
+            now = time.time()
+            # a consumer moved to another owner sees other pools
+            if catalog['owners'].get(consumer_uuid) != owner:
+                catalog['entries'] = {}
+            catalog['owners'][consumer_uuid] = owner
+            for key, entry in catalog['entries'].items():
+                if now - entry['time'] > self.MAX_STALE:
+                    del catalog['entries'][key]
+            catalog['entries'][self._key(consumer_uuid, list_all, active_on,
+                    filter_string)] = {'owner': owner, 'time': now, 'pools': pools,
+                                       'consumer_data': consumer_data}
+            self._write(catalog)
+
+    def _read(self):
+        try:
+            f = open(self.CACHE_FILE)
+            try:
+                catalog = json.load(f)
+            finally:
+                f.close()
+        except (IOError, ValueError):
+            catalog = None
+        if not isinstance(catalog, dict) or 'entries' not in catalog:
+            catalog = {'owners': {}, 'entries': {}}
+        return catalog
+
+    def _write(self, catalog):
+        cache_dir = os.path.dirname(self.CACHE_FILE)
+        try:
+            fd, tmp_path = tempfile.mkstemp(dir=cache_dir, prefix='.pool_catalog')
+            try:
+                f = os.fdopen(fd, 'w')
+                try:
+                    json.dump(catalog, f, default=json.encode)
+                finally:
+                    f.close()
+                os.rename(tmp_path, self.CACHE_FILE)
+            except Exception:
+                os.unlink(tmp_path)
+                raise
+        except (IOError, OSError), e:
+            if e.errno not in (errno.ENOENT, errno.EACCES, errno.EPERM, errno.EROFS):
+                log.warn("Unable to write cache: %s: %s" % (self.CACHE_FILE, e))
+
+    def delete_cache(self):
+        """
+        Invalidate the catalog, the entitlements of the consumer changed.
+        """
+        with self._lock:
+            if os.path.exists(self.CACHE_FILE):
+                log.debug("Deleting cache: %s" % self.CACHE_FILE)
+                try:
+                    os.remove(self.CACHE_FILE)
+                except OSError, e:
+                    log.warn("Unable to delete cache: %s: %s" % (self.CACHE_FILE, e))
+
+
 class RhsmIconCache(CacheManager):
     '''
     Cache to keep track of last status returned by the StatusCache.
@@ -671,3 +1048,30 @@ class WrittenOverrideCache(CacheManager):
             # ignore json file parse errors, we are going to generate
             # a new as if it didn't exist
             pass
+
+
+class RepoSectionCache(CacheManager):
+    '''
+    Cache of the redhat.repo sections as they were last written. Maps each
+    section to a hash of what it was generated from and a hash of the
+    values written, so sections that did not change can be skipped.
+    '''
+
+    CACHE_FILE = "/var/lib/rhsm/cache/redhat_repo_sections.json"
+
+    def __init__(self, sections=None):
+        self.sections = sections or {}
+
+    def to_dict(self):
+        return self.sections
+
+    def _load_data(self, open_file):
+        try:
+            self.sections = json.loads(open_file.read()) or {}
+            return self.sections
+        except IOError:
+            log.error("Unable to read cache: %s" % self.CACHE_FILE)
+        except ValueError:
+            # ignore json file parse errors, we are going to generate
+            # a new as if it didn't exist
+            pass
@@ -15,11 +15,16 @@
 # in this software or its documentation.
 #
 
+import errno
 import gettext
 import logging
 import os
+import shutil
+import tempfile
+import time
 
 from rhsm.certificate import Key, create_from_file
+from rhsm.certcache import CertificateCache
 from rhsm.config import initConfig
 from subscription_manager.injection import require, ENT_DIR
 
@@ -33,6 +38,50 @@ conf = config.Config(initConfig())
 
 DEFAULT_PRODUCT_CERT_DIR = "/etc/pki/product-default"
 
+# Counter bumped by DirectoryTransaction.commit(), odd while a commit is
+# renaming files into place.
+GENERATION_FILE = ".generation"
+
+# How often a listing is retried when the directory changed under it.
+LIST_ATTEMPTS = 3
+
+
+def read_generation(path):
+    """
+    Return the generation of a certificate directory, 0 if it was never
+    written by a DirectoryTransaction.
+    """
+    try:
+        f = open(os.path.join(path, GENERATION_FILE))
+        try:
+            return int(f.read().strip())
+        finally:
+            f.close()
+    except (IOError, ValueError):
+        return 0
+
+
+def _write_generation(path, generation):
+    gen_path = os.path.join(path, GENERATION_FILE)
+    tmp_path = gen_path + ".tmp"
+    try:
+        f = open(tmp_path, "w")
+        try:
+            f.write("%d\n" % generation)
+        finally:
+            f.close()
+        os.rename(tmp_path, gen_path)
+    except (IOError, OSError), e:
+        log.debug("Unable to write %s: %s" % (gen_path, e))
+
+
+def _fsync_path(path):
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
 
 class Directory(object):
 
@@ -99,10 +148,126 @@ class Directory(object):
         return self.path
 
 
+class DirectoryTransaction(object):
+    """
+    Certificate and key writes and certificate removals applied to a
+    certificate directory as one unit by commit().
+
+    Files are written to a staging directory inside the certificate
+    directory, so they are on the same filesystem, and flushed to disk
+    before commit() renames them into place and removes the
+    certificates staged for removal. The generation of the directory is
+    odd while this happens, readers which see an odd or changed generation
+    list the directory again, see CertificateDirectory.list().
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._staging = None
+        # (staged path, final path, object written)
+        self._writes = []
+        self._removals = []
+        # certificates removed by commit(), and (cert, error) for the ones
+        # which could not be
+        self.removed = []
+        self.remove_errors = []
+
+    def write(self, obj, filename):
+        """
+        Stage writing a certificate or key (anything with a write(path)
+        method) as filename in the directory.
+        """
+        if self._staging is None:
+            self._staging = tempfile.mkdtemp(prefix=".staging-", dir=self.path)
+        staged_path = os.path.join(self._staging, filename)
+        obj.write(staged_path)
+        self._writes.append((staged_path, os.path.join(self.path, filename), obj))
+
+    def remove(self, cert):
+        """
+        Stage the removal of a certificate, using its delete() method.
+        """
+        self._removals.append(cert)
+
+    def commit(self):
+        if not self._writes and not self._removals:
+            self.abort()
+            return
+        try:
+            # Only the staged files, syncing the whole filesystem would
+            # wait for unrelated writes too.
+            for staged_path, _final_path, _obj in self._writes:
+                _fsync_path(staged_path)
+
+            generation = read_generation(self.path)
+            generation += 1 + generation % 2
+            _write_generation(self.path, generation)
+            try:
+                for staged_path, final_path, obj in self._writes:
+                    os.rename(staged_path, final_path)
+                    obj.path = final_path
+
+                for cert in self._removals:
+                    try:
+                        cert.delete()
+                        self.removed.append(cert)
+                    except OSError, e:
+                        self.remove_errors.append((cert, e))
+            finally:
+                # even again however far we got, or every reader would
+                # keep listing the directory again until the next commit
+                _write_generation(self.path, generation + 1)
+            try:
+                _fsync_path(self.path)
+            except OSError, e:
+                if e.errno != errno.ENOENT:
+                    raise
+            log.debug("Committed %s writes and %s removals to %s, generation %s" %
+                      (len(self._writes), len(self.removed), self.path, generation + 1))
+        finally:
+            self.abort()
+
+    def abort(self):
+        """
+        Throw away everything staged and not committed.
+        """
+        if self._staging is not None:
+            shutil.rmtree(self._staging, ignore_errors=True)
+            self._staging = None
+        self._writes = []
+        self._removals = []
+
+
+class CertificateIndex(object):
+    """
+    Lookup tables over a list of certificates, by serial, product ID,
+    pool ID and stacking ID. Lists keep the order of the certificates
+    they were built from.
+    """
+
+    def __init__(self, certs):
+        self.by_serial = {}
+        self.by_product = {}
+        self.by_pool = {}
+        self.by_stacking_id = {}
+        for cert in certs:
+            self.by_serial.setdefault(cert.serial, cert)
+            for product in cert.products:
+                self.by_product.setdefault(product.id, []).append(cert)
+            pool = getattr(cert, 'pool', None)
+            if pool is not None:
+                self.by_pool.setdefault(str(pool.id), []).append(cert)
+            order = getattr(cert, 'order', None)
+            if order and order.stacking_id:
+                self.by_stacking_id.setdefault(order.stacking_id, []).append(cert)
+
+
 class CertificateDirectory(Directory):
 
     KEY = 'key.pem'
 
+    _index = None
+
     def __init__(self, path):
         super(CertificateDirectory, self).__init__(path)
         self.create()
@@ -111,19 +276,61 @@ class CertificateDirectory(Directory):
     def refresh(self):
         # simply clear the cache. the next list() will reload.
         self._listing = None
+        self._index = None
+
+    def _get_index(self):
+        # built from list() once, refresh() throws it away with the listing
+        if self._index is None:
+            self._index = CertificateIndex(self.list())
+        return self._index
 
     def list(self):
         if self._listing is not None:
             return self._listing
+        # List again if a DirectoryTransaction was committing meanwhile,
+        # rather than returning a half updated directory. An odd generation
+        # which stays the same was left behind by a commit which never
+        # finished, waiting for it is pointless.
+        previous = None
+        for attempt in range(1, LIST_ATTEMPTS + 1):
+            generation = read_generation(self.path)
+            try:
+                listing = self._read_listing()
+            except Exception:
+                if attempt == LIST_ATTEMPTS or read_generation(self.path) == generation:
+                    raise
+                continue
+            if generation % 2 == 0 or generation == previous:
+                if read_generation(self.path) == generation:
+                    break
+            previous = generation
+            if attempt < LIST_ATTEMPTS:
+                log.debug("%s changed while being listed" % self.path)
+                time.sleep(0.1)
+        self._listing = listing
+        return listing
+
+    def _read_listing(self):
         listing = []
+        # unchanged certificates are restored from the on disk cache
+        # instead of being parsed again
+        cache = CertificateCache.for_directory(self.path)
         for _p, fn in Directory.list(self):
             if not fn.endswith('.pem') or fn.endswith(self.KEY):
                 continue
             path = self.abspath(fn)
-            listing.append(create_from_file(path))
-        self._listing = listing
+            listing.append(create_from_file(path, cache=cache))
+        cache.save()
         return listing
 
+    @property
+    def generation(self):
+        """
+        Changes every time certificates are written to or removed from the
+        directory by a DirectoryTransaction.
+        """
+        return read_generation(self.path)
+
     def list_valid(self):
         valid = []
         for c in self.list():
@@ -139,44 +346,26 @@ class CertificateDirectory(Directory):
         return expired
 
     def find(self, sn):
-        # TODO: could optimize to just load SERIAL.pem? Maybe not in all cases.
-        for c in self.list():
-            if c.serial == sn:
-                return c
-        return None
+        return self._get_index().by_serial.get(sn)
 
     def find_all_by_product(self, p_hash):
-        certs = set()
-        providing_stack_ids = set()
-        stack_id_map = {}
+        index = self._get_index()
+        certs = set(index.by_product.get(p_hash, []))
 
-        # Note this will override a product cert for id '71' with
-        # a different product cert for id '71' if it is later in self.list
-        for c in self.list():
-            for p in c.products:
-                if p.id == p_hash:
-                    certs.add(c)
-                    # Keep track of stacks that provide our product
-                    if (c.order and c.order.stacking_id):
-                        providing_stack_ids.add(c.order.stacking_id)
-
-            # Keep track of stack ids in case we need them later.  avoids another loop
-            if (c.order and c.order.stacking_id):
-                if c.order.stacking_id not in stack_id_map:
-                    stack_id_map[c.order.stacking_id] = set()
-                stack_id_map[c.order.stacking_id].add(c)
-
-        # Complete
+        # Include everything stacked with a cert providing our product
+        providing_stack_ids = set()
+        for c in certs:
+            if c.order and c.order.stacking_id:
+                providing_stack_ids.add(c.order.stacking_id)
         for stack_id in providing_stack_ids:
-            certs |= stack_id_map[stack_id]
+            certs.update(index.by_stacking_id[stack_id])
 
         return list(certs)
 
     def find_by_product(self, p_hash):
-        for c in self.list():
-            for p in c.products:
-                if p.id == p_hash:
-                    return c
+        certs = self._get_index().by_product.get(p_hash)
+        if certs:
+            return certs[0]
         return None
 
     #Set up an alias for backwards compatibility
@@ -238,6 +427,7 @@ class ProductDirectory(ProductCertificateDirectory):
     def refresh(self):
         self.installed_prod_dir.refresh()
         self.default_prod_dir.refresh()
+        self._index = None
 
     # In productid.py, ProductDirectory.path is used as path to write new certs
     # to. Souse  the installed_prod_dir (/etc/pki/product) as that is
@@ -308,28 +498,23 @@ class EntitlementDirectory(CertificateDirectory):
         Returns all entitlement certificates providing access to the given
         product ID.
         """
-        entitlements = []
-        for cert in self.list():
-            for cert_product in cert.products:
-                if product_id == cert_product.id:
-                    entitlements.append(cert)
-        return entitlements
+        return list(self._get_index().by_product.get(product_id, []))
 
     def list_for_pool_id(self, pool_id):
         """
         Returns all entitlement certificates provided by the given
         pool ID.
         """
-        entitlements = [entitlement for entitlement in self.list() if str(entitlement.pool.id) == str(pool_id)]
-        return entitlements
+        return list(self._get_index().by_pool.get(str(pool_id), []))
 
     def list_serials_for_pool_ids(self, pool_ids):
         """
         Returns a dict of all entitlement certificate serials for each pool_id in the list provided
         """
+        by_pool = self._get_index().by_pool
         pool_id_to_serials = {}
         for pool_id in pool_ids:
-            pool_id_to_serials[pool_id] = [str(cert.serial) for cert in self.list_for_pool_id(pool_id)]
+            pool_id_to_serials[pool_id] = [str(cert.serial) for cert in by_pool.get(str(pool_id), [])]
         return pool_id_to_serials
 
 
@@ -359,17 +544,24 @@ class Path:
 
 class Writer:
 
-    def __init__(self):
-        self.ent_dir = require(ENT_DIR)
+    def __init__(self, ent_dir=None, transaction=None):
+        self.ent_dir = ent_dir or require(ENT_DIR)
+        # if given, the files are only staged in the transaction
+        self.transaction = transaction
 
     def write(self, key, cert):
         serial = cert.serial
-        ent_dir_path = self.ent_dir.productpath()
-
         key_filename = '%s-key.pem' % str(serial)
+        cert_filename = '%s.pem' % str(serial)
+
+        if self.transaction is not None:
+            self.transaction.write(key, key_filename)
+            self.transaction.write(cert, cert_filename)
+            return
+
+        ent_dir_path = self.ent_dir.productpath()
         key_path = Path.join(ent_dir_path, key_filename)
         key.write(key_path)
 
-        cert_filename = '%s.pem' % str(serial)
         cert_path = Path.join(ent_dir_path, cert_filename)
         cert.write(cert_path)
@@ -15,12 +15,15 @@
 
 import gettext
 import logging
+import Queue
 import socket
+import threading
 
 from rhsm.certificate import Key, create_from_pem
 from rhsm.certificate2 import CONTENT_ACCESS_CERT_TYPE
+from rhsm.config import initConfig
 
-from subscription_manager.certdirectory import Writer
+from subscription_manager.certdirectory import DirectoryTransaction, Writer
 from subscription_manager import certlib
 from subscription_manager import content_action_client
 from subscription_manager import utils
@@ -28,11 +31,20 @@ from subscription_manager.injection import IDENTITY, require
 from subscription_manager import rhelentbranding
 import subscription_manager.injection as inj
 
+from rhsmlib.services import config
+
 log = logging.getLogger(__name__)
 _ = gettext.gettext
 
+conf = config.Config(initConfig())
+
 CONTENT_ACCESS_CERT_CAPABILITY = "org_level_content_access"
 
+# Used when rhsm.conf has no usable cert_download_batch_size or
+# cert_download_threads.
+DEFAULT_CERT_DOWNLOAD_BATCH_SIZE = 20
+DEFAULT_CERT_DOWNLOAD_THREADS = 4
+
 
 class EntCertActionInvoker(certlib.BaseActionInvoker):
     """Invoker for entitlement certificate updating actions."""
@@ -109,6 +121,7 @@ class EntCertUpdateAction(object):
         self.identity = require(IDENTITY)
         self.report = EntCertUpdateReport()
         self.content_access_cache = inj.require(inj.CONTENT_ACCESS_CACHE)
+        self.pool_catalog = inj.require(inj.POOL_CATALOG_CACHE)
 
     # NOTE: this is slightly at odds with the manual cert import
     #       path, manual import certs wont get a 'report', etc
@@ -124,14 +137,23 @@ class EntCertUpdateAction(object):
         missing_serials = self._find_missing_serials(local, expected)
         rogue_serials = self._find_rogue_serials(local, expected)
 
-        self.delete(rogue_serials)
-        self.install(missing_serials)
+        # Removals and new certs all land in the directory at once.
+        transaction = DirectoryTransaction(self.ent_dir.path)
+        try:
+            self.delete(rogue_serials, transaction)
+            self.install(missing_serials, transaction)
+        finally:
+            self._commit(transaction)
 
         log.info('certs updated:\n%s', self.report)
         self.syslog_results()
 
         if missing_serials or rogue_serials:
 
+            # Consumed quantities changed, so did the pools listed as
+            # available to this consumer.
+            self.pool_catalog.delete_cache()
+
             # We call EntCertlibActionInvoker.update() solo from
             # the 'attach' cli instead of an ActionClient. So
             # we need to refresh the ent_dir object before calling
@@ -164,13 +186,30 @@ class EntCertUpdateAction(object):
         # of *Lib.update
         return self.report
 
-    def install(self, missing_serials):
-        """Install any missing entitlement certificates."""
+    def install(self, missing_serials, transaction=None):
+        """Install any missing entitlement certificates.
+
+        Certificates are fetched in batches and each one is installed as
+        soon as its batch arrives. Serials which could not be fetched are
+        added to the report, unless none could be fetched at all, in which
+        case the error is raised as before.
 
-        cert_bundles = self.get_certificates_by_serial_list(missing_serials)
+        If a transaction is given the certificates are only staged in it.
+        """
+        fetcher = EntitlementCertFetcher(self.uep, self.identity.getConsumerId())
 
         ent_cert_bundles_installer = EntitlementCertBundlesInstaller(self.report)
-        ent_cert_bundles_installer.install(cert_bundles)
+        ent_cert_bundles_installer.install(fetcher.fetch(missing_serials), transaction)
+
+        if not fetcher.failed:
+            return
+        if len(fetcher.failed) == len(missing_serials):
+            raise fetcher.error
+        for sn in sorted(fetcher.failed):
+            error = EntitlementCertFetchError(sn, fetcher.failed[sn])
+            log.error(error)
+            self.report.failed.append(sn)
+            self.report._exceptions.append(error)
 
     def _find_content_access_certs(self):
         certs = self.ent_dir.list_with_content_access()
@@ -260,10 +299,10 @@ class EntCertUpdateAction(object):
             # empty result set is returned.
             return results
 
-        reply = self.uep.getCertificateSerials(identity.uuid)
-        for d in reply:
-            sn = d['serial']
-            results.append(sn)
+        serials_cache = inj.require(inj.ENTITLEMENT_SERIALS_CACHE)
+        results = serials_cache.get_serials(self.uep, identity.uuid)
+        if serials_cache.not_modified:
+            log.debug("Entitlement certificate serials not modified on the server")
         return results
 
     def get_certificates_by_serial_list(self, sn_list):
@@ -284,18 +323,26 @@ class EntCertUpdateAction(object):
         self.report.expected = exp
         return exp
 
-    def delete(self, rogue):
+    def delete(self, rogue, transaction=None):
+        """Delete rogue certs, or stage their removal in transaction if given."""
+        if transaction is None:
+            transaction = DirectoryTransaction(self.ent_dir.path)
+            self.delete(rogue, transaction)
+            self._commit(transaction)
+            return
         for cert in rogue:
-            try:
-                cert.delete()
-                self.report.rogue.append(cert)
-            except OSError, er:
-                log.exception(er)
-                log.warn("Failed to delete cert")
+            transaction.remove(cert)
+
+    def _commit(self, transaction):
+        transaction.commit()
+        for cert, er in transaction.remove_errors:
+            log.error(er)
+            log.warn("Failed to delete cert")
+        self.report.rogue.extend(transaction.removed)
 
         # If we just deleted certs, we need to refresh the now stale
         # entitlement directory before we go to delete expired certs.
-        rogue_count = len(self.report.rogue)
+        rogue_count = len(transaction.removed)
         if rogue_count > 0:
             print gettext.ngettext("%s local certificate has been deleted.",
                                    "%s local certificates have been deleted.",
@@ -303,6 +350,142 @@ class EntCertUpdateAction(object):
             self.ent_dir.refresh()
 
 
+class EntitlementCertFetcher(object):
+    """Fetch entitlement cert bundles for a list of serial numbers.
+
+    The serials are requested in batches of batch_size, with up to threads
+    batches in flight at once over the pooled connections of uep. Bundles
+    are yielded by fetch() as their batch arrives, so that at most a few
+    batches are held in memory no matter how many certificates there are.
+
+    Batches which could not be fetched do not stop the others, their
+    serials are recorded in failed along with the error.
+    """
+
+    def __init__(self, uep, consumer_uuid, batch_size=None, threads=None):
+        self.uep = uep
+        self.consumer_uuid = consumer_uuid
+        self.batch_size = batch_size or self._conf_int('cert_download_batch_size',
+                                                       DEFAULT_CERT_DOWNLOAD_BATCH_SIZE)
+        self.threads = threads or self._conf_int('cert_download_threads',
+                                                 DEFAULT_CERT_DOWNLOAD_THREADS)
+        # serial -> exception, for the serials which could not be fetched
+        self.failed = {}
+        # first exception seen
+        self.error = None
+
+    def _conf_int(self, key, default):
+        try:
+            value = conf['rhsm'].get_int(key)
+        except ValueError:
+            log.warn("Ignoring invalid value for %s in rhsm.conf" % key)
+            value = None
+        if value is None or value < 1:
+            return default
+        return value
+
+    def batches(self, serials):
+        """Split a list of serials into batches of batch_size."""
+        serials = [str(sn) for sn in serials]
+        return [serials[i:i + self.batch_size]
+                for i in range(0, len(serials), self.batch_size)]
+
+    def fetch(self, serials):
+        """Yield the cert bundles for the given serials."""
+        batches = self.batches(serials)
+        if not batches:
+            return
+        threads = min(self.threads, len(batches))
+        log.debug("Fetching %s entitlement certificates in %s batches, %s at a time" %
+                  (len(serials), len(batches), threads))
+
+        if threads == 1:
+            for batch in batches:
+                for bundle in self._fetch_batch(batch):
+                    yield bundle
+            return
+
+        todo = Queue.Queue()
+        for batch in batches:
+            todo.put(batch)
+        # Bounded, so workers wait for the installer rather than piling
+        # up responses in memory.
+        done = Queue.Queue(threads)
+        # Set when the caller is done, whether or not it went through all
+        # the bundles, so the workers do not wait on done forever.
+        stop = threading.Event()
+        for i in range(threads):
+            worker = threading.Thread(target=self._worker, args=(todo, done, stop),
+                                      name="EntCertFetchThread-%s" % i)
+            worker.setDaemon(True)
+            worker.start()
+
+        try:
+            for i in range(len(batches)):
+                for bundle in self._batch_result(*done.get()):
+                    yield bundle
+        finally:
+            stop.set()
+            # let go of the responses nobody is going to install
+            while True:
+                try:
+                    done.get(block=False)
+                except Queue.Empty:
+                    break
+
+    def _worker(self, todo, done, stop):
+        while not stop.isSet():
+            try:
+                batch = todo.get(block=False)
+            except Queue.Empty:
+                return
+            try:
+                result = (batch, self._get_certificates(batch), None)
+            except Exception, e:
+                result = (batch, None, e)
+            while not stop.isSet():
+                try:
+                    done.put(result, timeout=0.1)
+                    break
+                except Queue.Full:
+                    pass
+
+    def _fetch_batch(self, batch):
+        try:
+            reply = self._get_certificates(batch)
+        except Exception, e:
+            reply, error = None, e
+        else:
+            error = None
+        return self._batch_result(batch, reply, error)
+
+    def _batch_result(self, batch, reply, error):
+        if error is None:
+            return reply or []
+        log.debug("Failed to fetch entitlement certificates %s: %s" % (', '.join(batch), error))
+        if self.error is None:
+            self.error = error
+        for sn in batch:
+            self.failed[sn] = error
+        return []
+
+    def _get_certificates(self, batch):
+        return self.uep.getCertificates(self.consumer_uuid, serials=batch)
+
+
+class EntitlementCertFetchError(Exception):
+    """An entitlement cert could not be fetched from the server."""
+
+    def __init__(self, serial, error):
+        Exception.__init__(self, serial, error)
+        self.serial = serial
+        self.error = error
+
+    def __str__(self):
+        # ActionReport.format_exceptions() drops everything up to the first '-'
+        return "Entitlement certificate - serial %s: %s" % (self.serial, self.error)
+
+
 class EntitlementCertBundlesInstaller(object):
     """Install a list of entitlement cert bundles.
 
@@ -315,11 +498,22 @@ class EntitlementCertBundlesInstaller(object):
         self.exceptions = []
         self.report = report
 
-    def install(self, cert_bundles):
-        """Fetch entitliement certs, install them, and update the report."""
-        bundle_installer = EntitlementCertBundleInstaller(self.report)
-        for cert_bundle in cert_bundles:
-            bundle_installer.install(cert_bundle)
+    def install(self, cert_bundles, transaction=None):
+        """Fetch entitliement certs, install them, and update the report.
+
+        The certs are written to the entitlement directory at once when all
+        bundles were handled, or only staged if a transaction is given.
+        """
+        commit = transaction is None
+        if commit:
+            transaction = DirectoryTransaction(inj.require(inj.ENT_DIR).path)
+        bundle_installer = EntitlementCertBundleInstaller(self.report, transaction)
+        try:
+            for cert_bundle in cert_bundles:
+                bundle_installer.install(cert_bundle)
+        finally:
+            if commit:
+                transaction.commit()
         self.exceptions = bundle_installer.exceptions
         self.post_install()
 
@@ -355,15 +549,16 @@ class EntitlementCertBundleInstaller(object):
     bundles, while this is pre/post each ent cert bundle.
     """
 
-    def __init__(self, report):
+    def __init__(self, report, transaction=None):
         self.exceptions = []
         self.report = report
+        self.transaction = transaction
 
     def install(self, bundle):
         """Persist an ent cert and it's key after splitting it from the bundle."""
         self.pre_install(bundle)
 
-        cert_bundle_writer = Writer()
+        cert_bundle_writer = Writer(transaction=self.transaction)
         try:
             key, cert = self.build_cert(bundle)
             cert_bundle_writer.write(key, cert)
@@ -415,6 +610,8 @@ class EntCertUpdateReport(certlib.ActionReport):
         self.expected = []
         self.added = []
         self.rogue = []
+        # serials which could not be fetched from the server
+        self.failed = []
         self._exceptions = []
 
     def updates(self):
@@ -456,4 +653,6 @@ class EntCertUpdateReport(certlib.ActionReport):
         s.append(_('Expected (UEP) serial# %s') % self.expected)
         self.write(s, _('Added (new)'), self.added)
         self.write(s, _('Deleted (rogue):'), self.rogue)
+        if self.failed:
+            s.append(_('Failed to fetch serial# %s') % self.failed)
         return '\n'.join(s)
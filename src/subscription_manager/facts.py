@@ -25,6 +25,8 @@ from rhsmlib.dbus.facts import FactsClient
 _ = gettext.gettext
 log = logging.getLogger(__name__)
 
+FACTS_DELTA_CAPABILITY = "facts_delta"
+
 
 class Facts(CacheManager):
     """
@@ -49,6 +51,17 @@ class Facts(CacheManager):
         # plugin manager so we can add custom facts via plugin
         self.plugin_manager = require(PLUGIN_MANAGER)
 
+        # a forced update always sends all the facts
+        self._full_upload = False
+        # What facts uploads cost, and what delta uploads saved, in this
+        # process. Sizes are those of the JSON request bodies.
+        self.upload_stats = {
+            'full_uploads': 0,
+            'delta_uploads': 0,
+            'bytes_sent': 0,
+            'bytes_saved': 0,
+        }
+
     def get_last_update(self):
         try:
             return datetime.fromtimestamp(os.stat(self.CACHE_FILE).st_mtime)
@@ -81,12 +94,71 @@ class Facts(CacheManager):
             self.facts = facts
         return self.facts
 
+    def refresh_facts(self):
+        """Collect all the facts again, bypassing the facts service cache."""
+        facts_dbus_client = FactsClient()
+        facts = facts_dbus_client.RefreshFacts()
+        self.plugin_manager.run('post_facts_collection', facts=facts)
+        self.facts = facts
+        return self.facts
+
     def to_dict(self):
         return self.get_facts()
 
+    def update_check(self, uep, consumer_uuid, force=False):
+        self._full_upload = force
+        try:
+            return CacheManager.update_check(self, uep, consumer_uuid, force)
+        finally:
+            self._full_upload = False
+
+    def _get_delta(self, uep):
+        """
+        Returns the (changed, removed) facts since the facts we last sent,
+        or None if all the facts have to be uploaded.
+
+        Unlike has_changed, graylisted facts are included so the server
+        ends up with exactly the facts we cache.
+        """
+        if self._full_upload or not self._cache_exists():
+            return None
+        if not uep.has_capability(FACTS_DELTA_CAPABILITY):
+            return None
+
+        cached_facts = self._read_cache()
+        if cached_facts is None:
+            return None
+
+        facts = self.get_facts()
+        changed = {}
+        for key, value in facts.items():
+            if key not in cached_facts or cached_facts[key] != value:
+                changed[key] = value
+        removed = [key for key in cached_facts if key not in facts]
+        return (changed, removed)
+
     def _sync_with_server(self, uep, consumer_uuid):
         log.debug("Updating facts on server")
-        uep.updateConsumer(consumer_uuid, facts=self.get_facts())
+        facts = self.get_facts()
+        full_size = len(json.dumps({'facts': facts}))
+
+        delta = self._get_delta(uep)
+        if delta is None:
+            uep.updateConsumer(consumer_uuid, facts=facts)
+            self.upload_stats['full_uploads'] += 1
+            self.upload_stats['bytes_sent'] += full_size
+            return
+
+        changed, removed = delta
+        delta_size = len(json.dumps({'changed': changed, 'removed': removed}))
+        uep.updateConsumerFactsDelta(consumer_uuid, changed, removed)
+        self.upload_stats['delta_uploads'] += 1
+        self.upload_stats['bytes_sent'] += delta_size
+        self.upload_stats['bytes_saved'] += max(full_size - delta_size, 0)
+        log.debug("Uploaded facts delta: %s changed, %s removed, %s bytes "
+                  "instead of %s (%s bytes saved so far)." %
+                  (len(changed), len(removed), delta_size, full_size,
+                   self.upload_stats['bytes_saved']))
 
     def _load_data(self, open_file):
         json_str = open_file.read()
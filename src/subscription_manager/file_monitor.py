@@ -15,8 +15,115 @@
 
 """
 Watch for and be notified of changes in a file.
+
+Changes are found by comparing mtimes whenever update() is called. Where
+Linux inotify is available, MonitorDirectories can also be told about
+changes as they happen, so callers can wait for them (see
+MonitorDirectories.wait and MonitorDirectories.process_events) instead of
+calling update() on a timer.
 """
+import ctypes
+import ctypes.util
+import errno
+import logging
 import os
+import select
+import struct
+import time
+
+log = logging.getLogger(__name__)
+
+# from <sys/inotify.h>
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_NONBLOCK = os.O_NONBLOCK
+IN_CLOEXEC = 0o2000000
+
+WATCH_MASK = (IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM |
+              IN_MOVED_TO | IN_CREATE | IN_DELETE | IN_DELETE_SELF |
+              IN_MOVE_SELF | IN_ONLYDIR)
+
+# struct inotify_event, followed by a NUL padded name of 'len' bytes
+EVENT_HEADER = struct.Struct('iIII')
+
+
+class InotifyUnavailable(Exception):
+    pass
+
+
+class Inotify(object):
+    """
+    Minimal ctypes binding for the Linux inotify API.
+
+    Raises InotifyUnavailable if the C library has no inotify, or an
+    inotify instance can not be created (ie, max_user_instances reached).
+    """
+
+    def __init__(self):
+        libc_name = ctypes.util.find_library('c')
+        try:
+            self._libc = ctypes.CDLL(libc_name, use_errno=True)
+            self._add_watch = self._libc.inotify_add_watch
+            self._rm_watch = self._libc.inotify_rm_watch
+            init1 = self._libc.inotify_init1
+        except (OSError, AttributeError), e:
+            raise InotifyUnavailable("inotify is not available: %s" % e)
+
+        self._add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+        self._rm_watch.argtypes = [ctypes.c_int, ctypes.c_int]
+        self.fd = init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            raise InotifyUnavailable("inotify_init1 failed: %s" %
+                                     os.strerror(ctypes.get_errno()))
+
+    def fileno(self):
+        return self.fd
+
+    def add_watch(self, path, mask=WATCH_MASK):
+        """Returns the watch descriptor for path, raises OSError on failure."""
+        wd = self._add_watch(self.fd, path, mask)
+        if wd < 0:
+            err = ctypes.get_errno()
+            raise OSError(err, os.strerror(err), path)
+        return wd
+
+    def rm_watch(self, wd):
+        self._rm_watch(self.fd, wd)
+
+    def read_events(self):
+        """Returns the pending (wd, mask, name) events, without blocking."""
+        events = []
+        while True:
+            try:
+                buf = os.read(self.fd, 64 * 1024)
+            except OSError, e:
+                if e.errno in (errno.EAGAIN, errno.EINTR):
+                    return events
+                raise
+            if not buf:
+                return events
+            offset = 0
+            while offset + EVENT_HEADER.size <= len(buf):
+                wd, mask, cookie, length = EVENT_HEADER.unpack_from(buf, offset)
+                offset += EVENT_HEADER.size
+                name = buf[offset:offset + length].rstrip('\0')
+                offset += length
+                events.append((wd, mask, name))
+
+    def close(self):
+        if self.fd >= 0:
+            os.close(self.fd)
+            self.fd = -1
 
 
 class MonitorDirectory(object):
@@ -26,6 +133,9 @@ class MonitorDirectory(object):
         self.exists = None
         self.path = path
         self._changed_callback = changed_callback
+        # set when inotify reported a change the mtime may not show, ie
+        # a file rewritten in place
+        self.pending = False
         self.update()
 
     def _check_mtime(self):
@@ -51,7 +161,8 @@ class MonitorDirectory(object):
         mtime, exists = self._check_mtime()
 
         # Has something changed?
-        result = self._changed(mtime, self.mtime, exists, self.exists)
+        result = self._changed(mtime, self.mtime, exists, self.exists) or self.pending
+        self.pending = False
 
         # Update saved values
         self.mtime = mtime
@@ -66,11 +177,19 @@ class MonitorDirectory(object):
 class MonitorDirectories(object):
 
     def __init__(self, dir_monitors=None, changed_callback=None):
-        """Attach a timer callback to call run_check to poll periodically."""
+        """Attach a timer callback to call run_check to poll periodically,
+        or use wait() or process_events() to learn of changes through
+        inotify."""
         self.dir_monitors = dir_monitors or []
         self._changed_callback = changed_callback
+        self._inotify = None
+        # watch descriptor -> MonitorDirectory
+        self._watches = {}
 
     def update(self):
+        if self._inotify is not None and not self.fully_watched():
+            self._add_watches()
+
         # check all the dirs in a batch, to hopefully coalesce
         # related changes into one callback.
 
@@ -86,6 +205,108 @@ class MonitorDirectories(object):
         if self._changed_callback:
             self._changed_callback()
 
+    def start_watching(self):
+        """
+        Start watching the directories with inotify.
+
+        Returns False if inotify is not available, callers then have to
+        keep calling update() periodically.
+        """
+        if self._inotify is not None:
+            return True
+        try:
+            self._inotify = Inotify()
+        except InotifyUnavailable, e:
+            log.debug("Polling for certificate changes: %s" % e)
+            return False
+        self._add_watches()
+        return True
+
+    def stop_watching(self):
+        if self._inotify is not None:
+            self._inotify.close()
+            self._inotify = None
+            self._watches = {}
+
+    def fileno(self):
+        """The inotify file descriptor, readable when changes are pending.
+        Only valid after start_watching() returned True."""
+        return self._inotify.fileno()
+
+    def fully_watched(self):
+        """True if inotify reports changes to all of the directories. A
+        directory that did not exist when watching started has to be
+        polled for until it appears."""
+        return self._inotify is not None and \
+            len(self._watches) == len(self.dir_monitors)
+
+    def _add_watches(self):
+        watched = self._watches.values()
+        for dir_monitor in self.dir_monitors:
+            if dir_monitor in watched:
+                continue
+            try:
+                wd = self._inotify.add_watch(dir_monitor.path)
+            except OSError, e:
+                log.debug("Unable to watch %s: %s" % (dir_monitor.path, e))
+                continue
+            self._watches[wd] = dir_monitor
+
+    def process_events(self, *args):
+        """
+        Read the pending inotify events and call update() if there were
+        any. Suitable as a GLib io watch callback, always returns True to
+        keep the watch.
+        """
+        events = self._inotify.read_events()
+        for wd, mask, name in events:
+            if mask & IN_Q_OVERFLOW:
+                # events were lost, assume everything changed
+                for dir_monitor in self.dir_monitors:
+                    dir_monitor.pending = True
+                continue
+            dir_monitor = self._watches.get(wd)
+            if dir_monitor is None:
+                continue
+            dir_monitor.pending = True
+            if mask & IN_MOVE_SELF:
+                # the watch would follow the directory to its new name
+                self._inotify.rm_watch(wd)
+                del self._watches[wd]
+            elif mask & IN_IGNORED:
+                # the directory was removed, watch it again once it is back
+                del self._watches[wd]
+
+        if events:
+            self.update()
+        return True
+
+    def wait(self, poll_interval):
+        """
+        Block until a directory changes, then call update().
+
+        Without inotify, or while one of the directories is missing, this
+        just checks again every poll_interval seconds.
+        """
+        if not self.start_watching():
+            time.sleep(poll_interval)
+            self.update()
+            return
+
+        timeout = None
+        if not self.fully_watched():
+            timeout = poll_interval
+        try:
+            ready = select.select([self.fileno()], [], [], timeout)[0]
+        except select.error, e:
+            if e.args[0] != errno.EINTR:
+                raise
+            ready = []
+        if ready:
+            self.process_events()
+        else:
+            self.update()
+
     @classmethod
     def from_path_list(cls, path_list=None, changed_callback=None):
         dir_monitors = [MonitorDirectory(path) for path in path_list]
@@ -2,7 +2,19 @@ import gobject
 
 timeout_add = gobject.timeout_add
 idle_add = gobject.idle_add
+source_remove = gobject.source_remove
 MainLoop = gobject.MainLoop
 threads_init = gobject.threads_init
 
-__all__ = [timeout_add, idle_add, MainLoop, threads_init]
+IO_IN = gobject.IO_IN
+PRIORITY_DEFAULT = gobject.PRIORITY_DEFAULT
+
+
+# GLib from gi takes the priority as the second argument, gobject
+# only as a keyword argument.
+def io_add_watch(fd, priority, condition, callback, *user_data):
+    return gobject.io_add_watch(fd, condition, callback, *user_data, priority=priority)
+
+
+__all__ = [timeout_add, idle_add, source_remove, MainLoop, threads_init,
+           io_add_watch, IO_IN, PRIORITY_DEFAULT]
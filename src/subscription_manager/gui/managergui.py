@@ -29,7 +29,6 @@ import webbrowser
 import os
 import socket
 import threading
-import time
 
 import rhsm.config as config
 
@@ -149,6 +148,11 @@ class Backend(object):
     def on_cert_check_timer(self):
         self.cs.force_cert_check()
 
+    # Like on_cert_check_timer, but with inotify this sleeps until one of
+    # the cert dirs changes instead of checking every poll_interval seconds.
+    def wait_for_cert_changes(self, poll_interval):
+        self.cs.cert_monitor.wait(poll_interval)
+
 
 class MainWindow(widgets.SubmanBaseWidget):
     """
@@ -282,8 +286,8 @@ class MainWindow(widgets.SubmanBaseWidget):
         # Update everything with compliance data
         self.backend.cs.notify()
 
-        # managergui needs cert_sort.cert_monitor.run_check() to run
-        # on a timer to detect cert changes from outside the gui
+        # managergui needs cert_sort.cert_monitor to be checked from a
+        # thread to detect cert changes from outside the gui
         # (via rhsmdd for example, or manually provisioned).
         cert_monitor_thread = threading.Thread(target=self._cert_check_timer, name="CertMonitorThread")
         cert_monitor_thread.daemon = True
@@ -297,8 +301,7 @@ class MainWindow(widgets.SubmanBaseWidget):
 
     def _cert_check_timer(self):
         while True:
-            self.backend.on_cert_check_timer()
-            time.sleep(2.0)
+            self.backend.wait_for_cert_changes(2.0)
 
     def _cert_change_update(self):
         # Update installed products
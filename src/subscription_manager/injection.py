@@ -22,6 +22,7 @@ ENT_DIR = "ENT_DIR"
 PROD_DIR = "PROD_DIR"
 RHSM_ICON_CACHE = "RHSM_ICON_CACHE"
 ENTITLEMENT_STATUS_CACHE = "ENTITLEMENT_STATUS_CACHE"
+ENTITLEMENT_SERIALS_CACHE = "ENTITLEMENT_SERIALS_CACHE"
 PROD_STATUS_CACHE = "PROD_STATUS_CACHE"
 OVERRIDE_STATUS_CACHE = "OVERRIDE_STATUS_CACHE"
 CP_PROVIDER = "CP_PROVIDER"
@@ -34,6 +35,7 @@ PROFILE_MANAGER = "PROFILE_MANAGER"
 INSTALLED_PRODUCTS_MANAGER = "INSTALLED_PRODUCTS_MANAGER"
 RELEASE_STATUS_CACHE = "RELEASE_STATUS_CACHE"
 CONTENT_ACCESS_CACHE = "CONTENT_ACCESS_CACHE"
+POOL_CATALOG_CACHE = "POOL_CATALOG_CACHE"
 
 
 class FeatureBroker:
@@ -16,9 +16,9 @@ import subscription_manager.injection as inj
 
 
 from subscription_manager.cache import ProductStatusCache, \
-    EntitlementStatusCache, OverrideStatusCache, ProfileManager, \
+    EntitlementStatusCache, EntitlementSerialsCache, OverrideStatusCache, ProfileManager, \
     InstalledProductsManager, PoolTypeCache, ReleaseStatusCache, \
-    RhsmIconCache, ContentAccessCache
+    RhsmIconCache, ContentAccessCache, PoolCatalogCache
 
 from subscription_manager.cert_sorter import CertSorter
 from subscription_manager.certdirectory import EntitlementDirectory
@@ -52,12 +52,14 @@ def init_dep_injection():
     #        attributes of inj (can happen if yum has old inj module,
     #        but runs a new version of injectioninit...)
     inj.provide(inj.ENTITLEMENT_STATUS_CACHE, EntitlementStatusCache, singleton=True)
+    inj.provide(inj.ENTITLEMENT_SERIALS_CACHE, EntitlementSerialsCache, singleton=True)
     inj.provide(inj.RHSM_ICON_CACHE, RhsmIconCache, singleton=True)
     inj.provide(inj.PROD_STATUS_CACHE, ProductStatusCache, singleton=True)
     inj.provide(inj.OVERRIDE_STATUS_CACHE, OverrideStatusCache, singleton=True)
     inj.provide(inj.RELEASE_STATUS_CACHE, ReleaseStatusCache,
                 singleton=False)
     inj.provide(inj.CONTENT_ACCESS_CACHE, ContentAccessCache, singleton=True)
+    inj.provide(inj.POOL_CATALOG_CACHE, PoolCatalogCache, singleton=True)
 
     inj.provide(inj.PROFILE_MANAGER, ProfileManager, singleton=True)
     inj.provide(inj.INSTALLED_PRODUCTS_MANAGER, InstalledProductsManager, singleton=True)
@@ -677,6 +677,9 @@ class RefreshCommand(CliCommand):
             if content_access.exists():
                 content_access.remove()
 
+            # pools may have been added or changed server side
+            inj.require(inj.POOL_CATALOG_CACHE).delete_cache()
+
             # Force a regen of the entitlement certs for this consumer
             # TODO: Eventually migrate this to capability recognition. Currently it will silently return
             #   false if an error occurs
@@ -1890,6 +1893,8 @@ class FactsCommand(CliCommand):
         if self.options.update:
             identity = inj.require(inj.IDENTITY)
             try:
+                # an explicit update should not be answered from cached facts
+                facts.refresh_facts()
                 facts.update_check(self.cp, identity.uuid, force=True)
             except connection.RestlibException, re:
                 log.exception(re)
@@ -2316,6 +2321,8 @@ class ListCommand(CliCommand):
                                help=_("lists only subscriptions or products containing the specified expression in the subscription or product information, varying with the list requested and the server version (case-insensitive)."))
         self.parser.add_option("--pool-only", dest="pid_only", action="store_true",
                                help=_("lists only the pool IDs for applicable available or consumed subscriptions; only used with --available and --consumed"))
+        self.parser.add_option("--cached", action="store_true",
+                               help=_("lists subscriptions from the local pool cache when available, whatever their age; only used with --available"))
 
     def _validate_options(self):
         if (self.options.all and not self.options.available):
@@ -2330,6 +2337,8 @@ class ListCommand(CliCommand):
             system_exit(os.EX_USAGE, _("Error: --match-installed is only applicable with --available"))
         if self.options.no_overlap and not self.options.available:
             system_exit(os.EX_USAGE, _("Error: --no-overlap is only applicable with --available"))
+        if self.options.cached and not self.options.available:
+            system_exit(os.EX_USAGE, _("Error: --cached is only applicable with --available"))
         if self.options.pid_only and self.options.installed:
             system_exit(os.EX_USAGE, _("Error: --pool-only is only applicable with --available and/or --consumed"))
 
@@ -2377,7 +2386,8 @@ class ListCommand(CliCommand):
                                                            active_on=on_date,
                                                            overlapping=self.options.no_overlap,
                                                            uninstalled=self.options.match_installed,
-                                                           filter_string=self.options.filter_string)
+                                                           filter_string=self.options.filter_string,
+                                                           cached=self.options.cached)
 
             # Filter certs by service level, if specified.
             # Allowing "" here.
@@ -22,6 +22,8 @@ import re
 import shutil
 import stat
 import syslog
+import threading
+import time
 
 from rhsm import connection
 from rhsm.config import initConfig
@@ -32,9 +34,9 @@ import subscription_manager.cache as cache
 from subscription_manager.cert_sorter import StackingGroupSorter, ComplianceManager
 from subscription_manager import identity
 from subscription_manager.injection import require, CERT_SORTER, \
-        IDENTITY, ENTITLEMENT_STATUS_CACHE, \
+        IDENTITY, ENTITLEMENT_STATUS_CACHE, ENTITLEMENT_SERIALS_CACHE, \
         PROD_STATUS_CACHE, ENT_DIR, PROD_DIR, CP_PROVIDER, OVERRIDE_STATUS_CACHE, \
-        POOLTYPE_CACHE, RELEASE_STATUS_CACHE, FACTS
+        POOLTYPE_CACHE, RELEASE_STATUS_CACHE, FACTS, POOL_CATALOG_CACHE
 from subscription_manager import isodate
 from subscription_manager.jsonwrapper import PoolWrapper
 from subscription_manager.repolib import RepoActionInvoker
@@ -280,28 +282,165 @@ def list_pools(uep, consumer_uuid, list_all=False, active_on=None, filter_string
     #         then service flops 'been_synced' property
     # subman gets signal that props changed, and that been_synced is now true
     # since it's been synced, then subman continues
-    require(FACTS).update_check(uep, consumer_uuid)
+    session = PoolQuerySession(uep, consumer_uuid)
+    return session.list_pools(list_all=list_all, active_on=active_on,
+            filter_string=filter_string)
 
-    profile_mgr = cache.ProfileManager()
-    profile_mgr.update_check(uep, consumer_uuid)
 
-    owner = uep.getOwner(consumer_uuid)
-    ownerid = owner['key']
+class PoolQuerySession(object):
+    """
+    Pool queries for one consumer, sharing a single pre-flight.
+
+    Before pools are listed the server is sent any changed facts and
+    package profile, so its rules are checked against the current state
+    of the consumer, and the owner of the consumer is looked up. A session
+    does this once, however many queries it then runs. The time taken by
+    each phase is logged and kept in timings.
+
+    Given a PoolCatalogCache, pools it lists are stored in it, and later
+    queries are answered from it while the cached pools are younger than
+    its TTL, or of any age if cached is set. Expired pools are still used
+    while being refreshed in the background if the catalog allows it.
+    Facts and package profile are synced before the catalog is looked at,
+    unless cached is set, as sending changes makes the cached pools stale.
+    """
+    def __init__(self, uep, consumer_uuid, catalog=None, cached=False):
+        self.uep = uep
+        self.consumer_uuid = consumer_uuid
+        self.catalog = catalog
+        self.cached = cached
+        self.owner_key = None
+        self.timings = {}
+        self._synced = False
+        self._prepared = False
+        self._lock = threading.Lock()
+
+    def _timed(self, phase, func, *args, **kwargs):
+        start = time.time()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            self.timings[phase] = time.time() - start
+            log.debug("Pool query %s took %.3fs" % (phase, self.timings[phase]))
+
+    def sync(self):
+        """
+        Sync facts and package profile, if not done yet in this session.
+        """
+        with self._lock:
+            self._sync()
+
+    def _sync(self):
+        if self._synced:
+            return
+        self._timed('facts', require(FACTS).update_check, self.uep,
+                self.consumer_uuid)
+        self._timed('profile', cache.ProfileManager().update_check, self.uep,
+                self.consumer_uuid)
+        self._synced = True
+
+    def prepare(self):
+        """
+        Sync facts and package profile, and look up the owner, if not done
+        yet in this session.
+        """
+        with self._lock:
+            if self._prepared:
+                return
+            self._sync()
+            owner = self._timed('owner', self.uep.getOwner, self.consumer_uuid)
+            self.owner_key = owner['key']
+            self._prepared = True
+
+    def list_pools(self, list_all=False, active_on=None, filter_string=None):
+        if self.catalog is not None:
+            if not self.cached:
+                self.sync()
+            found = self.catalog.get(self.consumer_uuid, list_all, active_on,
+                    filter_string)
+            if found is not None:
+                pools, age = found
+                if self.cached or age < self.catalog.ttl:
+                    log.debug("Using %d pools cached %ds ago" % (len(pools), age))
+                    return pools
+                if self.catalog.background_refresh:
+                    log.debug("Using %d pools cached %ds ago, refreshing them in "
+                              "the background" % (len(pools), age))
+                    self._refresh(list_all, active_on, filter_string)
+                    return pools
+        return self._query(list_all, active_on, filter_string)
+
+    def _query(self, list_all, active_on, filter_string):
+        self.prepare()
+        if self.catalog is not None:
+            consumer_data = self.catalog.consumer_data()
+        if list_all:
+            phase = 'all pools'
+        else:
+            phase = 'compatible pools'
+        pools = self._timed(phase, self.uep.getPoolsList,
+                consumer=self.consumer_uuid, listAll=list_all,
+                active_on=active_on, owner=self.owner_key,
+                filter_string=filter_string)
+        if self.catalog is not None:
+            self.catalog.put(self.consumer_uuid, self.owner_key, pools,
+                    list_all, active_on, filter_string, consumer_data)
+        return pools
+
+    def _refresh(self, list_all, active_on, filter_string):
+        def refresh():
+            try:
+                self._query(list_all, active_on, filter_string)
+            except Exception, e:
+                log.warn("Unable to refresh cached pools: %s" % e)
+
+        # Not a daemon thread, so the refreshed pools get saved even if
+        # the process is done with the stale ones first.
+        thread = threading.Thread(target=refresh, name="PoolCatalogRefreshThread")
+        thread.start()
+
+    def list_compatible_and_all_pools(self, active_on=None, filter_string=None):
+        """
+        Return the compatible pools and all pools, both queries are sent to
+        the server at the same time.
+        """
+        results = {}
+
+        def query(list_all):
+            try:
+                results[list_all] = (self.list_pools(list_all, active_on,
+                    filter_string), None)
+            except Exception, e:
+                results[list_all] = (None, e)
+
+        thread = threading.Thread(target=query, args=(True,),
+                                  name="PoolQueryAllPoolsThread")
+        thread.setDaemon(True)
+        thread.start()
+        query(False)
+        thread.join()
 
-    return uep.getPoolsList(consumer=consumer_uuid, listAll=list_all,
-            active_on=active_on, owner=ownerid, filter_string=filter_string)
+        for list_all in (False, True):
+            error = results[list_all][1]
+            if error is not None:
+                raise error
+        return results[False][0], results[True][0]
 
 
 # TODO: This method is morphing the actual pool json and returning a new
 # dict which does not contain all the pool info. Not sure if this is really
 # necessary. Also some "view" specific things going on in here.
 def get_available_entitlements(get_all=False, active_on=None, overlapping=False,
-                               uninstalled=False, text=None, filter_string=None):
+                               uninstalled=False, text=None, filter_string=None,
+                               cached=False):
     """
     Returns a list of entitlement pools from the server.
 
     The 'all' setting can be used to return all pools, even if the rules do
     not pass. (i.e. show pools that are incompatible for your hardware)
+
+    With 'cached' set, pools found in the local pool catalog are returned
+    whatever their age, instead of being fetched again.
     """
     columns = [
         'id',
@@ -320,7 +459,7 @@ def get_available_entitlements(get_all=False, active_on=None, overlapping=False,
         'management_enabled'
     ]
 
-    pool_stash = PoolStash()
+    pool_stash = PoolStash(cached=cached)
     dlist = pool_stash.get_filtered_pools_list(active_on, not get_all,
            overlapping, uninstalled, text, filter_string)
 
@@ -455,8 +594,10 @@ class PoolStash(object):
     Object used to fetch pools from the server, sort them into compatible,
     incompatible, and installed lists. Also does filtering based on name.
     """
-    def __init__(self):
+    def __init__(self, cached=False):
         self.identity = require(IDENTITY)
+        self.catalog = require(POOL_CATALOG_CACHE)
+        self.cached = cached
         self.sorter = None
 
         # Pools which passed rules server side for this consumer:
@@ -486,16 +627,17 @@ class PoolStash(object):
         self.all_pools = {}
         self.compatible_pools = {}
         log.debug("Refreshing pools from server...")
-        for pool in list_pools(require(CP_PROVIDER).get_consumer_auth_cp(),
-                self.identity.uuid, active_on=active_on):
+        start = time.time()
+        session = self._session()
+        compatible, all_pools = session.list_compatible_and_all_pools(active_on=active_on)
+        for pool in compatible:
             self.compatible_pools[pool['id']] = pool
             self.all_pools[pool['id']] = pool
 
         # Filter the list of all pools, removing those we know are compatible.
         # Sadly this currently requires a second query to the server.
         self.incompatible_pools = {}
-        for pool in list_pools(require(CP_PROVIDER).get_consumer_auth_cp(),
-                self.identity.uuid, list_all=True, active_on=active_on):
+        for pool in all_pools:
             if not pool['id'] in self.compatible_pools:
                 self.incompatible_pools[pool['id']] = pool
                 self.all_pools[pool['id']] = pool
@@ -506,6 +648,7 @@ class PoolStash(object):
         # we can avoid more api calls
         require(POOLTYPE_CACHE).update_from_pools(self.all_pools)
 
+        log.debug("Refreshed pools in %.3fs" % (time.time() - start))
         log.debug("found %s pools:" % len(self.all_pools))
         log.debug("   %s compatible" % len(self.compatible_pools))
         log.debug("   %s incompatible" % len(self.incompatible_pools))
@@ -524,17 +667,21 @@ class PoolStash(object):
         elif not active_on and overlapping:
             self.sorter = require(CERT_SORTER)
 
+        session = self._session()
         if incompatible:
-            for pool in list_pools(require(CP_PROVIDER).get_consumer_auth_cp(),
-                    self.identity.uuid, active_on=active_on, filter_string=filter_string):
+            for pool in session.list_pools(active_on=active_on, filter_string=filter_string):
                 self.compatible_pools[pool['id']] = pool
         else:  # --all has been used
-            for pool in list_pools(require(CP_PROVIDER).get_consumer_auth_cp(),
-                    self.identity.uuid, list_all=True, active_on=active_on, filter_string=filter_string):
+            for pool in session.list_pools(list_all=True, active_on=active_on,
+                    filter_string=filter_string):
                 self.all_pools[pool['id']] = pool
 
         return self._filter_pools(incompatible, overlapping, uninstalled, False, text)
 
+    def _session(self):
+        return PoolQuerySession(require(CP_PROVIDER).get_consumer_auth_cp(),
+                self.identity.uuid, catalog=self.catalog, cached=self.cached)
+
     def _get_subscribed_pool_ids(self):
         return [ent.pool.id for ent in require(ENT_DIR).list()]
 
@@ -872,6 +1019,7 @@ def clean_all_data(backup=True):
     # for deleting persistent caches
     cache.ProfileManager.delete_cache()
     cache.InstalledProductsManager.delete_cache()
+    require(POOL_CATALOG_CACHE).delete_cache()
 
     # FIXME: implement as dbus client to facts service DeleteCache() once implemented
     #Facts.delete_cache()
@@ -883,6 +1031,7 @@ def clean_all_data(backup=True):
     # and delete_cache is an instance method, so we need to call
     # the delete_cache on the instances created in injectioninit.
     require(ENTITLEMENT_STATUS_CACHE).delete_cache()
+    require(ENTITLEMENT_SERIALS_CACHE).delete_cache()
     require(PROD_STATUS_CACHE).delete_cache()
     require(OVERRIDE_STATUS_CACHE).delete_cache()
     require(RELEASE_STATUS_CACHE).delete_cache()
@@ -0,0 +1,192 @@
+#
+# Copyright (c) 2017 Red Hat, Inc.
+#
+# This software is licensed to you under the GNU General Public License,
+# version 2 (GPLv2). There is NO WARRANTY for this software, express or
+# implied, including the implied warranties of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. You should have received a copy of GPLv2
+# along with this software; if not, see
+# http://www.gnu.org/licenses/old-licenses/gpl-2.0.txt.
+#
+# Red Hat trademarks are not licensed under GPLv2. No permission is
+# granted to use or replicate Red Hat trademarks that are incorporated
+# in this software or its documentation.
+#
+"""
+Fingerprint of the files redhat.repo is generated from.
+
+The yum and dnf plugins regenerate redhat.repo before every transaction,
+which means connecting to the entitlement server, reading the override
+cache and parsing every entitlement certificate. When the plugins only
+work from the caches (full_refresh_on_yum off) the result can only change
+if one of the files involved changes, so the plugins record their
+fingerprint after an update and skip the next one while it still matches.
+
+This module is imported before anything else by the plugins, keep it
+free of imports beyond the standard library and python-rhsm's json wrapper.
+"""
+
+import calendar
+import errno
+import hashlib
+import logging
+import os
+import tempfile
+import time
+
+from rhsm import ourjson as json
+
+log = logging.getLogger(__name__)
+
+FINGERPRINT_FILE = "/var/lib/rhsm/cache/redhat_repo_fingerprint.json"
+
+REPO_FILE = "/etc/yum.repos.d/redhat.repo"
+DEFAULT_PRODUCT_CERT_DIR = "/etc/pki/product-default"
+CLASSIC_SYSTEMID = "/etc/sysconfig/rhn/systemid"
+
+# Only read by repolib when it runs from the caches. The release cache is
+# left out on purpose, it is rewritten by every update, and setting a new
+# release rewrites redhat.repo anyway.
+OVERRIDES_FILE = "/var/lib/rhsm/cache/content_overrides.json"
+
+# Written by every update.
+OUTPUT_FILES = [
+    REPO_FILE,
+    "/var/lib/rhsm/cache/written_overrides.json",
+]
+
+
+def _stat(path):
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return [st.st_size, st.st_mtime, st.st_ino]
+
+
+def _dir_stats(path):
+    try:
+        names = sorted(os.listdir(path))
+    except OSError:
+        return None
+    return [[name, _stat(os.path.join(path, name))] for name in names]
+
+
+def valid_until(certs):
+    """
+    Return the time at which the validity of one of the certificates
+    changes next, as seconds since the epoch, or None if it never does.
+    """
+    now = time.time()
+    changes = []
+    for cert in certs:
+        for when in (cert.start, cert.end):
+            timestamp = calendar.timegm(when.utctimetuple())
+            if timestamp > now:
+                changes.append(timestamp)
+    if not changes:
+        return None
+    return min(changes)
+
+
+class RepoFingerprint(object):
+    """
+    Fingerprint of the inputs and the output of a redhat.repo update.
+
+    :meth:`check` tells whether the last recorded update is still current,
+    and returns the messages the plugin printed back then. :meth:`begin`
+    and :meth:`save` bracket an update, nothing is recorded if any of the
+    inputs changed while it ran.
+    """
+
+    def __init__(self, cfg, releasever=None, path=FINGERPRINT_FILE):
+        self.cfg = cfg
+        self.releasever = releasever
+        self.path = path
+        self._before = None
+
+    def _inputs(self):
+        consumer_dir = self.cfg.get('rhsm', 'consumerCertDir')
+        return [
+            self.releasever,
+            _stat(getattr(self.cfg, 'config_file', None) or ''),
+            _dir_stats(self.cfg.get('rhsm', 'entitlementCertDir')),
+            _dir_stats(self.cfg.get('rhsm', 'productCertDir')),
+            _dir_stats(DEFAULT_PRODUCT_CERT_DIR),
+            _stat(os.path.join(consumer_dir, 'cert.pem')),
+            _stat(CLASSIC_SYSTEMID),
+            _stat(OVERRIDES_FILE),
+        ]
+
+    def _fingerprint(self, inputs):
+        outputs = [_stat(output_file) for output_file in OUTPUT_FILES]
+        data = json.dumps([inputs, outputs], sort_keys=True)
+        return hashlib.sha256(data.encode('utf-8')).hexdigest()
+
+    def check(self):
+        """
+        Return the messages recorded with the last update if nothing it
+        depends on changed since, otherwise None.
+        """
+        try:
+            f = open(self.path)
+            try:
+                record = json.load(f)
+            finally:
+                f.close()
+        except (IOError, ValueError):
+            return None
+        if not isinstance(record, dict):
+            return None
+        until = record.get('valid_until')
+        if until is not None and time.time() >= until:
+            return None
+        if record.get('fingerprint') != self._fingerprint(self._inputs()):
+            return None
+        return record.get('messages') or []
+
+    def begin(self):
+        """
+        Take note of the inputs before updating redhat.repo.
+        """
+        self._before = self._inputs()
+
+    def save(self, messages, valid_until=None):
+        """
+        Record the fingerprint after a successful update, along with the
+        messages to repeat while it matches and the time after which it
+        must not be used anymore.
+        """
+        inputs = self._inputs()
+        if inputs != self._before:
+            log.debug("Inputs of %s changed during the update, not recording them" %
+                    REPO_FILE)
+            self.invalidate()
+            return
+        record = {
+            'fingerprint': self._fingerprint(inputs),
+            'messages': messages,
+            'valid_until': valid_until,
+        }
+        cache_dir = os.path.dirname(self.path)
+        try:
+            fd, tmp_path = tempfile.mkstemp(dir=cache_dir, prefix='.redhat_repo')
+            try:
+                f = os.fdopen(fd, 'w')
+                try:
+                    json.dump(record, f)
+                finally:
+                    f.close()
+                os.rename(tmp_path, self.path)
+            except Exception:
+                os.unlink(tmp_path)
+                raise
+        except (IOError, OSError) as e:
+            if e.errno not in (errno.ENOENT, errno.EACCES, errno.EPERM, errno.EROFS):
+                log.warning("Unable to write %s: %s" % (self.path, e))
+
+    def invalidate(self):
+        try:
+            os.unlink(self.path)
+        except OSError:
+            pass
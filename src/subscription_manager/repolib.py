@@ -19,18 +19,22 @@
 # TODO: cleanup config parser imports
 from ConfigParser import Error as ConfigParserError
 import gettext
+import hashlib
 from iniparse import RawConfigParser as ConfigParser
 import logging
 import os
 import string
 import socket
+import tempfile
 import subscription_manager.injection as inj
-from subscription_manager.cache import OverrideStatusCache, WrittenOverrideCache
+from subscription_manager.cache import OverrideStatusCache, WrittenOverrideCache, \
+        RepoSectionCache
 from subscription_manager import utils
 from subscription_manager import model
 from subscription_manager.model import ent_cert
 
 from rhsm.config import initConfig, in_container
+from rhsm import ourjson as json
 
 # FIXME: local imports
 
@@ -64,6 +68,10 @@ def manage_repos_enabled():
     return bool(manage_repos)
 
 
+def _digest(data):
+    return hashlib.sha256(json.dumps(data, sort_keys=True)).hexdigest()
+
+
 class RepoActionInvoker(BaseActionInvoker):
     """Invoker for yum repo updating related actions."""
     def __init__(self, cache_only=False, locker=None):
@@ -110,6 +118,7 @@ class RepoActionInvoker(BaseActionInvoker):
             os.unlink(repo_file.path)
         # When the repo is removed, also remove the override tracker
         WrittenOverrideCache.delete_cache()
+        RepoSectionCache.delete_cache()
 
 
 # This is $releasever specific, but expanding other vars would be similar,
@@ -230,6 +239,14 @@ class RepoUpdateActionCommand(object):
             pass
         self.written_overrides = WrittenOverrideCache()
 
+        # Sections of redhat.repo found unchanged by get_all_content(), and
+        # the stamps of what each section is generated from.
+        self.section_cache = RepoSectionCache()
+        self._repo_file = None
+        self._disk_sections = {}
+        self._unchanged = set()
+        self._stamps = {}
+
         # FIXME: empty report at the moment, should be changed to include
         # info about updated repos
         self.report = RepoActionReport()
@@ -280,29 +297,38 @@ class RepoUpdateActionCommand(object):
             return 0
 
         repo_file.read()
+        self._load_sections(repo_file)
         valid = set()
+        changed = False
 
         # Iterate content from entitlement certs, and create/delete each section
         # in the RepoFile as appropriate:
         for cont in self.get_unique_content():
             valid.add(cont.id)
+            if cont.id in self._unchanged:
+                continue
             existing = repo_file.section(cont.id)
             if existing is None:
                 repo_file.add(cont)
                 self.report_add(cont)
-            else:
-                # Updates the existing repo with new content
-                self.update_repo(existing, cont)
+                changed = True
+            # Updates the existing repo with new content
+            elif self.update_repo(existing, cont):
                 repo_file.update(existing)
                 self.report_update(existing)
+                changed = True
 
         for section in repo_file.sections():
             if section not in valid:
                 self.report_delete(section)
                 repo_file.delete(section)
+                changed = True
 
-        # Write new RepoFile to disk:
-        repo_file.write()
+        # Write new RepoFile to disk, the sections left alone are as on disk
+        # already:
+        if changed:
+            repo_file.write(check_changed=False)
+        self._save_sections(repo_file, valid)
         if self.override_supported:
             # Update with the values we just wrote
             self.written_overrides.overrides = self.overrides
@@ -310,6 +336,49 @@ class RepoUpdateActionCommand(object):
         log.info("repos updated: %s" % self.report)
         return self.report
 
+    def _section_digest(self, repo_file, section):
+        return _digest([[k, v] for (k, v) in repo_file.items(section)])
+
+    def _load_sections(self, repo_file):
+        """
+        Hash the sections currently in redhat.repo, for get_all_content()
+        to tell which it does not need to generate again.
+        """
+        if self.section_cache._cache_exists():
+            self.section_cache._read_cache()
+        self._disk_sections = {}
+        for section in repo_file.sections():
+            self._disk_sections[section] = self._section_digest(repo_file, section)
+        self._repo_file = repo_file
+
+    def _save_sections(self, repo_file, valid):
+        sections = {}
+        for section in valid:
+            stamp = self._stamps.get(section)
+            if stamp is not None and repo_file.has_section(section):
+                sections[section] = [stamp, self._section_digest(repo_file, section)]
+        if sections != self.section_cache.sections:
+            self.section_cache.sections = sections
+            self.section_cache.write_cache()
+
+    def _content_stamp(self, content, repo_id, settings, release_source):
+        """
+        Hash everything the section for content is generated from.
+        """
+        url = content.url or ''
+        release = None
+        if release_source.marker in url:
+            release = release_source.get_expansion()
+        overrides = None
+        written_overrides = None
+        if self.override_supported and self.apply_overrides:
+            overrides = self.overrides.get(repo_id)
+            written_overrides = self.written_overrides.overrides.get(repo_id)
+        return _digest([content.label, content.cert.serial, content.cert.path,
+                content.name, content.enabled, url, content.gpg,
+                content.metadata_expire, release, settings, overrides,
+                written_overrides])
+
     def get_unique_content(self):
         # FIXME Shouldn't this skip all of the repo updating?
         if not self.manage_repos:
@@ -335,6 +404,8 @@ class RepoUpdateActionCommand(object):
     def get_all_content(self, baseurl, ca_cert):
         matching_content = self.matching_content()
         content_list = []
+        self._unchanged = set()
+        self._stamps = {}
 
         # avoid checking for release/etc if there is no matching_content
         if not matching_content:
@@ -345,7 +416,26 @@ class RepoUpdateActionCommand(object):
         # cache_only as well.
         release_source = YumReleaseverSource()
 
+        settings = [baseurl, ca_cert, conf['server']['proxy_hostname'],
+                conf['server']['proxy_port'], conf['server']['proxy_user'],
+                conf['server']['proxy_password']]
+
         for content in matching_content:
+            repo_id = Repo.clean_id(content.label)
+            stamp = self._content_stamp(content, repo_id, settings,
+                                        release_source)
+            # the first content for a repo id wins, as in get_unique_content()
+            if repo_id not in self._stamps:
+                self._stamps[repo_id] = stamp
+                # Neither the content nor the section on disk changed since
+                # the section was written, use it as is.
+                cached = self.section_cache.sections.get(repo_id)
+                if cached and repo_id in self._disk_sections and \
+                        cached == [stamp, self._disk_sections[repo_id]]:
+                    self._unchanged.add(repo_id)
+                    content_list.append(self._repo_file.section(repo_id))
+                    continue
+
             repo = Repo.from_ent_cert_content(content, baseurl, ca_cert,
                                               release_source)
 
@@ -508,7 +598,7 @@ class Repo(dict):
     def __init__(self, repo_id, existing_values=None):
         # existing_values is a list of 2-tuples
         existing_values = existing_values or []
-        self.id = self._clean_id(repo_id)
+        self.id = self.clean_id(repo_id)
 
         # used to store key order, so we can write things out in the order
         # we read them from the config.
@@ -609,7 +699,8 @@ class Repo(dict):
         return contenturl.replace(release_source.marker,
                                   expansion)
 
-    def _clean_id(self, repo_id):
+    @staticmethod
+    def clean_id(repo_id):
         """
         Format the config file id to contain only characters that yum expects
         (we'll just replace 'bad' chars with -)
@@ -754,17 +845,36 @@ class RepoFile(ConfigParser):
         on_disk.read(self.path)
         return not self._configparsers_equal(on_disk)
 
-    def write(self):
+    def write(self, check_changed=True):
+        """
+        Write the file if its contents differ from the file on disk, or
+        unconditionally if check_changed is False.
+
+        The file is replaced atomically, yum never sees a partial file.
+        """
         if not self.manage_repos:
             log.debug("Skipping write due to manage_repos setting: %s" %
                     self.path)
             return
-        if self._has_changed():
-            f = open(self.path, 'w')
+        if check_changed and not self._has_changed():
+            return
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(self.path),
+                                        prefix='.%s' % os.path.basename(self.path))
+        try:
+            f = os.fdopen(fd, 'w')
             tidy_writer = TidyWriter(f)
             ConfigParser.write(self, tidy_writer)
             tidy_writer.close()
             f.close()
+            try:
+                mode = os.stat(self.path).st_mode & 0777
+            except OSError:
+                mode = 0644
+            os.chmod(tmp_path, mode)
+            os.rename(tmp_path, self.path)
+        except Exception:
+            os.unlink(tmp_path)
+            raise
 
     def add(self, repo):
         self.add_section(repo.id)
@@ -171,6 +171,8 @@ class SubManFixture(unittest.TestCase):
         inj.provide(inj.PRODUCT_DATE_RANGE_CALCULATOR, self.mock_calc)
 
         inj.provide(inj.ENTITLEMENT_STATUS_CACHE, stubs.StubEntitlementStatusCache())
+        inj.provide(inj.ENTITLEMENT_SERIALS_CACHE, stubs.StubEntitlementSerialsCache())
+        inj.provide(inj.POOL_CATALOG_CACHE, stubs.StubPoolCatalogCache())
         inj.provide(inj.PROD_STATUS_CACHE, stubs.StubProductStatusCache())
         inj.provide(inj.OVERRIDE_STATUS_CACHE, stubs.StubOverrideStatusCache())
         inj.provide(inj.RELEASE_STATUS_CACHE, stubs.StubReleaseStatusCache())
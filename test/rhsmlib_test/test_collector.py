@@ -16,11 +16,17 @@ try:
 except ImportError:
     import unittest
 
+import os
 import platform
+import shutil
+import tempfile
+import threading
+import time
+
 import mock
 from test.fixture import open_mock
 
-from rhsmlib.facts import collector, firmware_info
+from rhsmlib.facts import collector, custom, firmware_info, host_collector, hwprobe
 
 
 class GetArchTest(unittest.TestCase):
@@ -41,3 +47,231 @@ class GetArchTest(unittest.TestCase):
     def test_get_platform_specific_info_provider(self):
         info_provider = firmware_info.get_firmware_collector(arch=platform.machine())
         self.assertTrue(info_provider is not None)
+
+
+class CollectionRunTest(unittest.TestCase):
+    def test_collector_runs_once(self):
+        facts_collector = collector.FactsCollector(arch="x86_64")
+        facts_collector.get_all = mock.Mock(return_value={"a": "1"})
+        run = collector.CollectionRun()
+
+        self.assertEqual({"a": "1"}, run.get_all(facts_collector))
+        self.assertEqual({"a": "1"}, dict(facts_collector.collect(run).data))
+        self.assertEqual(1, facts_collector.get_all.call_count)
+
+    def test_equivalent_collectors_shared(self):
+        run = collector.CollectionRun()
+        with mock.patch.object(hwprobe.HardwareCollector, 'get_all') as mock_get_all:
+            mock_get_all.return_value = {"uname.machine": "x86_64"}
+            run.get_all(hwprobe.HardwareCollector(arch="x86_64"))
+            run.get_all(hwprobe.HardwareCollector(arch="x86_64"))
+            self.assertEqual(1, mock_get_all.call_count)
+
+    def test_custom_facts_paths_in_key(self):
+        etc_facts = custom.CustomFactsCollector(path_and_globs=[('/etc/rhsm/facts/', '*.facts')])
+        same_facts = custom.CustomFactsCollector(path_and_globs=[('/etc/rhsm/facts', '*.facts')])
+        other_facts = custom.CustomFactsCollector(path_and_globs=[('/tmp/facts', '*.facts')])
+        self.assertEqual(etc_facts.run_key(), same_facts.run_key())
+        self.assertNotEqual(etc_facts.run_key(), other_facts.run_key())
+
+    @mock.patch('locale.getdefaultlocale', mock.Mock(return_value=('en_US', 'UTF-8')))
+    @mock.patch.object(custom.CustomFactsCollector, 'get_all')
+    @mock.patch('rhsmlib.facts.cleanup.CleanupCollector.get_all')
+    @mock.patch('rhsmlib.facts.virt.VirtWhatCollector.get_all')
+    @mock.patch('rhsmlib.facts.virt.VirtCollector.get_all')
+    @mock.patch('rhsmlib.facts.firmware_info.FirmwareCollector.get_all')
+    @mock.patch.object(hwprobe.HardwareCollector, 'get_all')
+    def test_host_collector_shares_sub_collectors(self, mock_hw, mock_firmware,
+                                                  mock_virt, mock_virt_what, mock_cleanup, mock_custom):
+        mock_hw.return_value = {"uname.machine": "x86_64"}
+        for mock_get_all in (mock_firmware, mock_virt, mock_virt_what, mock_cleanup, mock_custom):
+            mock_get_all.return_value = {}
+
+        run = collector.CollectionRun()
+        host_facts = host_collector.HostCollector(arch="x86_64").collect(run)
+        hardware_facts = hwprobe.HardwareCollector(arch="x86_64").collect(run)
+
+        self.assertEqual("x86_64", host_facts.data["uname.machine"])
+        self.assertEqual({"uname.machine": "x86_64"}, dict(hardware_facts.data))
+        self.assertEqual(1, mock_hw.call_count)
+
+    @mock.patch('locale.getdefaultlocale', mock.Mock(return_value=('en_US', 'UTF-8')))
+    @mock.patch.object(custom.CustomFactsCollector, 'get_all', mock.Mock(return_value={}))
+    @mock.patch('rhsmlib.facts.cleanup.CleanupCollector.get_all', mock.Mock(return_value={}))
+    @mock.patch('rhsmlib.facts.virt.VirtWhatCollector.get_all')
+    @mock.patch('rhsmlib.facts.firmware_info.FirmwareCollector.get_all', mock.Mock(return_value={}))
+    @mock.patch.object(hwprobe.HardwareCollector, 'get_all', mock.Mock(return_value={}))
+    def test_host_collector_runs_virt_what_once(self, mock_virt_what):
+        mock_virt_what.return_value = {"virt.is_guest": False}
+        host_facts = host_collector.HostCollector(arch="x86_64").get_all()
+        self.assertEqual(False, host_facts["virt.is_guest"])
+        self.assertEqual(1, mock_virt_what.call_count)
+
+    @mock.patch('locale.getdefaultlocale', mock.Mock(return_value=('en_US', 'UTF-8')))
+    @mock.patch.object(custom.CustomFactsCollector, 'get_all', mock.Mock(return_value={}))
+    @mock.patch('rhsmlib.facts.cleanup.CleanupCollector.get_all', mock.Mock(return_value={}))
+    @mock.patch('rhsmlib.facts.virt.VirtWhatCollector.get_all')
+    @mock.patch('rhsmlib.facts.firmware_info.FirmwareCollector.get_all', mock.Mock(return_value={}))
+    @mock.patch.object(hwprobe.HardwareCollector, 'get_all', mock.Mock(return_value={}))
+    def test_host_collector_does_not_wait_for_timed_out_virt_what(self, mock_virt_what):
+        release = threading.Event()
+        self.addCleanup(release.set)
+
+        def hung_virt_what():
+            release.wait(5)
+            return {"virt.is_guest": False}
+        mock_virt_what.side_effect = hung_virt_what
+
+        host = host_collector.HostCollector(arch="x86_64")
+        host.probe_timeout = 0.2
+        start = time.time()
+        host_facts = host.get_all()
+        self.assertTrue(time.time() - start < 2)
+        self.assertFalse("virt.is_guest" in host_facts)
+        self.assertEqual(1, mock_virt_what.call_count)
+
+    def test_failed_collector_not_run_again(self):
+        facts_collector = collector.FactsCollector(arch="x86_64")
+        facts_collector.get_all = mock.Mock(side_effect=ValueError("broken"))
+        run = collector.CollectionRun()
+
+        self.assertRaises(ValueError, run.get_all, facts_collector)
+        self.assertEqual({}, run.get_all(facts_collector))
+        self.assertEqual(1, facts_collector.get_all.call_count)
+
+
+class ConcurrentCollectionTest(unittest.TestCase):
+    def test_call_concurrently(self):
+        started = threading.Event()
+
+        def first():
+            # only returns if the second call is running at the same time
+            started.wait(5)
+            return "first"
+
+        def second():
+            started.set()
+            return "second"
+
+        def failing():
+            raise ValueError("broken")
+
+        outcomes = collector.call_concurrently([first, second, failing])
+        self.assertEqual([("first", None), ("second", None)], outcomes[:2])
+        self.assertTrue(isinstance(outcomes[2][1], ValueError))
+
+    def test_call_concurrently_timeout(self):
+        finish = threading.Event()
+        outcomes = collector.call_concurrently([lambda: finish.wait(5), lambda: "done"], timeout=0.1)
+        finish.set()
+        self.assertTrue(isinstance(outcomes[0][1], collector.ProbeTimeout))
+        self.assertEqual(("done", None), outcomes[1])
+
+    def test_hardware_methods_merged_in_order(self):
+        def slow():
+            time.sleep(0.05)
+            return {"a": "slow", "b": "slow"}
+
+        def fast():
+            return {"b": "fast"}
+
+        def broken():
+            raise ValueError("broken")
+
+        facts_collector = collector.FactsCollector(arch="x86_64", hardware_methods=[slow, broken, fast])
+        facts_collector.concurrent_hardware_methods = True
+        self.assertEqual({"a": "slow", "b": "fast"}, facts_collector.get_all())
+
+    def test_running_collector_shared_between_threads(self):
+        release = threading.Event()
+        facts_collector = collector.FactsCollector(arch="x86_64")
+
+        def get_all():
+            release.wait(5)
+            return {"a": "1"}
+        facts_collector.get_all = mock.Mock(side_effect=get_all)
+
+        run = collector.CollectionRun()
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(run.get_all(facts_collector)))
+                   for i in range(3)]
+        for thread in threads:
+            thread.start()
+        release.set()
+        for thread in threads:
+            thread.join(5)
+        self.assertEqual([{"a": "1"}] * 3, results)
+        self.assertEqual(1, facts_collector.get_all.call_count)
+
+
+class CachedCollector(collector.FactsCollector):
+    cache_ttl = 60
+
+    def __init__(self, *args, **kwargs):
+        super(CachedCollector, self).__init__(*args, **kwargs)
+        self.calls = 0
+        self.fingerprint = ['boot-1']
+
+    def cache_fingerprint(self):
+        return list(self.fingerprint)
+
+    def get_all(self):
+        self.calls += 1
+        return {"calls": self.calls}
+
+
+class FactsCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.cache = collector.FactsCache()
+        self.facts_collector = CachedCollector(arch="x86_64")
+
+    def _collect(self, refresh=False):
+        run = collector.CollectionRun(cache=self.cache, refresh=refresh)
+        return run.get_all(self.facts_collector)
+
+    def test_served_from_cache(self):
+        self.assertEqual({"calls": 1}, self._collect())
+        self.assertEqual({"calls": 1}, self._collect())
+        self.assertEqual(1, self.facts_collector.calls)
+
+    def test_refresh_bypasses_cache(self):
+        self._collect()
+        self.assertEqual({"calls": 2}, self._collect(refresh=True))
+        # and the refreshed facts are what is cached from now on
+        self.assertEqual({"calls": 2}, self._collect())
+
+    def test_fingerprint_change_invalidates(self):
+        self._collect()
+        self.facts_collector.fingerprint = ['boot-2']
+        self.assertEqual({"calls": 2}, self._collect())
+
+    @mock.patch('rhsmlib.facts.collector.time.time')
+    def test_ttl_expires(self, mock_time):
+        mock_time.return_value = 1000.0
+        self._collect()
+        mock_time.return_value = 1059.0
+        self.assertEqual({"calls": 1}, self._collect())
+        mock_time.return_value = 1060.0
+        self.assertEqual({"calls": 2}, self._collect())
+
+    def test_no_ttl_not_cached(self):
+        facts_collector = collector.FactsCollector(arch="x86_64")
+        facts_collector.get_all = mock.Mock(return_value={"a": "1"})
+        for i in range(2):
+            collector.CollectionRun(cache=self.cache).get_all(facts_collector)
+        self.assertEqual(2, facts_collector.get_all.call_count)
+
+    def test_cached_facts_are_copies(self):
+        self._collect()["calls"] = 42
+        self.assertEqual({"calls": 1}, self._collect())
+
+    def test_custom_facts_file_change_invalidates(self):
+        facts_dir = tempfile.mkdtemp()
+        try:
+            facts_collector = custom.CustomFactsCollector(path_and_globs=[(facts_dir, '*.facts')])
+            fingerprint = facts_collector.cache_fingerprint()
+            with open(os.path.join(facts_dir, 'my.facts'), 'w') as facts_file:
+                facts_file.write('{"my.fact": "1"}')
+            self.assertNotEqual(fingerprint, facts_collector.cache_fingerprint())
+        finally:
+            shutil.rmtree(facts_dir)
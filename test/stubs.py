@@ -19,17 +19,20 @@ from datetime import datetime, timedelta
 import mock
 import random
 import tempfile
+import time
 
 from rhsm import config
 from subscription_manager.cert_sorter import CertSorter
 from subscription_manager.cache import EntitlementStatusCache, ProductStatusCache, \
-        OverrideStatusCache, ProfileManager, InstalledProductsManager, ReleaseStatusCache
+        EntitlementSerialsCache, OverrideStatusCache, ProfileManager, InstalledProductsManager, ReleaseStatusCache, \
+        PoolCatalogCache
 from subscription_manager.facts import Facts
 from subscription_manager.lock import ActionLock
 from rhsm.certificate import GMT
 from subscription_manager.gui.utils import AsyncWidgetUpdater, handle_gui_exception
 from rhsm.certificate2 import Version
-from subscription_manager.certdirectory import EntitlementDirectory, ProductDirectory
+from subscription_manager.certdirectory import CertificateIndex, EntitlementDirectory, \
+        ProductDirectory
 
 from rhsm.certificate import parse_tags
 from rhsm.certificate2 import EntitlementCertificate, ProductCertificate, \
@@ -310,6 +313,10 @@ class StubCertificateDirectory(EntitlementDirectory):
         self.list_called = True
         return self.certs
 
+    def _get_index(self):
+        # tests modify self.certs directly, never keep a stale index
+        return CertificateIndex(self.list())
+
     def _check_key(self, cert):
         """
         Fake filesystem access here so we don't try to read real keys.
@@ -443,6 +450,12 @@ class StubUEP(object):
     def updatePackageProfile(self, uuid, pkg_dicts):
         pass
 
+    def updatePackageProfileDelta(self, uuid, added, removed):
+        pass
+
+    def updateConsumerFactsDelta(self, uuid, changed, removed):
+        pass
+
     def getProduct(self):
         return {}
 
@@ -485,9 +498,15 @@ class StubUEP(object):
     def getCertificateSerials(self, consumer):
         return []
 
+    def getCertificateSerialsIfChanged(self, consumer, validators=None):
+        return self.getCertificateSerials(consumer), {}
+
     def getCompliance(self, uuid, on_data=None):
         return {}
 
+    def getComplianceIfChanged(self, uuid, validators=None):
+        return self.getCompliance(uuid), {}
+
     def getEntitlementList(self, uuid):
         return [{'id': 'ent1'}, {'id': 'ent2'}]
 
@@ -500,6 +519,9 @@ class StubUEP(object):
     def getContentOverrides(self, uuid):
         return []
 
+    def getContentOverridesIfChanged(self, uuid, validators=None):
+        return self.getContentOverrides(uuid), {}
+
 
 class StubBackend(object):
     def __init__(self, uep=None):
@@ -514,6 +536,9 @@ class StubBackend(object):
     def on_cert_check_timer(self):
         pass
 
+    def wait_for_cert_changes(self, poll_interval):
+        time.sleep(poll_interval)
+
     def update(self):
         pass
 
@@ -536,6 +561,9 @@ class StubFacts(Facts):
     def get_facts(self, refresh=True):
         return self.facts
 
+    def refresh_facts(self):
+        return self.facts
+
     def has_changed(self):
         return self.delta_values
 
@@ -645,6 +673,31 @@ class StubEntitlementStatusCache(EntitlementStatusCache):
         self.server_status = None
 
 
+class StubEntitlementSerialsCache(EntitlementSerialsCache):
+
+    def write_cache(self):
+        pass
+
+    def delete_cache(self):
+        self.server_status = None
+
+
+class StubPoolCatalogCache(PoolCatalogCache):
+
+    def __init__(self, ttl=0, background_refresh=False):
+        super(StubPoolCatalogCache, self).__init__(ttl, background_refresh)
+        self.catalog = {'owners': {}, 'entries': {}}
+
+    def _read(self):
+        return self.catalog
+
+    def _write(self, catalog):
+        self.catalog = catalog
+
+    def delete_cache(self):
+        self.catalog = {'owners': {}, 'entries': {}}
+
+
 class StubProductStatusCache(ProductStatusCache):
 
     def write_cache(self):
@@ -31,8 +31,8 @@ from fixture import SubManFixture
 
 from rhsm import ourjson as json
 from subscription_manager.cache import ProfileManager, \
-    InstalledProductsManager, EntitlementStatusCache, \
-    PoolTypeCache, ReleaseStatusCache, ContentAccessCache
+    InstalledProductsManager, EntitlementStatusCache, EntitlementSerialsCache, \
+    PoolTypeCache, ReleaseStatusCache, ContentAccessCache, PoolCatalogCache
 
 from rhsm.profile import Package, RPMProfile
 
@@ -128,6 +128,113 @@ class TestProfileManager(unittest.TestCase):
                 FACT_MATCHER)
         self.assertEquals(0, self.profile_mgr.write_cache.call_count)
 
+    def _setup_delta(self, capable=True):
+        cached_pkgs = [
+                Package(name="package1", version="0.9.0", release=1, arch="x86_64"),
+                Package(name="package3", version="3.0.0", release=3, arch="x86_64")]
+        self.profile_mgr._cache_exists = Mock(return_value=True)
+        self.profile_mgr._read_cache = Mock(return_value=self._mock_pkg_profile(cached_pkgs))
+        self.profile_mgr.write_cache = Mock()
+        uep = Mock()
+        uep.has_capability = Mock(return_value=capable)
+        return uep
+
+    def test_update_check_delta(self):
+        uuid = 'FAKEUUID'
+        uep = self._setup_delta()
+
+        self.assertEquals(1, self.profile_mgr.update_check(uep, uuid))
+
+        self.assertEquals(0, uep.updatePackageProfile.call_count)
+        uep.has_capability.assert_called_with('packages_delta')
+        added = [self.current_profile.packages[1].to_dict(),
+                 self.current_profile.packages[0].to_dict()]
+        removed = [Package(name="package3", version="3.0.0", release=3, arch="x86_64").to_dict(),
+                   Package(name="package1", version="0.9.0", release=1, arch="x86_64").to_dict()]
+        uep.updatePackageProfileDelta.assert_called_with(uuid, added, removed)
+        self.assertEquals(1, self.profile_mgr.write_cache.call_count)
+
+    def test_update_check_delta_not_supported(self):
+        uuid = 'FAKEUUID'
+        uep = self._setup_delta(capable=False)
+
+        self.profile_mgr.update_check(uep, uuid)
+
+        self.assertEquals(0, uep.updatePackageProfileDelta.call_count)
+        uep.updatePackageProfile.assert_called_with(uuid, FACT_MATCHER)
+
+    def test_update_check_forced_uploads_full_profile(self):
+        uuid = 'FAKEUUID'
+        uep = self._setup_delta()
+
+        self.profile_mgr.update_check(uep, uuid, force=True)
+
+        self.assertEquals(0, uep.updatePackageProfileDelta.call_count)
+        uep.updatePackageProfile.assert_called_with(uuid, FACT_MATCHER)
+
+    def _setup_fingerprint(self, stored):
+        temp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, temp_dir)
+        fingerprint_file = os.path.join(temp_dir, 'rpmdb_fingerprint.json')
+        if stored is not None:
+            f = open(fingerprint_file, 'w')
+            json.dump(stored, f)
+            f.close()
+        profile_mgr = ProfileManager()
+        profile_mgr.RPMDB_FINGERPRINT_FILE = fingerprint_file
+        profile_mgr._cache_exists = Mock(return_value=True)
+        profile_mgr._read_cache = Mock(return_value=self.current_profile)
+        profile_mgr._get_profile = Mock(return_value=self.current_profile)
+        profile_mgr._get_rpmdb_fingerprint = Mock(
+                return_value=[['Packages', 1000, 1500000000.5, 42]])
+        return profile_mgr
+
+    def test_has_changed_rpmdb_unchanged(self):
+        profile_mgr = self._setup_fingerprint([['Packages', 1000, 1500000000.5, 42]])
+        self.assertFalse(profile_mgr.has_changed())
+        # neither the rpm database nor the cache had to be read
+        self.assertEquals(0, profile_mgr._get_profile.call_count)
+        self.assertEquals(0, profile_mgr._read_cache.call_count)
+
+    def test_has_changed_rpmdb_changed(self):
+        profile_mgr = self._setup_fingerprint([['Packages', 1000, 1400000000.5, 42]])
+        self.assertFalse(profile_mgr.has_changed())
+        self.assertEquals(1, profile_mgr._get_profile.call_count)
+        self.assertEquals(1, profile_mgr._read_cache.call_count)
+
+    def test_has_changed_rpmdb_changed_same_packages(self):
+        profile_mgr = self._setup_fingerprint([['Packages', 1000, 1400000000.5, 42]])
+        self.assertFalse(profile_mgr.has_changed())
+        # the new state of the rpm database is remembered ...
+        self.assertEquals([['Packages', 1000, 1500000000.5, 42]],
+                profile_mgr._read_rpmdb_fingerprint())
+
+        # ... so the next check does not read the packages again
+        next_mgr = self._setup_fingerprint(None)
+        next_mgr.RPMDB_FINGERPRINT_FILE = profile_mgr.RPMDB_FINGERPRINT_FILE
+        self.assertFalse(next_mgr.has_changed())
+        self.assertEquals(0, next_mgr._get_profile.call_count)
+
+    def test_write_cache_stores_rpmdb_fingerprint(self):
+        profile_mgr = self._setup_fingerprint(None)
+        profile_mgr.CACHE_FILE = os.path.join(
+                os.path.dirname(profile_mgr.RPMDB_FINGERPRINT_FILE), 'packages.json')
+        profile_mgr.has_changed()
+        profile_mgr.write_cache()
+
+        self.assertEquals([['Packages', 1000, 1500000000.5, 42]],
+                profile_mgr._read_rpmdb_fingerprint())
+
+    def test_write_cache_removes_stale_rpmdb_fingerprint(self):
+        profile_mgr = self._setup_fingerprint([['Packages', 1000, 1500000000.5, 42]])
+        profile_mgr.CACHE_FILE = os.path.join(
+                os.path.dirname(profile_mgr.RPMDB_FINGERPRINT_FILE), 'packages.json')
+        # a profile we were handed has no fingerprint
+        profile_mgr.current_profile = self.current_profile
+        profile_mgr.write_cache()
+
+        self.assertFalse(os.path.exists(profile_mgr.RPMDB_FINGERPRINT_FILE))
+
     def test_has_changed_no_cache(self):
         self.profile_mgr._cache_exists = Mock(return_value=False)
         self.assertTrue(self.profile_mgr.has_changed())
@@ -183,6 +290,50 @@ class TestProfileManager(unittest.TestCase):
         return mock_profile
 
 
+class TestRPMProfile(unittest.TestCase):
+    def setUp(self):
+        self.pkg1 = Package(name="package1", version="1.0.0", release=1, arch="x86_64")
+        self.pkg2 = Package(name="package2", version="2.0.0", release=2, arch="x86_64")
+        self.pkg2_new = Package(name="package2", version="2.1.0", release=1, arch="x86_64")
+        self.pkg3 = Package(name="package3", version="3.0.0", release=3, arch="x86_64")
+
+    def _profile(self, packages):
+        return TestProfileManager._mock_pkg_profile(packages)
+
+    def test_package_hashable(self):
+        same = Package(name="package1", version="1.0.0", release=1, arch="x86_64")
+        self.assertEquals(self.pkg1, same)
+        self.assertEquals(hash(self.pkg1), hash(same))
+        self.assertEquals(1, len(set([self.pkg1, same])))
+        self.assertTrue(self.pkg1 != self.pkg2)
+
+    def test_eq_ignores_order(self):
+        profile = self._profile([self.pkg1, self.pkg2])
+        self.assertTrue(profile == self._profile([self.pkg2, self.pkg1]))
+        self.assertFalse(profile != self._profile([self.pkg2, self.pkg1]))
+        self.assertFalse(profile == self._profile([self.pkg1, self.pkg3]))
+        self.assertFalse(profile == self._profile([self.pkg1]))
+
+    def test_diff(self):
+        old = self._profile([self.pkg1, self.pkg2])
+        new = self._profile([self.pkg2_new, self.pkg3])
+        added, removed, changed = new.diff(old)
+        self.assertEquals([self.pkg3], added)
+        self.assertEquals([self.pkg1], removed)
+        self.assertEquals([(self.pkg2, self.pkg2_new)], changed)
+
+    def test_diff_multiple_versions(self):
+        # two versions of the same package installed side by side, ie kernels
+        old = self._profile([self.pkg2])
+        new = self._profile([self.pkg2, self.pkg2_new])
+        self.assertEquals(([self.pkg2_new], [], []), new.diff(old))
+        self.assertEquals(([], [self.pkg2_new], []), old.diff(new))
+
+    def test_diff_no_changes(self):
+        old = self._profile([self.pkg1, self.pkg2])
+        self.assertEquals(([], [], []), self._profile([self.pkg2, self.pkg1]).diff(old))
+
+
 class TestInstalledProductsCache(SubManFixture):
     def setUp(self):
         super(TestInstalledProductsCache, self).setUp()
@@ -394,7 +545,7 @@ class TestEntitlementStatusCache(SubManFixture):
     def test_load_from_server(self):
         uep = Mock()
         dummy_status = {"a": "1"}
-        uep.getCompliance = Mock(return_value=dummy_status)
+        uep.getComplianceIfChanged = Mock(return_value=(dummy_status, {}))
 
         self.status_cache.load_status(uep, "SOMEUUID")
 
@@ -403,14 +554,14 @@ class TestEntitlementStatusCache(SubManFixture):
 
     def test_server_no_compliance_call(self):
         uep = Mock()
-        uep.getCompliance = Mock(side_effect=RestlibException("boom"))
+        uep.getComplianceIfChanged = Mock(side_effect=RestlibException("boom"))
         status = self.status_cache.load_status(uep, "SOMEUUID")
         self.assertEquals(None, status)
 
     def test_server_network_error(self):
         dummy_status = {"a": "1"}
         uep = Mock()
-        uep.getCompliance = Mock(side_effect=socket.error("boom"))
+        uep.getComplianceIfChanged = Mock(side_effect=socket.error("boom"))
         self.status_cache._cache_exists = Mock(return_value=True)
         self.status_cache._read_cache = Mock(return_value=dummy_status)
         status = self.status_cache.load_status(uep, "SOMEUUID")
@@ -420,7 +571,7 @@ class TestEntitlementStatusCache(SubManFixture):
     # Extremely unlikely but just in case:
     def test_server_network_error_no_cache(self):
         uep = Mock()
-        uep.getCompliance = Mock(side_effect=socket.error("boom"))
+        uep.getComplianceIfChanged = Mock(side_effect=socket.error("boom"))
         self.status_cache._cache_exists = Mock(return_value=False)
         self.assertEquals(None, self.status_cache.load_status(uep, "SOMEUUID"))
 
@@ -456,9 +607,83 @@ class TestEntitlementStatusCache(SubManFixture):
 
     def test_unauthorized_exception_handled(self):
         uep = Mock()
-        uep.getCompliance = Mock(side_effect=UnauthorizedException(401, "GET"))
+        uep.getComplianceIfChanged = Mock(side_effect=UnauthorizedException(401, "GET"))
         self.assertEquals(None, self.status_cache.load_status(uep, "aaa"))
 
+    def _use_temp_files(self, status_cache):
+        cache_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, cache_dir)
+        status_cache.CACHE_FILE = os.path.join(cache_dir, 'status_cache.json')
+        status_cache.VALIDATORS_FILE = os.path.join(cache_dir, 'status_validators.json')
+        return status_cache
+
+    def _write_json(self, path, data):
+        f = open(path, 'w')
+        json.dump(data, f)
+        f.close()
+
+    def test_not_modified_uses_cache(self):
+        self._use_temp_files(self.status_cache)
+        self._write_json(self.status_cache.CACHE_FILE, {"a": "1"})
+        validators = {'uuid': 'SOMEUUID', 'etag': '"abc"', 'last_modified': None}
+        self._write_json(self.status_cache.VALIDATORS_FILE, validators)
+        uep = Mock()
+        uep.getComplianceIfChanged = Mock(return_value=None)
+
+        status = self.status_cache.load_status(uep, "SOMEUUID")
+
+        self.assertEquals({"a": "1"}, status)
+        self.assertTrue(self.status_cache.not_modified)
+        uep.getComplianceIfChanged.assert_called_once_with("SOMEUUID", validators)
+        self.assertEquals(0, self.status_cache.write_cache.call_count)
+
+    def test_validators_of_other_consumer_ignored(self):
+        self._use_temp_files(self.status_cache)
+        self._write_json(self.status_cache.CACHE_FILE, {"a": "1"})
+        self._write_json(self.status_cache.VALIDATORS_FILE, {'uuid': 'OTHER', 'etag': '"abc"'})
+        uep = Mock()
+        uep.getComplianceIfChanged = Mock(return_value=({"a": "2"}, {}))
+
+        self.assertEquals({"a": "2"}, self.status_cache.load_status(uep, "SOMEUUID"))
+        uep.getComplianceIfChanged.assert_called_once_with("SOMEUUID", None)
+        self.assertFalse(self.status_cache.not_modified)
+
+    def test_not_modified_without_cache_refetches(self):
+        self._use_temp_files(self.status_cache)
+        self.status_cache._read_validators = Mock(return_value={'etag': '"abc"'})
+        uep = Mock()
+        uep.getComplianceIfChanged = Mock(side_effect=[None, ({"a": "2"}, {'etag': '"def"'})])
+
+        self.assertEquals({"a": "2"}, self.status_cache.load_status(uep, "SOMEUUID"))
+        self.assertEquals({}, uep.getComplianceIfChanged.call_args[0][1])
+        self.assertEquals(1, self.status_cache.write_cache.call_count)
+
+    def test_validators_written_with_cache(self):
+        status_cache = self._use_temp_files(EntitlementStatusCache())
+        uep = Mock()
+        uep.getComplianceIfChanged = Mock(return_value=({"a": "1"}, {'etag': '"abc"', 'last_modified': None}))
+        status_cache._sync_with_server(uep, "SOMEUUID")
+        status_cache._write_cache_and_validators()
+
+        fresh_cache = self._use_temp_files(EntitlementStatusCache())
+        fresh_cache.CACHE_FILE = status_cache.CACHE_FILE
+        fresh_cache.VALIDATORS_FILE = status_cache.VALIDATORS_FILE
+        self.assertEquals('"abc"', fresh_cache._read_validators("SOMEUUID")['etag'])
+
+        status_cache.delete_cache()
+        self.assertFalse(os.path.exists(status_cache.VALIDATORS_FILE))
+        self.assertEquals(None, fresh_cache._read_validators("SOMEUUID"))
+
+    def test_serials_errors_not_hidden(self):
+        serials_cache = EntitlementSerialsCache()
+        serials_cache.write_cache = Mock()
+        uep = Mock()
+        uep.getCertificateSerialsIfChanged = Mock(side_effect=socket.error("boom"))
+        self.assertRaises(socket.error, serials_cache.get_serials, uep, "SOMEUUID")
+
+        uep.getCertificateSerialsIfChanged = Mock(return_value=([{'serial': 1}, {'serial': 2}], {}))
+        self.assertEquals([1, 2], serials_cache.get_serials(uep, "SOMEUUID"))
+
 
 class TestPoolTypeCache(SubManFixture):
     def setUp(self):
@@ -621,3 +846,71 @@ after
         self.mock_uep.getAccessibleContent = Mock(side_effect=RestlibException(404))
         self.cache.check_for_update()
         # getting this far means we did not raise an exception :-)
+
+
+class TestPoolCatalogCache(SubManFixture):
+
+    def setUp(self):
+        super(TestPoolCatalogCache, self).setUp()
+        self.cache_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.cache_dir)
+        patcher = patch.object(PoolCatalogCache, 'CACHE_FILE',
+                os.path.join(self.cache_dir, 'pool_catalog.json'))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.facts_file = os.path.join(self.cache_dir, 'facts.json')
+        patcher = patch.object(PoolCatalogCache, 'CONSUMER_DATA_FILES', [self.facts_file])
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.cache = PoolCatalogCache(ttl=60, background_refresh=False)
+
+    def test_empty(self):
+        self.assertEquals(None, self.cache.get('uuid'))
+        self.assertEquals(None, self.cache.owner('uuid'))
+
+    def test_put_get(self):
+        self.cache.put('uuid', 'owner', [{'id': '1'}], True, '2017-01-01', 'foo*')
+        pools, age = self.cache.get('uuid', True, '2017-01-01', 'foo*')
+        self.assertEquals([{'id': '1'}], pools)
+        self.assertTrue(0 <= age < 60)
+        self.assertEquals('owner', self.cache.owner('uuid'))
+        # other parameters are other queries
+        self.assertEquals(None, self.cache.get('uuid', False, '2017-01-01', 'foo*'))
+        self.assertEquals(None, self.cache.get('uuid', True, None, 'foo*'))
+        self.assertEquals(None, self.cache.get('uuid', True, '2017-01-01', None))
+        self.assertEquals(None, self.cache.get('other', True, '2017-01-01', 'foo*'))
+
+    def test_too_old_not_used(self):
+        self.cache.put('uuid', 'owner', [{'id': '1'}])
+        with patch('time.time', Mock(return_value=time.time() + PoolCatalogCache.MAX_STALE + 1)):
+            self.assertEquals(None, self.cache.get('uuid'))
+
+    def test_owner_change_drops_pools(self):
+        self.cache.put('uuid', 'owner', [{'id': '1'}], True)
+        self.cache.put('uuid', 'other_owner', [{'id': '2'}])
+        self.assertEquals(None, self.cache.get('uuid', True))
+        self.assertEquals([{'id': '2'}], self.cache.get('uuid')[0])
+
+    def test_facts_sent_invalidate(self):
+        self.cache.put('uuid', 'owner', [{'id': '1'}])
+        f = open(self.facts_file, 'w')
+        f.write('{"cpu.cpu_socket(s)": "16"}')
+        f.close()
+        self.assertEquals(None, self.cache.get('uuid'))
+
+        self.cache.put('uuid', 'owner', [{'id': '2'}])
+        self.assertEquals([{'id': '2'}], self.cache.get('uuid')[0])
+
+    def test_delete_cache(self):
+        self.cache.put('uuid', 'owner', [{'id': '1'}])
+        self.cache.delete_cache()
+        self.assertFalse(os.path.exists(PoolCatalogCache.CACHE_FILE))
+        self.assertEquals(None, self.cache.get('uuid'))
+
+    def test_corrupt_cache_ignored(self):
+        f = open(PoolCatalogCache.CACHE_FILE, 'w')
+        f.write('{"entries": ')
+        f.close()
+        self.assertEquals(None, self.cache.get('uuid'))
+        self.cache.put('uuid', 'owner', [{'id': '1'}])
+        self.assertEquals([{'id': '1'}], self.cache.get('uuid')[0])
@@ -24,9 +24,10 @@ from mock import patch, MagicMock
 from shutil import rmtree
 
 from stubs import StubProduct, StubEntitlementCertificate, \
-    StubProductCertificate
+    StubProductCertificate, StubPool
 from subscription_manager.certdirectory import Path, EntitlementDirectory, \
-    ProductDirectory, ProductCertificateDirectory, Directory
+    ProductDirectory, ProductCertificateDirectory, Directory, \
+    DirectoryTransaction, read_generation
 from subscription_manager.repolib import RepoFile
 from subscription_manager.productid import ProductDatabase
 
@@ -116,6 +117,56 @@ class TestEntitlementDirectoryCheckKey(unittest.TestCase):
         self.assertFalse(ret)
 
 
+class TestEntitlementDirectoryIndex(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp(prefix='subscription-manager-unit-tests-tmp')
+        self.addCleanup(rmtree, self.temp_dir)
+        patcher = patch.object(EntitlementDirectory, 'productpath')
+        self.addCleanup(patcher.stop)
+        patcher.start().return_value = self.temp_dir
+
+        self.cert1 = StubEntitlementCertificate("product1", provided_products=["product2"],
+                stacking_id="stack1", pool=StubPool("pool1"))
+        self.cert2 = StubEntitlementCertificate("product3", stacking_id="stack1",
+                pool=StubPool("pool2"))
+        self.cert3 = StubEntitlementCertificate("product2", pool=StubPool("pool1"))
+        self.ent_dir = EntitlementDirectory()
+        self.ent_dir._listing = [self.cert1, self.cert2, self.cert3]
+
+    def test_find(self):
+        self.assertEquals(self.cert2, self.ent_dir.find(self.cert2.serial))
+        self.assertEquals(None, self.ent_dir.find(1))
+
+    def test_find_by_product(self):
+        self.assertEquals(self.cert1, self.ent_dir.find_by_product("product2"))
+        self.assertEquals(None, self.ent_dir.find_by_product("product4"))
+
+    def test_find_all_by_product_includes_stack(self):
+        certs = self.ent_dir.find_all_by_product("product1")
+        self.assertEquals(set([self.cert1, self.cert2]), set(certs))
+
+    def test_list_for_product(self):
+        self.assertEquals([self.cert1, self.cert3], self.ent_dir.list_for_product("product2"))
+        self.assertEquals([], self.ent_dir.list_for_product("product4"))
+
+    def test_list_for_pool_id(self):
+        self.assertEquals([self.cert1, self.cert3], self.ent_dir.list_for_pool_id("pool1"))
+
+    def test_list_serials_for_pool_ids(self):
+        serials = self.ent_dir.list_serials_for_pool_ids(["pool1", "pool2", "pool3"])
+        self.assertEquals({"pool1": [str(self.cert1.serial), str(self.cert3.serial)],
+                           "pool2": [str(self.cert2.serial)],
+                           "pool3": []}, serials)
+
+    def test_refresh_rebuilds_index(self):
+        self.assertEquals([], self.ent_dir.list_for_pool_id("pool3"))
+        cert4 = StubEntitlementCertificate("product4", pool=StubPool("pool3"))
+        self.ent_dir.refresh()
+        self.ent_dir._listing = [cert4]
+        self.assertEquals([cert4], self.ent_dir.list_for_pool_id("pool3"))
+        self.assertEquals([], self.ent_dir.list_for_pool_id("pool1"))
+
+
 class StubPath(Path):
 
     @staticmethod
@@ -409,3 +460,93 @@ class AlsoProductDirectoryTest(unittest.TestCase):
         self.assertEquals(1, len(results))
         resulting_ids = [cert.products[0].id for cert in results]
         self.assertTrue("top" in resulting_ids)
+
+
+class _PemFile(object):
+    def __init__(self, content):
+        self.content = content
+        self.path = None
+
+    def write(self, path):
+        f = open(path, 'w')
+        f.write(self.content)
+        f.close()
+        self.path = path
+
+
+class DirectoryTransactionTest(unittest.TestCase):
+    def setUp(self):
+        self.path = tempfile.mkdtemp(prefix='subscription-manager-unit-tests-tmp')
+
+    def tearDown(self):
+        rmtree(self.path)
+
+    def test_commit(self):
+        transaction = DirectoryTransaction(self.path)
+        cert = _PemFile('cert')
+        transaction.write(cert, '1.pem')
+        transaction.write(_PemFile('key'), '1-key.pem')
+        rogue = MagicMock()
+        transaction.remove(rogue)
+
+        self.assertFalse(os.path.exists(os.path.join(self.path, '1.pem')))
+        self.assertFalse(rogue.delete.called)
+
+        transaction.commit()
+        self.assertEquals(os.path.join(self.path, '1.pem'), cert.path)
+        self.assertEquals('cert', open(cert.path).read())
+        self.assertTrue(rogue.delete.called)
+        self.assertEquals([rogue], transaction.removed)
+        self.assertEquals(2, read_generation(self.path))
+        self.assertEquals(['.generation', '1-key.pem', '1.pem'], sorted(os.listdir(self.path)))
+
+    def test_remove_error(self):
+        transaction = DirectoryTransaction(self.path)
+        rogue = MagicMock()
+        rogue.delete.side_effect = OSError("already gone")
+        transaction.remove(rogue)
+        transaction.commit()
+        self.assertEquals([], transaction.removed)
+        self.assertEquals(rogue, transaction.remove_errors[0][0])
+
+    def test_failed_commit_ends_generation(self):
+        transaction = DirectoryTransaction(self.path)
+        rogue = MagicMock()
+        rogue.delete.side_effect = ValueError("not a certificate")
+        transaction.remove(rogue)
+        self.assertRaises(ValueError, transaction.commit)
+        self.assertEquals(2, read_generation(self.path))
+
+    def test_empty_commit_keeps_generation(self):
+        DirectoryTransaction(self.path).commit()
+        self.assertEquals(0, read_generation(self.path))
+
+    def test_abort(self):
+        transaction = DirectoryTransaction(self.path)
+        transaction.write(_PemFile('cert'), '1.pem')
+        transaction.abort()
+        transaction.commit()
+        self.assertEquals([], os.listdir(self.path))
+
+    @patch('subscription_manager.certdirectory.time.sleep')
+    def test_list_retried_while_committing(self, mock_sleep):
+        cert_dir = ProductCertificateDirectory(path=self.path)
+        with patch('subscription_manager.certdirectory.read_generation') as mock_generation:
+            # odd while a commit is running, then changed during the listing
+            mock_generation.side_effect = [1, 2, 4, 4, 4]
+            with patch.object(ProductCertificateDirectory, '_read_listing') as mock_read:
+                mock_read.return_value = []
+                cert_dir.list()
+        self.assertEquals(3, mock_read.call_count)
+
+    @patch('subscription_manager.certdirectory.time.sleep')
+    def test_list_abandoned_commit(self, mock_sleep):
+        cert_dir = ProductCertificateDirectory(path=self.path)
+        with patch('subscription_manager.certdirectory.read_generation') as mock_generation:
+            # odd, and never changing
+            mock_generation.return_value = 3
+            with patch.object(ProductCertificateDirectory, '_read_listing') as mock_read:
+                mock_read.return_value = []
+                cert_dir.list()
+        self.assertEquals(2, mock_read.call_count)
+        self.assertEquals(1, mock_sleep.call_count)
@@ -14,12 +14,14 @@
 #
 
 from datetime import datetime, timedelta
+import threading
 
 import mock
 import stubs
 
 from rhsm import ourjson as json
 from subscription_manager import action_client
+from subscription_manager import base_action_client
 from subscription_manager import content_action_client
 from subscription_manager import entcertlib
 from subscription_manager import identitycertlib
@@ -107,8 +109,8 @@ class ActionClientTestBase(SubManFixture):
         inj.provide(inj.ENT_DIR, self.stub_ent_dir)
 
         self.mock_uep = mock.Mock()
-        self.mock_uep.getCertificateSerials = mock.Mock(return_value=[{'serial': self.stub_ent1.serial},
-                                                                        {'serial': self.stub_ent2.serial}])
+        self.mock_uep.getCertificateSerialsIfChanged = mock.Mock(return_value=([{'serial': self.stub_ent1.serial},
+                                                                                {'serial': self.stub_ent2.serial}], {}))
         self.mock_uep.getConsumer = mock.Mock(return_value=CONSUMER_DATA)
         self.set_consumer_auth_cp(self.mock_uep)
 
@@ -153,6 +155,12 @@ class TestActionClient(ActionClientTestBase):
         actionclient = action_client.ActionClient()
         actionclient.update()
 
+    def test_repos_wait_for_identity_cert(self):
+        actionclient = action_client.ActionClient()
+        dependencies = actionclient._get_lib_dependencies()
+        self.assertTrue(actionclient.idcertlib in
+                        dependencies[actionclient.content_client])
+
     # see bz #852706
     @mock.patch.object(entcertlib.EntCertActionInvoker, 'update')
     def test_gone_exception(self, mock_update):
@@ -226,8 +234,8 @@ class TestActionClient(ActionClientTestBase):
 
     def test_rogue(self):
         # to mock "rogue" certs we need some local, that are not known to the
-        # server so getCertificateSerials to return nothing
-        self.mock_uep.getCertificateSerials = mock.Mock(return_value=[])
+        # server so getCertificateSerialsIfChanged to return nothing
+        self.mock_uep.getCertificateSerialsIfChanged = mock.Mock(return_value=([], {}))
         self.set_consumer_auth_cp(self.mock_uep)
         actionclient = action_client.ActionClient()
         actionclient.update()
@@ -247,7 +255,7 @@ class TestActionClient(ActionClientTestBase):
                 return_value=self.stub_ent_dir.list())
 
         # we don't want to find replacements, so this forces a delete
-        self.mock_uep.getCertificateSerials = mock.Mock(return_value=[])
+        self.mock_uep.getCertificateSerialsIfChanged = mock.Mock(return_value=([], {}))
         self.set_consumer_auth_cp(self.mock_uep)
 
         actionclient = action_client.ActionClient()
@@ -322,3 +330,93 @@ class TestHealingActionClient(TestActionClient):
             if call[0] == 'exception' and isinstance(call[1][0], TypeError):
                 return
         self.fail("Did not see TypeError in the logged exceptions")
+
+
+class RecordingLib(object):
+    """Lib that records when it runs, optionally waiting for or setting an event."""
+
+    def __init__(self, name, events, wait_for=None, sets=None, error=None):
+        self.name = name
+        self.events = events
+        self.wait_for = wait_for
+        self.sets = sets
+        self.error = error
+
+    def update(self):
+        self.events.append(('start', self.name))
+        if self.wait_for:
+            self.wait_for.wait(5)
+        self.events.append(('end', self.name))
+        if self.sets:
+            self.sets.set()
+        if self.error:
+            raise self.error
+        # serves as its own update report
+        return self
+
+    def print_exceptions(self):
+        pass
+
+
+class DependentActionClient(base_action_client.BaseActionClient):
+    def __init__(self, libs, dependencies):
+        self.libs = libs
+        self.dependencies = dependencies
+        super(DependentActionClient, self).__init__()
+
+    def _get_libset(self):
+        return self.libs
+
+    def _get_lib_dependencies(self):
+        return self.dependencies
+
+
+class TestConcurrentActionClient(SubManFixture):
+
+    def test_reports_in_libset_order(self):
+        events = []
+        release = threading.Event()
+        # second does not need first, so it runs while first waits for it
+        first = RecordingLib('first', events, wait_for=release)
+        second = RecordingLib('second', events, sets=release)
+        third = RecordingLib('third', events)
+
+        client = DependentActionClient([first, second, third], {third: [first]})
+        client.update()
+
+        self.assertEquals([first, second, third], client.update_reports)
+        self.assertTrue(events.index(('end', 'second')) < events.index(('end', 'first')))
+        self.assertTrue(events.index(('end', 'first')) < events.index(('start', 'third')))
+
+    def test_dependencies_only_on_earlier_libs(self):
+        events = []
+        first = RecordingLib('first', events)
+        second = RecordingLib('second', events)
+
+        # a dependency on a later lib can not be honoured and is ignored
+        client = DependentActionClient([first, second], {first: [second]})
+        client.update()
+
+        self.assertEquals([first, second], client.update_reports)
+
+    def test_gone_exception_stops_later_libs(self):
+        events = []
+        first = RecordingLib('first', events,
+                             error=GoneException(410, "bye bye", " 234234"))
+        second = RecordingLib('second', events)
+
+        client = DependentActionClient([first, second], {second: [first]})
+        self.assertRaises(GoneException, client.update)
+        self.assertFalse(('start', 'second') in events)
+
+    @mock.patch('subscription_manager.base_action_client.log')
+    def test_exception_logged(self, mock_log):
+        events = []
+        first = RecordingLib('first', events, error=ExceptionalException())
+        second = RecordingLib('second', events)
+
+        client = DependentActionClient([first, second], {second: [first]})
+        client.update()
+
+        self.assertEquals([None, second], client.update_reports)
+        self.assertTrue(mock_log.exception.called)
@@ -16,6 +16,7 @@
 
 from mock import Mock, patch
 from datetime import timedelta, datetime
+import threading
 
 from stubs import StubEntitlementCertificate, StubProduct, StubEntitlementDirectory
 
@@ -62,6 +63,53 @@ class TestEntCertUpdateReport(fixture.SubManFixture):
         return stub_ent_cert
 
 
+class EntitlementCertFetcherTests(fixture.SubManFixture):
+
+    def _get_certificates(self, uuid, serials=None):
+        if '3' in serials:
+            raise entcertlib.socket.error("boom")
+        return [{'serial': sn} for sn in serials]
+
+    def _fetcher(self, threads):
+        mock_uep = Mock()
+        mock_uep.getCertificates = Mock(side_effect=self._get_certificates)
+        return entcertlib.EntitlementCertFetcher(mock_uep, 'uuid', batch_size=2,
+                                                 threads=threads)
+
+    def test_batches(self):
+        fetcher = self._fetcher(1)
+        self.assertEquals([['1', '2'], ['3', '4'], ['5']], fetcher.batches([1, 2, 3, 4, 5]))
+
+    def test_fetch(self):
+        for threads in (1, 3):
+            fetcher = self._fetcher(threads)
+            bundles = list(fetcher.fetch([1, 2, 4, 5, 6]))
+            self.assertEquals(['1', '2', '4', '5', '6'], sorted(b['serial'] for b in bundles))
+            self.assertEquals(3, fetcher.uep.getCertificates.call_count)
+            self.assertEquals({}, fetcher.failed)
+
+    def test_failed_batch_does_not_stop_others(self):
+        for threads in (1, 3):
+            fetcher = self._fetcher(threads)
+            bundles = list(fetcher.fetch([1, 2, 3, 4, 5]))
+            self.assertEquals(['1', '2', '5'], sorted(b['serial'] for b in bundles))
+            self.assertEquals(['3', '4'], sorted(fetcher.failed.keys()))
+            self.assertTrue(isinstance(fetcher.error, entcertlib.socket.error))
+
+    def test_workers_stop_when_caller_stops(self):
+        fetcher = self._fetcher(2)
+        fetcher.batch_size = 1
+        bundles = fetcher.fetch([1, 2, 4, 5, 6, 7])
+        bundles.next()
+        bundles.close()
+
+        for thread in threading.enumerate():
+            if thread.name.startswith("EntCertFetchThread"):
+                thread.join(5)
+                self.assertFalse(thread.isAlive())
+        self.assertTrue(fetcher.uep.getCertificates.call_count < 6)
+
+
 class UpdateActionTests(fixture.SubManFixture):
 
     @patch("subscription_manager.entcertlib.EntitlementCertBundleInstaller.build_cert")
@@ -83,7 +131,7 @@ class UpdateActionTests(fixture.SubManFixture):
         build_cert_mock.side_effect = mock_build_cert
 
         mock_uep = Mock()
-        mock_uep.getCertificateSerials.return_value = [x.serial for x in cp_certificates]
+        mock_uep.getCertificateSerialsIfChanged.return_value = ([x.serial for x in cp_certificates], {})
         mock_uep.getCertificates.return_value = cp_bundles  # Passed into build_cert(bundle)
         self.set_consumer_auth_cp(mock_uep)
 
@@ -108,7 +156,7 @@ class UpdateActionTests(fixture.SubManFixture):
         ent.delete = Mock(side_effect=OSError("Cert has already been deleted"))
         mock_uep = Mock()
         mock_uep.getCertificates = Mock(return_value=[])
-        mock_uep.getCertificateSerials = Mock(return_value=[])
+        mock_uep.getCertificateSerialsIfChanged = Mock(return_value=([], {}))
 
         self.set_consumer_auth_cp(mock_uep)
         stub_ent_dir = StubEntitlementDirectory([ent])
@@ -125,3 +173,24 @@ class UpdateActionTests(fixture.SubManFixture):
 
         exceptions = update_action.report.exceptions()
         self.assertEquals([], exceptions)
+
+    @patch("subscription_manager.entcertlib.EntitlementCertBundleInstaller.install")
+    def test_install_reports_failed_serials(self, install_mock):
+        def get_certificates(uuid, serials=None):
+            if '2' in serials:
+                raise entcertlib.socket.error("boom")
+            return [{'serial': sn} for sn in serials]
+        mock_uep = Mock()
+        mock_uep.getCertificates = Mock(side_effect=get_certificates)
+        self.set_consumer_auth_cp(mock_uep)
+
+        update_action = TestingUpdateAction()
+        with patch.object(entcertlib.EntitlementCertFetcher, '_conf_int', Mock(return_value=1)):
+            update_action.install([1, 2, 3])
+        self.assertEquals(2, install_mock.call_count)
+        self.assertEquals(['2'], update_action.report.failed)
+        self.assertEquals(1, len(update_action.report.exceptions()))
+
+        mock_uep.getCertificates = Mock(side_effect=entcertlib.socket.error("boom"))
+        update_action = TestingUpdateAction()
+        self.assertRaises(entcertlib.socket.error, update_action.install, [1, 2])
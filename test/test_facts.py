@@ -1,6 +1,6 @@
 import tempfile
 import shutil
-from mock import patch
+from mock import Mock, patch
 
 import fixture
 from subscription_manager import facts
@@ -202,3 +202,45 @@ class TestFacts(fixture.SubManFixture):
 
         self.assertTrue(isinstance(f, dict))
         self.assertEquals(f['net.interface.lo.ipv4_address'], '127.0.0.1')
+
+    def _setup_delta(self, capable=True):
+        test_facts = json.loads(facts_buf)
+        test_facts['cpu.cpu_socket(s)'] = '16'
+        test_facts['new.fact'] = 'new'
+        del test_facts['another']
+        self.f.get_facts = Mock(return_value=test_facts)
+        self.f.write_cache = Mock()
+        uep = Mock()
+        uep.has_capability = Mock(return_value=capable)
+        return uep
+
+    def test_update_check_delta(self):
+        uep = self._setup_delta()
+
+        self.assertEquals(1, self.f.update_check(uep, 'FAKEUUID'))
+
+        uep.has_capability.assert_called_with('facts_delta')
+        self.assertEquals(0, uep.updateConsumer.call_count)
+        uep.updateConsumerFactsDelta.assert_called_with('FAKEUUID',
+                {'cpu.cpu_socket(s)': '16', 'new.fact': 'new'}, ['another'])
+        self.assertEquals(1, self.f.write_cache.call_count)
+        self.assertEquals(1, self.f.upload_stats['delta_uploads'])
+        self.assertTrue(self.f.upload_stats['bytes_saved'] > 0)
+
+    def test_update_check_delta_not_supported(self):
+        uep = self._setup_delta(capable=False)
+
+        self.f.update_check(uep, 'FAKEUUID')
+
+        self.assertEquals(0, uep.updateConsumerFactsDelta.call_count)
+        uep.updateConsumer.assert_called_with('FAKEUUID', facts=self.f.get_facts())
+        self.assertEquals(1, self.f.upload_stats['full_uploads'])
+        self.assertEquals(0, self.f.upload_stats['bytes_saved'])
+
+    def test_update_check_forced_uploads_all_facts(self):
+        uep = self._setup_delta()
+
+        self.f.update_check(uep, 'FAKEUUID', force=True)
+
+        self.assertEquals(0, uep.updateConsumerFactsDelta.call_count)
+        uep.updateConsumer.assert_called_with('FAKEUUID', facts=self.f.get_facts())
@@ -101,3 +101,74 @@ class TestMonitorDirectories(fixture.SubManFixture):
     def tearDown(self):
         if self.temp_dir:
             shutil.rmtree(self.temp_dir)
+
+
+class TestInotifyMonitorDirectories(fixture.SubManFixture):
+    def setUp(self):
+        super(TestInotifyMonitorDirectories, self).setUp()
+        self.temp_dir = tempfile.mkdtemp(prefix='subscription-manager-unit-tests-tmp-file_monitor')
+        self.dir_changed = mock.Mock()
+        self.changed = mock.Mock()
+        self.md = file_monitor.MonitorDirectory(self.temp_dir, self.dir_changed)
+        self.fm = file_monitor.MonitorDirectories(dir_monitors=[self.md],
+                                                  changed_callback=self.changed)
+        try:
+            file_monitor.Inotify().close()
+        except file_monitor.InotifyUnavailable:
+            self.skipTest("inotify is not available")
+        self.assertTrue(self.fm.start_watching())
+
+    def tearDown(self):
+        self.fm.stop_watching()
+        shutil.rmtree(self.temp_dir)
+
+    def _write(self, name, content):
+        f = open(os.path.join(self.temp_dir, name), 'w')
+        f.write(content)
+        f.close()
+
+    def test_no_events(self):
+        self.fm.process_events()
+        self.assertFalse(self.changed.called)
+
+    def test_rewritten_file(self):
+        self._write('cert.pem', 'one')
+        self.fm.process_events()
+        self.changed.reset_mock()
+        self.dir_changed.reset_mock()
+
+        # the directory mtime does not change, but inotify tells us
+        self._write('cert.pem', 'two')
+        self.fm.process_events()
+        self.assertEquals(1, self.changed.call_count)
+        self.assertEquals(1, self.dir_changed.call_count)
+
+    def test_wait(self):
+        self._write('cert.pem', 'one')
+        # returns at once, as the change is already pending
+        self.fm.wait(60)
+        self.assertEquals(1, self.changed.call_count)
+
+    def test_removed_dir_watched_again(self):
+        shutil.rmtree(self.temp_dir)
+        self.fm.process_events()
+        self.assertEquals(1, self.changed.call_count)
+        self.assertFalse(self.fm.fully_watched())
+
+        os.mkdir(self.temp_dir)
+        self.fm.update()
+        self.assertTrue(self.fm.fully_watched())
+        self._write('cert.pem', 'one')
+        self.fm.process_events()
+        self.assertTrue(self.changed.call_count >= 2)
+
+    @mock.patch('subscription_manager.file_monitor.Inotify',
+                side_effect=file_monitor.InotifyUnavailable())
+    @mock.patch('time.sleep')
+    def test_wait_polls_without_inotify(self, mock_sleep, mock_inotify):
+        fm = file_monitor.MonitorDirectories(dir_monitors=[self.md],
+                                             changed_callback=self.changed)
+        self.assertFalse(fm.start_watching())
+        self._write('cert.pem', 'one')
+        fm.wait(2.0)
+        mock_sleep.assert_called_with(2.0)
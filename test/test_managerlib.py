@@ -19,13 +19,16 @@ except ImportError:
 
 from datetime import datetime, timedelta
 import os
+import shutil
+import tempfile
+import threading
 
 from stubs import StubCertificateDirectory, StubProductCertificate, \
-        StubProduct, StubProductDirectory, StubCertSorter
+        StubProduct, StubProductDirectory, StubCertSorter, StubPoolCatalogCache
 from fixture import SubManFixture
 from subscription_manager.managerlib import merge_pools, PoolFilter, \
         MergedPoolsStackingGroupSorter, MergedPools, \
-        PoolStash, allows_multi_entitlement, valid_quantity
+        PoolStash, PoolQuerySession, allows_multi_entitlement, valid_quantity
 from subscription_manager.injection import provide, \
         PROD_DIR
 from modelhelpers import create_pool
@@ -1036,6 +1039,105 @@ class PoolStashTest(unittest.TestCase):
         self.assertTrue(my_stash.all_pools_size() == 0)
 
 
+class PoolQuerySessionTest(SubManFixture):
+
+    def setUp(self):
+        super(PoolQuerySessionTest, self).setUp()
+        profile_patcher = patch('subscription_manager.managerlib.cache.ProfileManager')
+        self.mock_profile_mgr = profile_patcher.start().return_value
+        self.stub_facts.update_check = Mock()
+
+        def get_pools_list(consumer=None, listAll=False, active_on=None, owner=None,
+                filter_string=None):
+            if listAll:
+                return [{'id': '1'}, {'id': '2'}]
+            return [{'id': '1'}]
+
+        self.uep = Mock()
+        self.uep.getOwner.return_value = {'key': 'owner'}
+        self.uep.getPoolsList = Mock(side_effect=get_pools_list)
+
+    def test_compatible_and_all_pools_share_preflight(self):
+        session = PoolQuerySession(self.uep, 'uuid')
+        compatible, all_pools = session.list_compatible_and_all_pools(active_on='today')
+
+        self.assertEquals([{'id': '1'}], compatible)
+        self.assertEquals([{'id': '1'}, {'id': '2'}], all_pools)
+        self.assertEquals(1, self.stub_facts.update_check.call_count)
+        self.assertEquals(1, self.mock_profile_mgr.update_check.call_count)
+        self.uep.getOwner.assert_called_once_with('uuid')
+        self.uep.getPoolsList.assert_any_call(consumer='uuid', listAll=True,
+                active_on='today', owner='owner', filter_string=None)
+        for phase in ('facts', 'profile', 'owner', 'compatible pools', 'all pools'):
+            self.assertTrue(phase in session.timings)
+
+    def test_query_error_raised(self):
+        self.uep.getPoolsList = Mock(side_effect=Exception('boom'))
+        session = PoolQuerySession(self.uep, 'uuid')
+        self.assertRaises(Exception, session.list_compatible_and_all_pools)
+
+    def test_stash_refresh(self):
+        self.set_consumer_auth_cp(self.uep)
+        stash = PoolStash()
+        stash.refresh(None)
+        self.assertEquals(['1'], list(stash.compatible_pools.keys()))
+        self.assertEquals(['2'], list(stash.incompatible_pools.keys()))
+        self.assertEquals(2, stash.all_pools_size())
+        self.uep.getOwner.assert_called_once_with(stash.identity.uuid)
+
+    def _catalog(self, ttl=60, background_refresh=False):
+        catalog = StubPoolCatalogCache(ttl, background_refresh)
+        catalog.put('uuid', 'owner', [{'id': 'cached'}])
+        return catalog
+
+    def test_fresh_catalog_used(self):
+        session = PoolQuerySession(self.uep, 'uuid', catalog=self._catalog())
+        self.assertEquals([{'id': 'cached'}], session.list_pools())
+        self.assertFalse(self.uep.getPoolsList.called)
+        self.assertFalse(self.uep.getOwner.called)
+
+    def test_changed_facts_invalidate_catalog(self):
+        facts_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, facts_dir)
+        facts_file = os.path.join(facts_dir, 'facts.json')
+        patcher = patch.object(StubPoolCatalogCache, 'CONSUMER_DATA_FILES', [facts_file])
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        def send_changed_facts(uep, uuid):
+            f = open(facts_file, 'w')
+            f.write('{"memory.memtotal": "4096"}')
+            f.close()
+            return 1
+        self.stub_facts.update_check = Mock(side_effect=send_changed_facts)
+
+        session = PoolQuerySession(self.uep, 'uuid', catalog=self._catalog())
+        self.assertEquals([{'id': '1'}], session.list_pools())
+        self.assertEquals(1, self.stub_facts.update_check.call_count)
+        self.assertEquals(1, self.uep.getPoolsList.call_count)
+
+    def test_expired_catalog_refreshed(self):
+        catalog = self._catalog(ttl=0)
+        session = PoolQuerySession(self.uep, 'uuid', catalog=catalog)
+        self.assertEquals([{'id': '1'}], session.list_pools())
+        self.assertEquals([{'id': '1'}], catalog.get('uuid')[0])
+
+    def test_expired_catalog_used_when_cached(self):
+        session = PoolQuerySession(self.uep, 'uuid', catalog=self._catalog(ttl=0),
+                cached=True)
+        self.assertEquals([{'id': 'cached'}], session.list_pools())
+        self.assertFalse(self.uep.getPoolsList.called)
+
+    def test_expired_catalog_refreshed_in_background(self):
+        catalog = self._catalog(ttl=0, background_refresh=True)
+        session = PoolQuerySession(self.uep, 'uuid', catalog=catalog)
+        self.assertEquals([{'id': 'cached'}], session.list_pools())
+        for thread in threading.enumerate():
+            if thread.name == "PoolCatalogRefreshThread":
+                thread.join()
+        self.assertEquals([{'id': '1'}], catalog.get('uuid')[0])
+
+
 class TestAllowsMutliEntitlement(unittest.TestCase):
 
     def test_allows_when_yes(self):
@@ -0,0 +1,130 @@
+#
+# Copyright (c) 2017 Red Hat, Inc.
+#
+# This software is licensed to you under the GNU General Public License,
+# version 2 (GPLv2). There is NO WARRANTY for this software, express or
+# implied, including the implied warranties of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. You should have received a copy of GPLv2
+# along with this software; if not, see
+# http://www.gnu.org/licenses/old-licenses/gpl-2.0.txt.
+#
+# Red Hat trademarks are not licensed under GPLv2. No permission is
+# granted to use or replicate Red Hat trademarks that are incorporated
+# in this software or its documentation.
+#
+try:
+    import unittest2 as unittest
+except ImportError:
+    import unittest
+
+import datetime
+import os
+import shutil
+import tempfile
+import time
+
+import mock
+from dateutil.tz import tzutc
+
+from subscription_manager import repofingerprint
+from subscription_manager.repofingerprint import RepoFingerprint, valid_until
+
+
+class StubConfig(object):
+    def __init__(self, values):
+        self.values = values
+        self.config_file = values['config_file']
+
+    def get(self, section, prop):
+        return self.values[prop]
+
+
+class TestRepoFingerprint(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.ent_dir = self._mkdir('entitlement')
+        self.repo_file = os.path.join(self._mkdir('yum.repos.d'), 'redhat.repo')
+        self.cfg = StubConfig({
+            'config_file': self._write('rhsm.conf', '[rhsm]\n'),
+            'entitlementCertDir': self.ent_dir,
+            'productCertDir': self._mkdir('product'),
+            'consumerCertDir': self._mkdir('consumer'),
+        })
+        patches = [
+            mock.patch.object(repofingerprint, 'REPO_FILE', self.repo_file),
+            mock.patch.object(repofingerprint, 'OUTPUT_FILES', [self.repo_file]),
+            mock.patch.object(repofingerprint, 'OVERRIDES_FILE',
+                              os.path.join(self.tmp, 'content_overrides.json')),
+        ]
+        for patcher in patches:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.path = os.path.join(self.tmp, 'fingerprint.json')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def _mkdir(self, name):
+        path = os.path.join(self.tmp, name)
+        os.mkdir(path)
+        return path
+
+    def _write(self, name, content):
+        path = os.path.join(self.tmp, name)
+        f = open(path, 'w')
+        f.write(content)
+        f.close()
+        return path
+
+    def _fingerprint(self, releasever='7Server'):
+        return RepoFingerprint(self.cfg, releasever=releasever, path=self.path)
+
+    def _update(self, messages=None, valid_until=None):
+        fingerprint = self._fingerprint()
+        fingerprint.begin()
+        self._write('yum.repos.d/redhat.repo', '[repo]\n')
+        fingerprint.save(messages or [], valid_until)
+
+    def test_no_record(self):
+        self.assertEqual(None, self._fingerprint().check())
+
+    def test_unchanged(self):
+        self._update([[2, 'no subscriptions']])
+        self.assertEqual([[2, 'no subscriptions']], self._fingerprint().check())
+
+    def test_entitlement_added(self):
+        self._update()
+        self._write('entitlement/1.pem', 'cert')
+        self.assertEqual(None, self._fingerprint().check())
+
+    def test_repo_file_removed(self):
+        self._update()
+        os.unlink(self.repo_file)
+        self.assertEqual(None, self._fingerprint().check())
+
+    def test_releasever_changed(self):
+        self._update()
+        self.assertEqual(None, self._fingerprint('7.4').check())
+
+    def test_expired(self):
+        self._update(valid_until=time.time() - 1)
+        self.assertEqual(None, self._fingerprint().check())
+
+    def test_not_saved_when_inputs_change_during_update(self):
+        fingerprint = self._fingerprint()
+        fingerprint.begin()
+        self._write('entitlement/1.pem', 'cert')
+        fingerprint.save([])
+        self.assertFalse(os.path.exists(self.path))
+
+    def test_valid_until(self):
+        now = datetime.datetime.now(tzutc())
+        certs = [
+            mock.Mock(start=now - datetime.timedelta(days=10), end=now + datetime.timedelta(days=5)),
+            mock.Mock(start=now + datetime.timedelta(days=1), end=now + datetime.timedelta(days=30)),
+            mock.Mock(start=now - datetime.timedelta(days=30), end=now - datetime.timedelta(days=1)),
+        ]
+        until = valid_until(certs)
+        self.assertTrue(abs(until - (time.time() + 24 * 60 * 60)) < 5)
+        self.assertEqual(None, valid_until(certs[2:]))
@@ -18,7 +18,10 @@ try:
 except ImportError:
     import unittest
 
+import os
 import re
+import shutil
+import tempfile
 import fixture
 
 from iniparse import RawConfigParser, SafeConfigParser
@@ -224,7 +227,7 @@ class RepoUpdateActionTests(fixture.SubManFixture):
         mock_uep = Mock()
         mock_uep.supports_resource = Mock(return_value=False)
         mock_uep.getCertificates = Mock(return_value=[])
-        mock_uep.getCertificateSerials = Mock(return_value=[])
+        mock_uep.getCertificateSerialsIfChanged = Mock(return_value=([], {}))
         mock_uep.getRelease = Mock(return_value={'releaseVer': "dummyrelease"})
 
         self.set_consumer_auth_cp(mock_uep)
@@ -289,6 +292,49 @@ class RepoUpdateActionTests(fixture.SubManFixture):
         self.assertEquals('original', written_repo['gpgcheck'])
         self.assertEquals('new_key', written_repo['gpgkey'])
 
+    def _use_tmp_repo_file(self):
+        tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp)
+        os.makedirs(os.path.join(tmp, 'etc/yum.repos.d'))
+        for patcher in [patch.object(repolib.Path, 'ROOT', tmp),
+                patch.object(repolib.RepoSectionCache, 'CACHE_FILE',
+                    os.path.join(tmp, 'redhat_repo_sections.json')),
+                patch.object(repolib.WrittenOverrideCache, 'CACHE_FILE',
+                    os.path.join(tmp, 'written_overrides.json'))]:
+            patcher.start()
+
+    def test_unchanged_sections_not_rebuilt(self):
+        self._use_tmp_repo_file()
+        RepoUpdateActionCommand().perform()
+
+        with patch.object(Repo, 'from_ent_cert_content') as mock_from_content:
+            with patch.object(RepoFile, 'write') as mock_write:
+                report = RepoUpdateActionCommand().perform()
+        self.assertFalse(mock_from_content.called)
+        self.assertFalse(mock_write.called)
+        self.assertEquals(0, report.updates())
+
+    def test_edited_section_rebuilt(self):
+        self._use_tmp_repo_file()
+        RepoUpdateActionCommand().perform()
+        repo_file = RepoFile()
+        repo_file.read()
+        repo_file.set('c1', 'name', 'edited')
+        repo_file.set('c1', 'enabled', '0')
+        repo_file.write()
+
+        with patch.object(Repo, 'from_ent_cert_content',
+                wraps=Repo.from_ent_cert_content) as mock_from_content:
+            report = RepoUpdateActionCommand().perform()
+        self.assertEquals(1, mock_from_content.call_count)
+        self.assertEquals(1, report.updates())
+
+        repo_file = RepoFile()
+        repo_file.read()
+        # immutable properties are restored, mutable ones are left alone
+        self.assertEquals('c1', repo_file.get('c1', 'name'))
+        self.assertEquals('0', repo_file.get('c1', 'enabled'))
+
     def test_no_gpg_key(self):
 
         update_action = RepoUpdateActionCommand()
@@ -157,11 +157,29 @@ class TestYumProductManager(fixture.SubManFixture):
         mock_package.arch = 'noarch'
 
         self.mock_yb.pkgSack.returnPackages.return_value = [mock_package]
+        self.mock_yb.rpmdb.simplePkgList.return_value = [
+            ('some-cool-package', 'noarch', '0', '1.0', '1')]
 
         pm = yum_product_id.YumProductManager(self.mock_yb)
         active = pm.get_active()
         self.assertEquals(set([mock_package.repoid]), active)
 
+    def test_get_active_reused(self):
+        mock_package = mock.Mock(spec=yum.rpmsack.RPMInstalledPackage)
+        mock_package.repoid = 'this-is-not-a-rh-repo'
+        mock_package.name = 'some-cool-package'
+        mock_package.arch = 'noarch'
+
+        self.mock_yb.pkgSack.returnPackages.return_value = [mock_package]
+        self.mock_yb.rpmdb.simplePkgList.return_value = [
+            ('some-cool-package', 'noarch', '0', '1.0', '1')]
+
+        pm = yum_product_id.YumProductManager(self.mock_yb)
+        self.assertEquals(set([mock_package.repoid]), pm.get_active())
+        self.assertEquals(set([mock_package.repoid]), pm.get_active())
+        self.assertEquals(1, self.mock_yb.rpmdb.simplePkgList.call_count)
+        self.assertEquals(1, self.mock_yb.pkgSack.returnPackages.call_count)
+
     def test_get_active_without_active_packages(self):
         mock_package = mock.Mock(spec=yum.rpmsack.RPMInstalledPackage)
         mock_package.repoid = 'this-is-not-a-rh-repo'
@@ -171,7 +189,9 @@ class TestYumProductManager(fixture.SubManFixture):
         self.mock_yb.pkgSack.returnPackages.return_value = [mock_package]
 
         # No packages in the enabled repo 'this-is-not-a-rh-repo' are installed.
-        self.mock_yb.rpmdb.searchNevra.return_value = False
+        self.mock_yb.rpmdb.simplePkgList.return_value = [
+            ('some-other-package', 'noarch', '0', '1.0', '1'),
+            ('some-cool-package', 'x86_64', '0', '1.0', '1')]
 
         pm = yum_product_id.YumProductManager(self.mock_yb)
         active = pm.get_active()
@@ -185,6 +205,8 @@ class TestYumProductManager(fixture.SubManFixture):
         mock_package.arch = 'noarch'
 
         self.mock_yb.pkgSack.returnPackages.return_value = [mock_package]
+        self.mock_yb.rpmdb.simplePkgList.return_value = [
+            ('some-cool-package', 'noarch', '0', '1.0', '1')]
 
         pm = yum_product_id.YumProductManager(self.mock_yb)
         active = pm.get_active()